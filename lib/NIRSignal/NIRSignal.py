@@ -2,21 +2,24 @@
 # Created by Weiwei Jiang on 20201105. 
 # 
 
+import threading
 import numpy as np
-from scipy.signal import savgol_filter, detrend, decimate, resample_poly
+from collections import OrderedDict
 
 # Utilities.
-def get_argmax(data, *, tol):
-    """ Find the index of final occurance of max value """
-    idx_max = 0
-    max_value = data[0]
-    for idx, item in enumerate(data):
-        
-        if (data[idx] >= max_value) or (max_value - data[idx] < tol):
-            idx_max = idx
-            max_value = data[idx]
-            
-    return idx_max
+def get_argmax(data, *, tol, axis=-1):
+    """ Find the index of final occurance of max value, values within tol of the running max count as max.
+        N-D data is processed along axis, vectorized over the other axes.
+    """
+    data = np.moveaxis(np.asarray(data), axis, -1)
+    idx_max = np.zeros(data.shape[:-1], dtype=int)
+    max_value = np.array(data[..., 0])
+    for idx in range(data.shape[-1]):
+        update = (data[..., idx] >= max_value) | (max_value - data[..., idx] < tol)
+        idx_max = np.where(update, idx, idx_max)
+        max_value = np.where(update, data[..., idx], max_value)
+
+    return idx_max if idx_max.ndim > 0 else int(idx_max)
 
 def normalize_array(input_arr, revert=True, low_percentile=None, high_percentile=None):
     """ Robust normalization of an array. """
@@ -46,52 +49,40 @@ def normalize_array(input_arr, revert=True, low_percentile=None, high_percentile
     
     return arr_normalized
 
-def invalid_to_nearest(signal, copy=True):
-    """ Repleace invalid values (nan/inf) to nearest valid values. """
-    # Init.
-    idx_left_valid = None
-    idx_right_valid = None
-    normal_state = np.isfinite(signal[0])
-    
-    if copy:
-        new_signal = np.copy(signal)
-    else:
-        new_signal = signal
-    
-    for idx, s in enumerate(signal):
-        # Looking for nan/inf.
-        if normal_state & (~np.isfinite(s)):
-            # Nan segment starts.
-            normal_state = False
-            idx_left_valid = idx - 1
-        elif (~normal_state) & np.isfinite(s):
-            # Nan segment ends.
-            normal_state = True
-            idx_right_valid = idx
-            
-            # Fill-in non-valid segment.
-            if idx_left_valid is None:
-                # Head-nan process.
-                new_signal[:idx_right_valid] = signal[idx_right_valid]
-            else:
-                # Find mid-point.
-                idx_mid = int(np.ceil((idx_right_valid + idx_left_valid) / 2))
-                
-                # Fill-in, mid-point = right_valid
-                new_signal[idx_left_valid+1:idx_mid] = signal[idx_left_valid]
-                new_signal[idx_mid:idx_right_valid] = signal[idx_right_valid]
-            
-    # Tail process. 
-    if not normal_state:
-        new_signal[idx_left_valid+1:] = signal[idx_left_valid]
-    
+def invalid_to_nearest(signal, copy=True, axis=-1):
+    """ Repleace invalid values (nan/inf) to nearest valid values, ties go to the right.
+        N-D signals are processed along axis in one pass, all-invalid signals are left as they are.
+    """
+    signal = np.asarray(signal)
+    new_signal = np.copy(signal) if copy else signal
+    valid = np.isfinite(signal)
+    if valid.all():
+        return new_signal
+
+    # Indexes of the previous and the next valid values, -1 / n if none.
+    n = signal.shape[axis]
+    shape = [1] * signal.ndim
+    shape[axis] = n
+    idx = np.arange(n).reshape(shape)
+    idx_left = np.maximum.accumulate(np.where(valid, idx, -1), axis=axis)
+    idx_right = np.flip(np.minimum.accumulate(np.flip(np.where(valid, idx, n), axis=axis), axis=axis), axis=axis)
+
+    # Nearest valid index, mid-point = right valid, head / tail take the only side.
+    idx_mid = np.ceil((idx_left + idx_right) / 2)
+    idx_nearest = np.where((idx < idx_mid) & (idx_left >= 0), idx_left, idx_right)
+    idx_nearest = np.where(idx_right >= n, idx_left, idx_nearest)
+
+    fill = ~valid & (idx_nearest >= 0) & (idx_nearest < n)
+    nearest = np.take_along_axis(signal, np.clip(idx_nearest, 0, n - 1), axis=axis)
+    new_signal[fill] = nearest[fill]
+
     return new_signal
 
 
-def moving_average(signal, N):
-    from scipy.ndimage.filters import uniform_filter1d
+def moving_average(signal, N, axis=-1):
     """ Moving average, nearest-padding, left-and-right. """
-    return uniform_filter1d(signal, size=N, mode="reflect")
+    from scipy.ndimage import uniform_filter1d
+    return uniform_filter1d(signal, size=N, axis=axis, mode="reflect")
     
     
 def estimate_snr(received, signal=None, N=20):
@@ -133,32 +124,109 @@ def process_signal(wavelength_list, raw_intensity, raw_reference, reference_spec
                    selected_indexes=None, savgol_window=11, savgol_polyorder=3,
                    moving_average_window=11, decimate_factor=8, absorbance_mode=True):
     """Processing NIRS spectra. """
-    
-    # Convert to numpy arrays.
-    raw_intensity = np.array(raw_intensity)
-    raw_reference = np.array(raw_reference)
-    reference_spectrum = np.array(reference_spectrum)
-    
-    # Remove low SNR wavelengths.
-    wavelength_list_processed = wavelength_list
-    if selected_indexes is not None:
-        wavelength_list_processed = wavelength_list[selected_indexes]
-        raw_intensity = raw_intensity[selected_indexes]
-        raw_reference = raw_reference[selected_indexes]
-        reference_spectrum = reference_spectrum[selected_indexes]
-    
-    # Pre-smoothing.
-    processed = savgol_filter(raw_intensity, window_length=savgol_window, polyorder=savgol_polyorder)
+    return process_signals(wavelength_list, raw_intensity, raw_reference, reference_spectrum,
+                           selected_indexes=selected_indexes, savgol_window=savgol_window,
+                           savgol_polyorder=savgol_polyorder, moving_average_window=moving_average_window,
+                           decimate_factor=decimate_factor, absorbance_mode=absorbance_mode)
 
-    # Convert to absorbance.
-    if absorbance_mode:
-        processed = -np.log10(processed / raw_reference) - reference_spectrum
 
-        # Fill-in non-valid values.
-        processed = invalid_to_nearest(processed)
+def process_signals(wavelength_list, raw_intensity, raw_reference, reference_spectrum=None, *,
+                    selected_indexes=None, savgol_window=11, savgol_polyorder=3,
+                    moving_average_window=11, decimate_factor=8, absorbance_mode=True):
+    """Processing a batch of NIRS spectra, (..., n_wavelengths) arrays, with a cached processing plan.
+       Returns the processed wavelength list and spectra of shape (..., n_processed).
+    """
+    plan = get_processing_plan(wavelength_list, reference_spectrum, selected_indexes=selected_indexes,
+                               savgol_window=savgol_window, savgol_polyorder=savgol_polyorder,
+                               moving_average_window=moving_average_window, decimate_factor=decimate_factor,
+                               absorbance_mode=absorbance_mode)
 
-    # Moving average and decimal.
-    processed = moving_average(processed, N=moving_average_window)
-    processed = processed[::decimate_factor]
-    
-    return np.array(wavelength_list_processed[::decimate_factor]), np.array(processed)
\ No newline at end of file
+    return np.array(plan.wavelength), plan.apply(raw_intensity, raw_reference)
+
+
+class ProcessingPlan:
+    """Processing of spectra on a fixed wavelength axis, precomputed once.
+       The linear steps are folded into matrices: selection and Savitzky-Golay smoothing into one,
+       moving average and decimation into another, both in a single matrix product without absorbance.
+    """
+
+    def __init__(self, wavelength_list, reference_spectrum=None, *, selected_indexes=None, savgol_window=11,
+                 savgol_polyorder=3, moving_average_window=11, decimate_factor=8, absorbance_mode=True):
+        wavelength_list = np.asarray(wavelength_list)
+        n_wavelengths = len(wavelength_list)
+        self.absorbance_mode = absorbance_mode
+
+        # Selection of wavelengths, reference entries follow it.
+        if selected_indexes is None:
+            self.selected_indexes = np.arange(n_wavelengths)
+        else:
+            self.selected_indexes = np.arange(n_wavelengths)[selected_indexes]
+        n_selected = len(self.selected_indexes)
+        selection = np.eye(n_wavelengths)[self.selected_indexes]
+
+        self.reference_spectrum = 0.0
+        if (reference_spectrum is not None) and (np.ndim(reference_spectrum) > 0):
+            self.reference_spectrum = np.asarray(reference_spectrum, dtype=float)[self.selected_indexes]
+        elif reference_spectrum is not None:
+            self.reference_spectrum = float(reference_spectrum)
+
+        # Columns are the filter responses of unit impulses. SciPy is only loaded once a plan is built.
+        from scipy.signal import savgol_filter
+        smoothing = savgol_filter(np.eye(n_selected), window_length=savgol_window, polyorder=savgol_polyorder,
+                                  axis=0)
+        averaging = moving_average(np.eye(n_selected), N=moving_average_window, axis=0)[::decimate_factor]
+
+        # Applied from the right: spectra @ matrix.
+        self.pre_matrix = (smoothing @ selection).T
+        self.post_matrix = averaging.T
+        self.full_matrix = None if absorbance_mode else self.pre_matrix @ self.post_matrix
+
+        # Output axis.
+        self.wavelength = wavelength_list[self.selected_indexes][::decimate_factor]
+
+    def wavelength_index(self, target_wavelength):
+        """Index of the processed wavelength closest to the target."""
+        return int(np.nanargmin(np.abs(self.wavelength - target_wavelength)))
+
+    def apply(self, raw_intensity, raw_reference=None):
+        """Process spectra of shape (..., n_wavelengths), raw_reference is needed in absorbance mode."""
+        raw_intensity = np.asarray(raw_intensity, dtype=float)
+        if self.full_matrix is not None:
+            return raw_intensity @ self.full_matrix
+
+        # Convert to absorbance, fill-in non-valid values.
+        processed = raw_intensity @ self.pre_matrix
+        raw_reference = np.asarray(raw_reference, dtype=float)[..., self.selected_indexes]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            processed = -np.log10(processed / raw_reference) - self.reference_spectrum
+        processed = invalid_to_nearest(processed, copy=False)
+
+        return processed @ self.post_matrix
+
+
+# Memoized plans, the least recently used dropped first.
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+
+def get_processing_plan(wavelength_list, reference_spectrum=None, *, max_cached=32, **params):
+    """Processing plan of a wavelength axis and parameters, built once per distinct set."""
+    wavelength_list = np.asarray(wavelength_list, dtype=float)
+    if reference_spectrum is not None:
+        reference_spectrum = np.asarray(reference_spectrum, dtype=float)
+    key = (wavelength_list.tobytes(), None if reference_spectrum is None else reference_spectrum.tobytes(),
+           tuple(sorted((name, tuple(np.ravel(value).tolist()) if np.ndim(value) > 0 else value)
+                        for name, value in params.items())))
+
+    with _plan_cache_lock:
+        if key in _plan_cache:
+            _plan_cache.move_to_end(key)
+            return _plan_cache[key]
+
+    plan = ProcessingPlan(wavelength_list, reference_spectrum, **params)
+    with _plan_cache_lock:
+        _plan_cache[key] = plan
+        while len(_plan_cache) > max_cached:
+            _plan_cache.popitem(last=False)
+
+    return plan
@@ -6,9 +6,18 @@ import os, sys
 sys.path.append(os.path.join(os.path.dirname(__file__), "./"))
 
 import atexit
+import threading
+from collections import namedtuple
+import _NIRScanner
 from _NIRScanner import *
 
 import ctypes
+import numpy as np
+
+
+# Scan metadata without spectra, temperatures and humidity are in degree / percent.
+ScanMetadata = namedtuple("ScanMetadata", ["header_version", "scan_name", "scan_time", "temperature_system",
+                                           "temperature_detector", "humidity", "pga", "valid_length"])
 
 
 class NIRS:
@@ -18,10 +27,18 @@ class NIRS:
         HADAMARD_TYPE = 1
         SLEW_TYPE = 2
 
+    # Prebuilt libraries may predate the raw buffer accessors, get_scan_arrays then parses the string results.
+    has_scan_buffers = hasattr(_NIRScanner, "NIRScanner_getWavelengthBuffer")
+    # Same for scan_exposure / scan_readout, without them only scan() works.
+    has_split_scan = hasattr(_NIRScanner, "NIRScanner_scanExposure")
+
     def __init__(self):
         self.nirs_obj = new_NIRScanner()
         atexit.register(self._cleanup)
 
+        # Device calls release the GIL, keep buffer reads from overlapping a scan.
+        self._lock = threading.RLock()
+
     def _cleanup(self):
         print("Cleanning up NIRS instance.")
         delete_NIRScanner(self.nirs_obj)
@@ -39,7 +56,18 @@ class NIRS:
         return eval(results_str)
 
     def scan(self, num_repeats=1):
-        NIRScanner_scan(self.nirs_obj, False, num_repeats)
+        with self._lock:
+            NIRScanner_scan(self.nirs_obj, False, num_repeats)
+
+    def scan_exposure(self, num_repeats=1):
+        """First half of scan(), returns once the exposure is done, the sample may then be moved."""
+        with self._lock:
+            return NIRScanner_scanExposure(self.nirs_obj, num_repeats)
+
+    def scan_readout(self):
+        """Second half of scan(), transfer and interpret the data of the last exposure."""
+        with self._lock:
+            return NIRScanner_scanReadout(self.nirs_obj)
 
     def get_scan_results(self):
         results_dict = {}
@@ -76,6 +104,52 @@ class NIRS:
 
         return results_dict
 
+    def get_scan_metadata(self):
+        results_dict = {}
+        for item in NIRScanner_getScanMetadata(self.nirs_obj).split("\n"):
+            keyvalue = item.split(":")
+            if len(keyvalue) == 2:
+                results_dict[keyvalue[0]] = keyvalue[1]
+
+        return ScanMetadata(
+            header_version=int(results_dict["header_version"]),
+            scan_name=results_dict["scan_name"],
+            scan_time=results_dict["scan_time"],
+            temperature_system=int(results_dict["temperature_system"]) / 100.0,
+            temperature_detector=int(results_dict["temperature_detector"]) / 100.0,
+            humidity=int(results_dict["humidity"]) / 100.0,
+            pga=int(results_dict["pga"]),
+            valid_length=int(results_dict["valid_length"]))
+
+    def get_scan_arrays(self, copy=True):
+        """Get wavelength (float64), intensity and reference (int32) arrays and metadata of the last scan.
+           Arrays are read directly from the scanner buffers. With copy=False they are read-only views
+           which are overwritten by the next scan.
+        """
+        if not self.has_scan_buffers:
+            results = self.get_scan_results()
+            metadata = ScanMetadata(
+                header_version=int(results["header_version"]),
+                scan_name=results["scan_name"],
+                scan_time=results["scan_time"],
+                temperature_system=results["temperature_system"],
+                temperature_detector=results["temperature_detector"],
+                humidity=results["humidity"],
+                pga=results["pga"],
+                valid_length=results["valid_length"])
+            return (np.asarray(results["wavelength"], dtype=np.float64),
+                    np.asarray(results["intensity"], dtype=np.intc),
+                    np.asarray(results["reference"], dtype=np.intc), metadata)
+
+        with self._lock:
+            wavelength = np.frombuffer(NIRScanner_getWavelengthBuffer(self.nirs_obj), dtype=np.float64)
+            intensity = np.frombuffer(NIRScanner_getIntensityBuffer(self.nirs_obj), dtype=np.intc)
+            reference = np.frombuffer(NIRScanner_getReferenceBuffer(self.nirs_obj), dtype=np.intc)
+            if copy:
+                wavelength, intensity, reference = np.copy(wavelength), np.copy(intensity), np.copy(reference)
+
+            return wavelength, intensity, reference, self.get_scan_metadata()
+
     def display_version(self):
         return NIRScanner_readVersion(self.nirs_obj)
 
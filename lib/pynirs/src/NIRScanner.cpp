@@ -1,5 +1,8 @@
 #include "NIRScanner.h"
 #include "dlpspec.h"
+extern "C" {
+#include "dlpspec_helper.h"
+}
 
 using namespace std;
 
@@ -38,8 +41,10 @@ NIRScanner::NIRScanner(uScanConfig *pConfig) {
         std::cout << "EVM FetchRefCalMatrix failed." << std::endl;
     }
 
-    // Get reference data pointer.
+    // Get reference data pointer, the reference is interpreted with the first scan.
     this->pRefDataBlob = this->mEvm.GetRefCalDataBlob();
+    this->pRefCalMatrixBlob = nullptr;
+    this->mRefCacheValid = false;
 
     // Apply configuration.
     this->configEVM();
@@ -60,6 +65,8 @@ int NIRScanner::readVersion()
  *
  */
 {
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
     char versionStr[255];
     unsigned int tiva_sw_ver;
     unsigned int dlpc_sw_ver;
@@ -166,6 +173,8 @@ void NIRScanner::resetErrorStatus()
 * Reset device's error status.
 */
 {
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
     int result = NNO_ResetErrorStatus();
     if (result == FAIL) {
         printf("ERROR: Failed to reset error status.");
@@ -178,9 +187,12 @@ void NIRScanner::configEVM(uScanConfig *pConfig)
  * Config NIRScan Nano. If pConfig is not provided, using the config stored in the instance..
 */
 {
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
     if (pConfig != nullptr) {
         this->mConfig = *pConfig;
     }
+    this->mRefCacheValid = false;
 
     int numpat = this->mEvm.ApplyScanCfgtoDevice(&this->mConfig);
     if (numpat != mConfig.scanCfg.num_patterns) {
@@ -198,6 +210,8 @@ void NIRScanner::setConfig(uint16_t scanConfigIndex,  // < Unique ID per spectro
                            uint16_t wavelength_end_nm, // Maximum wavelength to end the scan at, in nm.
                            uint8_t width_px // Pixel width of the patterns. Increasing this will increase SNR, but reduce resolution.
                            ) {
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
     this->mConfig.scanCfg.scanConfigIndex = scanConfigIndex;
     this->mConfig.scanCfg.scan_type = scan_type;
     this->mConfig.scanCfg.num_patterns = num_patterns;
@@ -216,6 +230,8 @@ void NIRScanner::setPGAGain(int32_t newValue)
 *
 */
 {
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
     int result;
     int pga_val = NNO_GetPGAGain();
     this->mPrevPGAGain = pga_val;
@@ -239,6 +255,8 @@ void NIRScanner::setLampOnOff(int32_t newValue)
 * @param newValue - I - if -1 then always off, if 0 then on when scanning, if 1 then always on. 
 */
 {
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
     // Sanity check.
     if(newValue > 1 || newValue < -1) {
         // Do nothing. 
@@ -333,7 +351,23 @@ int NIRScanner::_performScanReadData(bool storeInSD, uint16 numRepeats, void *pD
  *
  */
 {
-    int size;
+    if (this->_performScan(storeInSD, numRepeats) != PASS) {
+        *pBytesRead = 0;
+        return FAIL;
+    }
+
+    return this->_readScanData(pData, pBytesRead);
+}
+
+
+int NIRScanner::_performScan(bool storeInSD, uint16 numRepeats)
+/*
+ * This function asks the Nano to perform the scan and waits for completion, data stays on the device.
+ * @param storeInSD - I - a boolean to indicate if the current scan is to be stored in SD card
+ * @param numRepeats - I - an integer indicating the number of times the scan should repeat in Nano
+ *
+ */
+{
     int scanTimeOut;
     time_t timeScanEnd;
     time_t timeScanStart;
@@ -361,7 +395,6 @@ int NIRScanner::_performScanReadData(bool storeInSD, uint16 numRepeats, void *pD
             }
             timeScanEnd = time(0);
             if ((timeScanEnd - timeScanStart) >= scanTimeOut) {
-                *pBytesRead = 0;
                 std::cout << "Scan time out with " << timeScanEnd - timeScanStart << std::endl;
                 return FAIL;
             }
@@ -377,6 +410,20 @@ int NIRScanner::_performScanReadData(bool storeInSD, uint16 numRepeats, void *pD
     lastScanTimeMS = timeScanEnd - timeScanStart;
     std::cout << "Scan time was " << lastScanTimeMS << "ms" << std::endl;
 
+    return PASS;
+}
+
+
+int NIRScanner::_readScanData(void *pData, int *pBytesRead)
+/*
+ * This function reads back the ScanData of the last scan from the Nano
+ * @param pData - O - The scanData is readback from Nano in this variable
+ * @param pBytesRead - O - the size of the scnData read
+ *
+ */
+{
+    int size;
+
     *pBytesRead = NNO_GetFileSizeToRead(NNO_FILE_SCAN_DATA);
 
     if ((size = NNO_GetFile((unsigned char *) pData, *pBytesRead)) != *pBytesRead) {
@@ -391,52 +438,68 @@ int NIRScanner::_performScanReadData(bool storeInSD, uint16 numRepeats, void *pD
 
 int NIRScanner::_interpretData(void *pData)
 /**
- * This function takes scan data and reference data as serialzed blobs, interprets them
- * using spectrum library APIs and saves for future use.
+ * This function takes scan data as a serialzed blob, interprets it using spectrum library APIs
+ * and saves it for future use, together with the reference for its configuration.
  *
- * @param pScanDataBlob - I - pointer to scanData blob; if NULL it will continue to use the last set value
- * @param pRefDataBlob - I - pointer to reference data blob; if NULL it will continue to use the last set value
+ * @param pData - I - pointer to scanData blob; if NULL it will continue to use the last set value
  */
 {
-    uScanData *_pRefData;
-    DLPSPEC_ERR_CODE ret_val;
-    void *pCopyBuff = nullptr;
-
     if (pData != nullptr) {
         if (dlpspec_scan_interpret(pData, SCAN_DATA_BLOB_SIZE, &this->mScanResults) != PASS)
             return FAIL;
     }
 
     if (this->pRefDataBlob != nullptr) {
-        pCopyBuff = malloc(SCAN_DATA_BLOB_SIZE);
+        return this->_interpretReference();
+    }
+    return PASS;
+}
 
+
+int NIRScanner::_interpretReference()
+/**
+ * Interprets the reference calibration data for the configuration and PGA gain of the last scan.
+ * The result is kept in mReferenceResults and reused until the serial number, scan configuration or
+ * PGA gain of a scan differs, or the device is configured again.
+ */
+{
+    if (this->mRefCacheValid
+        && (strncmp(this->mRefCacheSerialNumber, this->mScanResults.serial_number, NANO_SER_NUM_LEN) == 0)
+        && (dlpspec_scan_cfg_compare(&this->mRefCacheCfg, &this->mScanResults.cfg) == PASS)
+        && (this->mRefCachePGA == this->mScanResults.pga)) {
+        return PASS;
+    }
+    this->mRefCacheValid = false;
+
+    // The ref-cal matrix of the spectrometer, built once from the serial number of the reference data.
+    if (this->pRefCalMatrixBlob == nullptr) {
+        void *pCopyBuff = malloc(SCAN_DATA_BLOB_SIZE);
         if (pCopyBuff == nullptr) {
             return (ERR_DLPSPEC_INSUFFICIENT_MEM);
         }
 
-        memcpy(pCopyBuff, this->pRefDataBlob, SCAN_DATA_BLOB_SIZE);
-
         // Deserialize
-        ret_val = dlpspec_scan_read_data(pCopyBuff, SCAN_DATA_BLOB_SIZE);
+        memcpy(pCopyBuff, this->pRefDataBlob, SCAN_DATA_BLOB_SIZE);
+        DLPSPEC_ERR_CODE ret_val = dlpspec_scan_read_data(pCopyBuff, SCAN_DATA_BLOB_SIZE);
         if (ret_val < 0) {
             free(pCopyBuff);
-            pCopyBuff = nullptr;
             return ret_val;
         }
 
-        _pRefData = (uScanData *) pCopyBuff;
-        ret_val = dlpspec_scan_interpReference(this->pRefDataBlob, SCAN_DATA_BLOB_SIZE,
-                                               this->mEvm.GetRefCalMatrixBlob(_pRefData->data.serial_number),
-                                               REF_CAL_MATRIX_BLOB_SIZE, &this->mScanResults,
-                                               &this->mReferenceResults);
-        if (PASS != ret_val) {
-            return FAIL;
-        }
-        if (pCopyBuff != nullptr) {
-            free(pCopyBuff);
-            pCopyBuff = nullptr;
-        }
+        this->pRefCalMatrixBlob = this->mEvm.GetRefCalMatrixBlob(((uScanData *) pCopyBuff)->data.serial_number);
+        free(pCopyBuff);
+    }
+
+    if (dlpspec_scan_interpReference(this->pRefDataBlob, SCAN_DATA_BLOB_SIZE, this->pRefCalMatrixBlob,
+                                     REF_CAL_MATRIX_BLOB_SIZE, &this->mScanResults,
+                                     &this->mReferenceResults) != PASS) {
+        return FAIL;
     }
+
+    memcpy(this->mRefCacheSerialNumber, this->mScanResults.serial_number, NANO_SER_NUM_LEN);
+    this->mRefCacheCfg = this->mScanResults.cfg;
+    this->mRefCachePGA = this->mScanResults.pga;
+    this->mRefCacheValid = true;
     return PASS;
 }
 
@@ -450,6 +513,8 @@ string NIRScanner::scanSNR(bool isHadamard)
  * 
  */   
 {
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
     int status;
     if (isHadamard == true) {
         status = NNO_StartHadSNRScan();
@@ -493,6 +558,8 @@ void NIRScanner::scan(bool saveDataFlag, int numRepeats)
  * displays the spectrum - plots the scan data on the GUI
  */
 {
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
     void *pData;
     int scanStatus;
     int fileSize;
@@ -545,12 +612,62 @@ void NIRScanner::scan(bool saveDataFlag, int numRepeats)
 }
 
 
+int NIRScanner::scanExposure(int numRepeats)
+/**
+ * First half of scan(): perform the scan on the device and wait until the exposure is complete.
+ * The sample may be moved afterwards, the data is transferred by scanReadout().
+ */
+{
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
+    if (this->_performScan(NNO_DONT_STORE_SCAN_IN_SD, numRepeats) != PASS) {
+        std::cout << "ERROR: Scan failed." << std::endl;
+        return FAIL;
+    }
+    return PASS;
+}
+
+
+int NIRScanner::scanReadout()
+/**
+ * Second half of scan(): transfer the data of the last exposure from the device and interpret it.
+ */
+{
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
+    void *pData;
+    int fileSize;
+    int retVal;
+
+    pData = (scanData *) malloc(SCAN_DATA_BLOB_SIZE);
+    if (pData == nullptr) {
+        std::cout << "ERROR: Out of memory" << std::endl;
+        return FAIL;
+    }
+
+    retVal = this->_readScanData(pData, &fileSize);
+    if (retVal != PASS) {
+        std::cout << "ERROR: Scan data read failed." << std::endl;
+    } else {
+        retVal = this->_interpretData(pData);
+        if (retVal != PASS) {
+            std::cout << "ERROR: Interpret data failed." << std::endl;
+        }
+    }
+
+    free(pData);
+    return retVal;
+}
+
+
 string NIRScanner::getScanData()
 /**
 * Convert scanning results to string dictionary.
 * This is for Python API.
 */
 {
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
     auto _arrayToString = [](const void *const pArray, int length, char type) -> string {
         string result;
 
@@ -612,12 +729,76 @@ string NIRScanner::getScanData()
     return scanResults;
 }
 
+string NIRScanner::getScanMetadata()
+/**
+* Convert scanning metadata (without spectra) to string dictionary.
+* Spectra are accessed through the raw data buffers.
+* This is for Python API.
+*/
+{
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
+    string metadata;
+    metadata = string("header_version:") + to_string(this->mScanResults.header_version);
+    metadata += string("\nscan_name:") + string(this->mScanResults.scan_name);
+    metadata += string("\nscan_time:")
+                + to_string(this->mScanResults.year + 2000)
+                + to_string(this->mScanResults.month + 1)
+                + to_string(this->mScanResults.day)
+                + to_string(this->mScanResults.hour)
+                + to_string(this->mScanResults.minute)
+                + to_string(this->mScanResults.second);
+    metadata += string("\ntemperature_system:") + to_string(this->mScanResults.system_temp_hundredths);
+    metadata += string("\ntemperature_detector:") + to_string(this->mScanResults.detector_temp_hundredths);
+    metadata += string("\nhumidity:") + to_string(this->mScanResults.humidity_hundredths);
+    metadata += string("\npga:") + to_string(this->mScanResults.pga);
+    metadata += string("\nvalid_length:") + to_string(this->mScanResults.length);
+
+    return metadata;
+}
+
+const double *NIRScanner::getWavelengthData() const
+/**
+* Raw wavelength buffer of the last scan, overwritten by the next scan.
+*/
+{
+    return this->mScanResults.wavelength;
+}
+
+const int *NIRScanner::getIntensityData() const
+/**
+* Raw intensity buffer of the last scan, overwritten by the next scan.
+*/
+{
+    return this->mScanResults.intensity;
+}
+
+const int *NIRScanner::getReferenceData() const
+/**
+* Raw reference intensity buffer of the last scan, overwritten by the next scan.
+*/
+{
+    return this->mReferenceResults.intensity;
+}
+
+int NIRScanner::getScanLength() const
+{
+    return this->mScanResults.length;
+}
+
+int NIRScanner::getReferenceLength() const
+{
+    return this->mReferenceResults.length;
+}
+
 int NIRScanner::setHibernate(bool newValue)
 /**
 * Enable hibernate after inactive if True, otherwise disable. 
 * This is for Python API.
 */
 {
+    std::lock_guard<std::recursive_mutex> lock(this->mMutex);
+
     return NNO_SetHibernate(newValue);
 }
 
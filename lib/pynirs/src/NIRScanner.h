@@ -12,6 +12,7 @@
 #include <ctime>
 #include <chrono>
 #include <thread>
+#include <mutex>
 #include <vector>
 #include <unistd.h>
 #include "API.h"
@@ -31,6 +32,16 @@ private:
     scanResults mScanResults;
     scanResults mReferenceResults;
 
+    // Interpreted reference, valid for the serial number, scan config and PGA gain it was interpreted for.
+    bool mRefCacheValid;
+    char mRefCacheSerialNumber[NANO_SER_NUM_LEN];
+    slewScanConfig mRefCacheCfg;
+    uint8_t mRefCachePGA;
+    void *pRefCalMatrixBlob;
+
+    // Serializes device access, the Python wrapper releases the GIL around calls.
+    std::recursive_mutex mMutex;
+
 public:
     NIRScanner(uScanConfig* pConfig = nullptr);
     ~NIRScanner();
@@ -45,13 +56,24 @@ public:
 
     string scanSNR(bool isHadamard=true);
     void scan(bool saveDataFlag=false, int numRepeats=1);
+    int scanExposure(int numRepeats=1);
+    int scanReadout();
     string getScanData();
+    string getScanMetadata();
+    const double *getWavelengthData() const;
+    const int *getIntensityData() const;
+    const int *getReferenceData() const;
+    int getScanLength() const;
+    int getReferenceLength() const;
     int setHibernate(bool newValue);
 
 
 private:
     int _performScanReadData(bool storeInSD, uint16 numRepeats, void *pData, int *pBytesRead);
+    int _performScan(bool storeInSD, uint16 numRepeats);
+    int _readScanData(void *pData, int *pBytesRead);
     int _interpretData(void *pData);
+    int _interpretReference();
 };
 
 #endif //NIRSCANNER_H
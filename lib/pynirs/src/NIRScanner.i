@@ -1,4 +1,4 @@
-%module NIRScanner
+%module(threads="1") NIRScanner
 %include "std_string.i"
 %include "stdint.i"
 %{
@@ -7,6 +7,23 @@
 
 using namespace std;
 
+// Release the GIL only around blocking device calls, NIRScanner serializes them with its own mutex.
+%nothread;
+%thread NIRScanner::NIRScanner;
+%thread NIRScanner::readVersion;
+%thread NIRScanner::resetErrorStatus;
+%thread NIRScanner::setLampOnOff;
+%thread NIRScanner::setConfig;
+%thread NIRScanner::configEVM;
+%thread NIRScanner::setPGAGain;
+%thread NIRScanner::scanSNR;
+%thread NIRScanner::scan;
+%thread NIRScanner::scanExposure;
+%thread NIRScanner::scanReadout;
+%thread NIRScanner::getScanData;
+%thread NIRScanner::getScanMetadata;
+%thread NIRScanner::setHibernate;
+
 class NIRScanner {
 private:
     EVM mEvm;
@@ -30,7 +47,12 @@ public:
 
     string scanSNR(bool isHadamard=true);
     void scan(bool saveDataFlag=false, int numRepeats=1);
+    int scanExposure(int numRepeats=1);
+    int scanReadout();
     string getScanData();
+    string getScanMetadata();
+    int getScanLength() const;
+    int getReferenceLength() const;
     int setHibernate(bool newValue);
 
 private:
@@ -38,3 +60,19 @@ private:
     int _InterpretData(void *pData);
 };
 
+// Read-only views on the result buffers (buffer protocol, no copy).
+// Views are only valid until the next scan.
+%extend NIRScanner {
+    PyObject *getWavelengthBuffer() {
+        return PyMemoryView_FromMemory((char *) $self->getWavelengthData(),
+                                       $self->getScanLength() * sizeof(double), PyBUF_READ);
+    }
+    PyObject *getIntensityBuffer() {
+        return PyMemoryView_FromMemory((char *) $self->getIntensityData(),
+                                       $self->getScanLength() * sizeof(int), PyBUF_READ);
+    }
+    PyObject *getReferenceBuffer() {
+        return PyMemoryView_FromMemory((char *) $self->getReferenceData(),
+                                       $self->getReferenceLength() * sizeof(int), PyBUF_READ);
+    }
+}
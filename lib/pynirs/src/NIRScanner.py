@@ -135,11 +135,35 @@ class NIRScanner(_object):
     def scan(self, saveDataFlag=False, numRepeats=1):
         return _NIRScanner.NIRScanner_scan(self, saveDataFlag, numRepeats)
 
+    def scanExposure(self, numRepeats=1):
+        return _NIRScanner.NIRScanner_scanExposure(self, numRepeats)
+
+    def scanReadout(self):
+        return _NIRScanner.NIRScanner_scanReadout(self)
+
     def getScanData(self):
         return _NIRScanner.NIRScanner_getScanData(self)
 
+    def getScanMetadata(self):
+        return _NIRScanner.NIRScanner_getScanMetadata(self)
+
+    def getScanLength(self):
+        return _NIRScanner.NIRScanner_getScanLength(self)
+
+    def getReferenceLength(self):
+        return _NIRScanner.NIRScanner_getReferenceLength(self)
+
     def setHibernate(self, newValue):
         return _NIRScanner.NIRScanner_setHibernate(self, newValue)
+
+    def getWavelengthBuffer(self):
+        return _NIRScanner.NIRScanner_getWavelengthBuffer(self)
+
+    def getIntensityBuffer(self):
+        return _NIRScanner.NIRScanner_getIntensityBuffer(self)
+
+    def getReferenceBuffer(self):
+        return _NIRScanner.NIRScanner_getReferenceBuffer(self)
 NIRScanner_swigregister = _NIRScanner.NIRScanner_swigregister
 NIRScanner_swigregister(NIRScanner)
 
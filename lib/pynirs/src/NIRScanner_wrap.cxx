@@ -13,6 +13,8 @@
 #define SWIGPYTHON
 #endif
 
+#define SWIG_PYTHON_THREADS
+
 #define SWIG_PYTHON_DIRECTOR_NO_VTABLE
 
 
@@ -3429,6 +3431,18 @@ SWIG_From_std_string  (const std::string& s)
   return SWIG_FromCharPtrAndSize(s.data(), s.size());
 }
 
+SWIGINTERN PyObject *NIRScanner_getWavelengthBuffer(NIRScanner *self){
+        return PyMemoryView_FromMemory((char *) self->getWavelengthData(),
+                                       self->getScanLength() * sizeof(double), PyBUF_READ);
+    }
+SWIGINTERN PyObject *NIRScanner_getIntensityBuffer(NIRScanner *self){
+        return PyMemoryView_FromMemory((char *) self->getIntensityData(),
+                                       self->getScanLength() * sizeof(int), PyBUF_READ);
+    }
+SWIGINTERN PyObject *NIRScanner_getReferenceBuffer(NIRScanner *self){
+        return PyMemoryView_FromMemory((char *) self->getReferenceData(),
+                                       self->getReferenceLength() * sizeof(int), PyBUF_READ);
+    }
 #ifdef __cplusplus
 extern "C" {
 #endif
@@ -3446,7 +3460,11 @@ SWIGINTERN PyObject *_wrap_new_NIRScanner__SWIG_0(PyObject *SWIGUNUSEDPARM(self)
     SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "new_NIRScanner" "', argument " "1"" of type '" "uScanConfig *""'"); 
   }
   arg1 = reinterpret_cast< uScanConfig * >(argp1);
-  result = (NIRScanner *)new NIRScanner(arg1);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    result = (NIRScanner *)new NIRScanner(arg1);
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_NewPointerObj(SWIG_as_voidptr(result), SWIGTYPE_p_NIRScanner, SWIG_POINTER_NEW |  0 );
   return resultobj;
 fail:
@@ -3459,7 +3477,11 @@ SWIGINTERN PyObject *_wrap_new_NIRScanner__SWIG_1(PyObject *SWIGUNUSEDPARM(self)
   NIRScanner *result = 0 ;
   
   if (!PyArg_ParseTuple(args,(char *)":new_NIRScanner")) SWIG_fail;
-  result = (NIRScanner *)new NIRScanner();
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    result = (NIRScanner *)new NIRScanner();
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_NewPointerObj(SWIG_as_voidptr(result), SWIGTYPE_p_NIRScanner, SWIG_POINTER_NEW |  0 );
   return resultobj;
 fail:
@@ -3536,7 +3558,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_readVersion(PyObject *SWIGUNUSEDPARM(self)
     SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_readVersion" "', argument " "1"" of type '" "NIRScanner *""'"); 
   }
   arg1 = reinterpret_cast< NIRScanner * >(argp1);
-  result = (int)(arg1)->readVersion();
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    result = (int)(arg1)->readVersion();
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_From_int(static_cast< int >(result));
   return resultobj;
 fail:
@@ -3557,7 +3583,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_resetErrorStatus(PyObject *SWIGUNUSEDPARM(
     SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_resetErrorStatus" "', argument " "1"" of type '" "NIRScanner *""'"); 
   }
   arg1 = reinterpret_cast< NIRScanner * >(argp1);
-  (arg1)->resetErrorStatus();
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    (arg1)->resetErrorStatus();
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_Py_Void();
   return resultobj;
 fail:
@@ -3587,7 +3617,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_setLampOnOff(PyObject *SWIGUNUSEDPARM(self
     SWIG_exception_fail(SWIG_ArgError(ecode2), "in method '" "NIRScanner_setLampOnOff" "', argument " "2"" of type '" "int32_t""'");
   } 
   arg2 = static_cast< int32_t >(val2);
-  (arg1)->setLampOnOff(arg2);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    (arg1)->setLampOnOff(arg2);
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_Py_Void();
   return resultobj;
 fail:
@@ -3671,7 +3705,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_setConfig(PyObject *SWIGUNUSEDPARM(self),
     SWIG_exception_fail(SWIG_ArgError(ecode8), "in method '" "NIRScanner_setConfig" "', argument " "8"" of type '" "uint8_t""'");
   } 
   arg8 = static_cast< uint8_t >(val8);
-  (arg1)->setConfig(arg2,arg3,arg4,arg5,arg6,arg7,arg8);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    (arg1)->setConfig(arg2,arg3,arg4,arg5,arg6,arg7,arg8);
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_Py_Void();
   return resultobj;
 fail:
@@ -3701,7 +3739,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_configEVM__SWIG_0(PyObject *SWIGUNUSEDPARM
     SWIG_exception_fail(SWIG_ArgError(res2), "in method '" "NIRScanner_configEVM" "', argument " "2"" of type '" "uScanConfig *""'"); 
   }
   arg2 = reinterpret_cast< uScanConfig * >(argp2);
-  (arg1)->configEVM(arg2);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    (arg1)->configEVM(arg2);
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_Py_Void();
   return resultobj;
 fail:
@@ -3722,7 +3764,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_configEVM__SWIG_1(PyObject *SWIGUNUSEDPARM
     SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_configEVM" "', argument " "1"" of type '" "NIRScanner *""'"); 
   }
   arg1 = reinterpret_cast< NIRScanner * >(argp1);
-  (arg1)->configEVM();
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    (arg1)->configEVM();
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_Py_Void();
   return resultobj;
 fail:
@@ -3797,7 +3843,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_setPGAGain(PyObject *SWIGUNUSEDPARM(self),
     SWIG_exception_fail(SWIG_ArgError(ecode2), "in method '" "NIRScanner_setPGAGain" "', argument " "2"" of type '" "int32_t""'");
   } 
   arg2 = static_cast< int32_t >(val2);
-  (arg1)->setPGAGain(arg2);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    (arg1)->setPGAGain(arg2);
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_Py_Void();
   return resultobj;
 fail:
@@ -3828,7 +3878,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_scanSNR__SWIG_0(PyObject *SWIGUNUSEDPARM(s
     SWIG_exception_fail(SWIG_ArgError(ecode2), "in method '" "NIRScanner_scanSNR" "', argument " "2"" of type '" "bool""'");
   } 
   arg2 = static_cast< bool >(val2);
-  result = (arg1)->scanSNR(arg2);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    result = (arg1)->scanSNR(arg2);
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_From_std_string(static_cast< std::string >(result));
   return resultobj;
 fail:
@@ -3850,7 +3904,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_scanSNR__SWIG_1(PyObject *SWIGUNUSEDPARM(s
     SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_scanSNR" "', argument " "1"" of type '" "NIRScanner *""'"); 
   }
   arg1 = reinterpret_cast< NIRScanner * >(argp1);
-  result = (arg1)->scanSNR();
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    result = (arg1)->scanSNR();
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_From_std_string(static_cast< std::string >(result));
   return resultobj;
 fail:
@@ -3935,7 +3993,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_scan__SWIG_0(PyObject *SWIGUNUSEDPARM(self
     SWIG_exception_fail(SWIG_ArgError(ecode3), "in method '" "NIRScanner_scan" "', argument " "3"" of type '" "int""'");
   } 
   arg3 = static_cast< int >(val3);
-  (arg1)->scan(arg2,arg3);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    (arg1)->scan(arg2,arg3);
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_Py_Void();
   return resultobj;
 fail:
@@ -3965,7 +4027,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_scan__SWIG_1(PyObject *SWIGUNUSEDPARM(self
     SWIG_exception_fail(SWIG_ArgError(ecode2), "in method '" "NIRScanner_scan" "', argument " "2"" of type '" "bool""'");
   } 
   arg2 = static_cast< bool >(val2);
-  (arg1)->scan(arg2);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    (arg1)->scan(arg2);
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_Py_Void();
   return resultobj;
 fail:
@@ -3986,7 +4052,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_scan__SWIG_2(PyObject *SWIGUNUSEDPARM(self
     SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_scan" "', argument " "1"" of type '" "NIRScanner *""'"); 
   }
   arg1 = reinterpret_cast< NIRScanner * >(argp1);
-  (arg1)->scan();
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    (arg1)->scan();
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_Py_Void();
   return resultobj;
 fail:
@@ -4062,6 +4132,139 @@ fail:
 }
 
 
+SWIGINTERN PyObject *_wrap_NIRScanner_scanExposure__SWIG_0(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  NIRScanner *arg1 = (NIRScanner *) 0 ;
+  int arg2 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  int val2 ;
+  int ecode2 = 0 ;
+  PyObject * obj0 = 0 ;
+  PyObject * obj1 = 0 ;
+  int result;
+  
+  if (!PyArg_ParseTuple(args,(char *)"OO:NIRScanner_scanExposure",&obj0,&obj1)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_NIRScanner, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_scanExposure" "', argument " "1"" of type '" "NIRScanner *""'"); 
+  }
+  arg1 = reinterpret_cast< NIRScanner * >(argp1);
+  ecode2 = SWIG_AsVal_int(obj1, &val2);
+  if (!SWIG_IsOK(ecode2)) {
+    SWIG_exception_fail(SWIG_ArgError(ecode2), "in method '" "NIRScanner_scanExposure" "', argument " "2"" of type '" "int""'");
+  } 
+  arg2 = static_cast< int >(val2);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    result = (int)(arg1)->scanExposure(arg2);
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
+  resultobj = SWIG_From_int(static_cast< int >(result));
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
+SWIGINTERN PyObject *_wrap_NIRScanner_scanExposure__SWIG_1(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  NIRScanner *arg1 = (NIRScanner *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  int result;
+  
+  if (!PyArg_ParseTuple(args,(char *)"O:NIRScanner_scanExposure",&obj0)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_NIRScanner, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_scanExposure" "', argument " "1"" of type '" "NIRScanner *""'"); 
+  }
+  arg1 = reinterpret_cast< NIRScanner * >(argp1);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    result = (int)(arg1)->scanExposure();
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
+  resultobj = SWIG_From_int(static_cast< int >(result));
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
+SWIGINTERN PyObject *_wrap_NIRScanner_scanExposure(PyObject *self, PyObject *args) {
+  Py_ssize_t argc;
+  PyObject *argv[3] = {
+    0
+  };
+  Py_ssize_t ii;
+  
+  if (!PyTuple_Check(args)) SWIG_fail;
+  argc = args ? PyObject_Length(args) : 0;
+  for (ii = 0; (ii < 2) && (ii < argc); ii++) {
+    argv[ii] = PyTuple_GET_ITEM(args,ii);
+  }
+  if (argc == 1) {
+    int _v;
+    void *vptr = 0;
+    int res = SWIG_ConvertPtr(argv[0], &vptr, SWIGTYPE_p_NIRScanner, 0);
+    _v = SWIG_CheckState(res);
+    if (_v) {
+      return _wrap_NIRScanner_scanExposure__SWIG_1(self, args);
+    }
+  }
+  if (argc == 2) {
+    int _v;
+    void *vptr = 0;
+    int res = SWIG_ConvertPtr(argv[0], &vptr, SWIGTYPE_p_NIRScanner, 0);
+    _v = SWIG_CheckState(res);
+    if (_v) {
+      {
+        int res = SWIG_AsVal_int(argv[1], NULL);
+        _v = SWIG_CheckState(res);
+      }
+      if (_v) {
+        return _wrap_NIRScanner_scanExposure__SWIG_0(self, args);
+      }
+    }
+  }
+  
+fail:
+  SWIG_SetErrorMsg(PyExc_NotImplementedError,"Wrong number or type of arguments for overloaded function 'NIRScanner_scanExposure'.\n"
+    "  Possible C/C++ prototypes are:\n"
+    "    NIRScanner::scanExposure(int)\n"
+    "    NIRScanner::scanExposure()\n");
+  return 0;
+}
+
+
+SWIGINTERN PyObject *_wrap_NIRScanner_scanReadout(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  NIRScanner *arg1 = (NIRScanner *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  int result;
+  
+  if (!PyArg_ParseTuple(args,(char *)"O:NIRScanner_scanReadout",&obj0)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_NIRScanner, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_scanReadout" "', argument " "1"" of type '" "NIRScanner *""'"); 
+  }
+  arg1 = reinterpret_cast< NIRScanner * >(argp1);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    result = (int)(arg1)->scanReadout();
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
+  resultobj = SWIG_From_int(static_cast< int >(result));
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
 SWIGINTERN PyObject *_wrap_NIRScanner_getScanData(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
   PyObject *resultobj = 0;
   NIRScanner *arg1 = (NIRScanner *) 0 ;
@@ -4076,7 +4279,37 @@ SWIGINTERN PyObject *_wrap_NIRScanner_getScanData(PyObject *SWIGUNUSEDPARM(self)
     SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_getScanData" "', argument " "1"" of type '" "NIRScanner *""'"); 
   }
   arg1 = reinterpret_cast< NIRScanner * >(argp1);
-  result = (arg1)->getScanData();
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    result = (arg1)->getScanData();
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
+  resultobj = SWIG_From_std_string(static_cast< std::string >(result));
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
+SWIGINTERN PyObject *_wrap_NIRScanner_getScanMetadata(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  NIRScanner *arg1 = (NIRScanner *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  std::string result;
+  
+  if (!PyArg_ParseTuple(args,(char *)"O:NIRScanner_getScanMetadata",&obj0)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_NIRScanner, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_getScanMetadata" "', argument " "1"" of type '" "NIRScanner *""'"); 
+  }
+  arg1 = reinterpret_cast< NIRScanner * >(argp1);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    result = (arg1)->getScanMetadata();
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_From_std_string(static_cast< std::string >(result));
   return resultobj;
 fail:
@@ -4084,6 +4317,116 @@ fail:
 }
 
 
+SWIGINTERN PyObject *_wrap_NIRScanner_getScanLength(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  NIRScanner *arg1 = (NIRScanner *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  int result;
+  
+  if (!PyArg_ParseTuple(args,(char *)"O:NIRScanner_getScanLength",&obj0)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_NIRScanner, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_getScanLength" "', argument " "1"" of type '" "NIRScanner *""'"); 
+  }
+  arg1 = reinterpret_cast< NIRScanner * >(argp1);
+  result = (int)((NIRScanner const *)arg1)->getScanLength();
+  resultobj = SWIG_From_int(static_cast< int >(result));
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
+SWIGINTERN PyObject *_wrap_NIRScanner_getReferenceLength(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  NIRScanner *arg1 = (NIRScanner *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  int result;
+  
+  if (!PyArg_ParseTuple(args,(char *)"O:NIRScanner_getReferenceLength",&obj0)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_NIRScanner, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_getReferenceLength" "', argument " "1"" of type '" "NIRScanner *""'"); 
+  }
+  arg1 = reinterpret_cast< NIRScanner * >(argp1);
+  result = (int)((NIRScanner const *)arg1)->getReferenceLength();
+  resultobj = SWIG_From_int(static_cast< int >(result));
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
+SWIGINTERN PyObject *_wrap_NIRScanner_getWavelengthBuffer(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  NIRScanner *arg1 = (NIRScanner *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  PyObject * result;
+  
+  if (!PyArg_ParseTuple(args,(char *)"O:NIRScanner_getWavelengthBuffer",&obj0)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_NIRScanner, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_getWavelengthBuffer" "', argument " "1"" of type '" "NIRScanner *""'"); 
+  }
+  arg1 = reinterpret_cast< NIRScanner * >(argp1);
+  result = (PyObject *)NIRScanner_getWavelengthBuffer(arg1);
+  resultobj = result;
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
+SWIGINTERN PyObject *_wrap_NIRScanner_getIntensityBuffer(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  NIRScanner *arg1 = (NIRScanner *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  PyObject * result;
+  
+  if (!PyArg_ParseTuple(args,(char *)"O:NIRScanner_getIntensityBuffer",&obj0)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_NIRScanner, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_getIntensityBuffer" "', argument " "1"" of type '" "NIRScanner *""'"); 
+  }
+  arg1 = reinterpret_cast< NIRScanner * >(argp1);
+  result = (PyObject *)NIRScanner_getIntensityBuffer(arg1);
+  resultobj = result;
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
+SWIGINTERN PyObject *_wrap_NIRScanner_getReferenceBuffer(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
+  PyObject *resultobj = 0;
+  NIRScanner *arg1 = (NIRScanner *) 0 ;
+  void *argp1 = 0 ;
+  int res1 = 0 ;
+  PyObject * obj0 = 0 ;
+  PyObject * result;
+  
+  if (!PyArg_ParseTuple(args,(char *)"O:NIRScanner_getReferenceBuffer",&obj0)) SWIG_fail;
+  res1 = SWIG_ConvertPtr(obj0, &argp1,SWIGTYPE_p_NIRScanner, 0 |  0 );
+  if (!SWIG_IsOK(res1)) {
+    SWIG_exception_fail(SWIG_ArgError(res1), "in method '" "NIRScanner_getReferenceBuffer" "', argument " "1"" of type '" "NIRScanner *""'"); 
+  }
+  arg1 = reinterpret_cast< NIRScanner * >(argp1);
+  result = (PyObject *)NIRScanner_getReferenceBuffer(arg1);
+  resultobj = result;
+  return resultobj;
+fail:
+  return NULL;
+}
+
+
 SWIGINTERN PyObject *_wrap_NIRScanner_setHibernate(PyObject *SWIGUNUSEDPARM(self), PyObject *args) {
   PyObject *resultobj = 0;
   NIRScanner *arg1 = (NIRScanner *) 0 ;
@@ -4107,7 +4450,11 @@ SWIGINTERN PyObject *_wrap_NIRScanner_setHibernate(PyObject *SWIGUNUSEDPARM(self
     SWIG_exception_fail(SWIG_ArgError(ecode2), "in method '" "NIRScanner_setHibernate" "', argument " "2"" of type '" "bool""'");
   } 
   arg2 = static_cast< bool >(val2);
-  result = (int)(arg1)->setHibernate(arg2);
+  {
+    SWIG_PYTHON_THREAD_BEGIN_ALLOW;
+    result = (int)(arg1)->setHibernate(arg2);
+    SWIG_PYTHON_THREAD_END_ALLOW;
+  }
   resultobj = SWIG_From_int(static_cast< int >(result));
   return resultobj;
 fail:
@@ -4134,8 +4481,16 @@ static PyMethodDef SwigMethods[] = {
 	 { (char *)"NIRScanner_setPGAGain", _wrap_NIRScanner_setPGAGain, METH_VARARGS, NULL},
 	 { (char *)"NIRScanner_scanSNR", _wrap_NIRScanner_scanSNR, METH_VARARGS, NULL},
 	 { (char *)"NIRScanner_scan", _wrap_NIRScanner_scan, METH_VARARGS, NULL},
+	 { (char *)"NIRScanner_scanExposure", _wrap_NIRScanner_scanExposure, METH_VARARGS, NULL},
+	 { (char *)"NIRScanner_scanReadout", _wrap_NIRScanner_scanReadout, METH_VARARGS, NULL},
 	 { (char *)"NIRScanner_getScanData", _wrap_NIRScanner_getScanData, METH_VARARGS, NULL},
+	 { (char *)"NIRScanner_getScanMetadata", _wrap_NIRScanner_getScanMetadata, METH_VARARGS, NULL},
+	 { (char *)"NIRScanner_getScanLength", _wrap_NIRScanner_getScanLength, METH_VARARGS, NULL},
+	 { (char *)"NIRScanner_getReferenceLength", _wrap_NIRScanner_getReferenceLength, METH_VARARGS, NULL},
 	 { (char *)"NIRScanner_setHibernate", _wrap_NIRScanner_setHibernate, METH_VARARGS, NULL},
+	 { (char *)"NIRScanner_getWavelengthBuffer", _wrap_NIRScanner_getWavelengthBuffer, METH_VARARGS, NULL},
+	 { (char *)"NIRScanner_getIntensityBuffer", _wrap_NIRScanner_getIntensityBuffer, METH_VARARGS, NULL},
+	 { (char *)"NIRScanner_getReferenceBuffer", _wrap_NIRScanner_getReferenceBuffer, METH_VARARGS, NULL},
 	 { (char *)"NIRScanner_swigregister", NIRScanner_swigregister, METH_VARARGS, NULL},
 	 { NULL, NULL, 0, NULL }
 };
@@ -4883,6 +5238,9 @@ SWIG_init(void) {
   
   SWIG_InstallConstants(d,swig_const_table);
   
+  
+  /* Initialize threading */
+  SWIG_PYTHON_INITIALIZE_THREADS;
 #if PY_VERSION_HEX >= 0x03000000
   return m;
 #else
@@ -1,131 +1,328 @@
 from django.apps import AppConfig
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseNotModified
 from .utils import NIRSImage
+from .simulation import SimulatedNIRS, FakeGrbl
+from .render import paint_image, set_plotter_headers, image_tag
+from .events import EventBroker
+from .grbl import GrblConnection, PlotterState
+from .scanner import ScannerWorker
+from .shared import SharedState
 
 # Import NIRS library.
-from nirs_plotter_server.settings import BASE_DIR
+from nirs_plotter_server.settings import BASE_DIR, NIRS_SCANNER_BACKEND, NIRS_PLOTTER_BACKEND, \
+    NIRS_SIMULATED_SCANNER, NIRS_SIMULATED_PLOTTER, NIRS_SESSION_DIR, NIRS_PLOTTER_STATUS_INTERVAL_S, \
+    NIRS_PLOTTER_READY_TIMEOUT_S, NIRS_SIGNAL_PROCESSING, NIRS_PIXEL_MODEL, NIRS_HARDWARE_SOCKET, \
+    NIRS_SHARED_MEMORY_NAME
 
 import io
 import os
 import sys
 sys.path.append(os.path.join(BASE_DIR, "../lib"))
-from pynirs.NIRS import NIRS
 
 import json
 import time
+import uuid
 import queue
-import serial
-from serial.tools.list_ports import comports
 import threading
 import numpy as np
-import matplotlib as mlp
-import matplotlib.pyplot as plt
 
-mlp.use("Agg")
+
+def pyplot():
+    """Matplotlib's pyplot on the Agg backend, imported on first use as it is slow to load."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def update_image(image, broker):
+    """Parse changed pixels and publish them as a "pixels" event of [ix, iy, value] items."""
+    idx_x, idx_y = image.parse_all_pixels()
+    if len(idx_x) > 0:
+        broker.publish("pixels", {
+            "version": image.version,
+            "pixels": [[int(ix), int(iy), float(image.img[ix, iy])] for ix, iy in zip(idx_x, idx_y)],
+        })
+
+
+class RasterJob:
+    """A server-side raster scan over a rectangular region of pixels."""
+
+    def __init__(self, image, pixels, *, num_repeats=1, pga_gain=None, feed=1000):
+        """Init job. Pixels are (ix, iy) image coordinates in scanning order."""
+        self.job_id = uuid.uuid4().hex
+        self.image = image
+        self.pixels = list(pixels)
+        self.num_repeats = num_repeats
+        self.pga_gain = pga_gain
+        self.feed = feed
+
+        # Job state: pending -> running -> done / cancelled / error.
+        self.state = "pending"
+        self.message = ""
+        self.num_done = 0
+        self.created_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self.cancel_event = threading.Event()
+
+        # Total time per pipeline stage in second, and number of samples.
+        self.stage_times = {}
+        self.stage_counts = {}
+
+    def cancel(self):
+        """Request cancellation, the worker stops before the next pixel."""
+        self.cancel_event.set()
+        if self.state == "pending":
+            self.state = "cancelled"
+
+    def add_timing(self, stage, seconds):
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+        self.stage_counts[stage] = self.stage_counts.get(stage, 0) + 1
+
+    def add_scan_timings(self, scan_job):
+        for stage, seconds in scan_job.timings.items():
+            self.add_timing(stage, seconds)
+
+    def to_dict(self):
+        """Job progress summary, with mean time per stage and pixels per second."""
+        end_time = time.time() if self.end_time is None else self.end_time
+        elapsed = None if self.start_time is None else end_time - self.start_time
+        return {
+            "job_id": self.job_id,
+            "state": self.state,
+            "message": self.message,
+            "num_pixels": len(self.pixels),
+            "num_done": self.num_done,
+            "created_time": self.created_time,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "pixels_per_s": self.num_done / elapsed if elapsed else None,
+            "stage_timings_ms": dict((stage, self.stage_times[stage] / self.stage_counts[stage] * 1000.0)
+                                     for stage in self.stage_times),
+        }
 
 
-def serial_reader(port, lock, buffer, plotter_state):
-    """Keep reading from the serial port.
-       Also query and interpret the machine state.
+def build_raster_path(image, x_range_mm, y_range_mm, eps=1e-6):
+    """Serpentine pixel path covering a workspace region (in millimeter).
+       Pixels overlapping [min, max) are included, a region ending on a pixel border stops there.
+    """
+    def _index_range(range_mm, offset_mm, pixel_size_mm, size):
+        start = int(np.floor((min(range_mm) - offset_mm) / pixel_size_mm + eps))
+        stop = int(np.ceil((max(range_mm) - offset_mm) / pixel_size_mm - eps))
+        # A zero-width region still covers its pixel. Clip to image.
+        return range(max(start, 0), min(max(stop, start + 1), size))
+
+    ix_range = _index_range(x_range_mm, image.wx_min, image.pixel_size_mm_x, image.shape[0])
+    iy_range = _index_range(y_range_mm, image.wy_min, image.pixel_size_mm_y, image.shape[1])
+
+    pixels = []
+    for row, iy in enumerate(iy_range):
+        ix_list = ix_range
+        if row % 2 == 1:
+            # Go back on odd rows, no return trips.
+            ix_list = reversed(ix_list)
+        pixels.extend((ix, iy) for ix in ix_list)
+
+    return pixels
+
+
+def send_plotter_move(plotter, plotter_state, wx, wy, feed):
+    """Send an absolute linear move and update the targeting position."""
+    command = "G90 G1 G21 X{:.2f} Y{:.2f} F{:d}\n".format(wx, wy, feed)
+    plotter_state.set_targeting(x=wx, y=wy)
+    return plotter.send(command)
+
+
+def store_scan_results(image, ix, iy, results):
+    """Save scan results, as a dict or as arrays, to a pixel."""
+    if isinstance(results, dict):
+        image.set_pixel_data(ix, iy, results)
+        return
+
+    wavelength, intensity, reference, metadata = results
+    image.set_pixel_arrays(ix, iy, wavelength, intensity, reference,
+                           temperature_system=metadata.temperature_system,
+                           temperature_detector=metadata.temperature_detector,
+                           humidity=metadata.humidity, pga=metadata.pga)
+
+
+def raster_worker(job_queue, scanner, get_plotter, plotter_state, broker):
+    """Run raster jobs one by one, pipelined.
+       The move to the next pixel is issued as soon as the exposure finishes, readout and transfer then overlap
+       with the plotter movement, and image update with the next exposure.
+       get_plotter returns the current plotter connection, which is replaced on reconnection.
     """
 
     while threading.main_thread().is_alive():
-        # Sleep to prevent from overwhelming.
-        time.sleep(0.10)
+        try:
+            job = job_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+
+        if job.cancel_event.is_set():
+            job.state = "cancelled"
+            continue
+
+        job.state = "running"
+        job.start_time = time.time()
+        plotter = get_plotter()
+        in_flight = []
+        try:
+            if job.pga_gain is not None:
+                scanner.call("set_pga_gain", job.pga_gain)
+
+            # Head to the first pixel.
+            if len(job.pixels) > 0:
+                wx, wy = job.image._imagecoord2workcoord(*job.pixels[0])
+                send_plotter_move(plotter, plotter_state, wx, wy, job.feed)
+
+            for idx, (ix, iy) in enumerate(job.pixels):
+                wait_start_time = time.perf_counter()
+                if not plotter.wait_idle((wx, wy), sync=True, cancel_event=job.cancel_event):
+                    if not job.cancel_event.is_set():
+                        job.message = "Plotter did not reach ({:.2f}, {:.2f}).".format(wx, wy)
+                        job.state = "error"
+                    break
+                job.add_timing("move", time.perf_counter() - wait_start_time)
+
+                # Scan, move on once exposed.
+                if idx + 1 < len(job.pixels):
+                    wx, wy = job.image._imagecoord2workcoord(*job.pixels[idx + 1])
+
+                def _move_on(scan_job, last=(idx + 1 == len(job.pixels)), wx=wx, wy=wy):
+                    if (not last) and (not job.cancel_event.is_set()):
+                        send_plotter_move(plotter, plotter_state, wx, wy, job.feed)
+
+                def _process(scan_job, ix=ix, iy=iy):
+                    store_scan_results(job.image, ix, iy, scan_job.results)
+                    update_image(job.image, broker)
+                    job.num_done += 1
+                    broker.publish("scan", {"ix": ix, "iy": iy, "job_id": job.job_id})
+
+                scan_job = scanner.submit_scan(job.num_repeats, on_scanned=_move_on, on_done=_process,
+                                               as_arrays=True)
+                in_flight.append(scan_job)
+                scan_job.wait_scanned()
+                if scan_job.state == "error":
+                    raise RuntimeError(scan_job.message)
+
+                # Stop at the first failed pixel.
+                for scan_job in in_flight:
+                    if scan_job.done_event.is_set():
+                        job.add_scan_timings(scan_job)
+                        if scan_job.state == "error":
+                            raise RuntimeError(scan_job.message)
+                in_flight = [scan_job for scan_job in in_flight if not scan_job.done_event.is_set()]
+
+            for scan_job in in_flight:
+                scan_job.wait()
+                job.add_scan_timings(scan_job)
+                if scan_job.state == "error":
+                    raise RuntimeError(scan_job.message)
+
+            if job.state == "running":
+                job.state = "cancelled" if job.cancel_event.is_set() else "done"
+
+        except Exception as e:
+            job.state = "error"
+            job.message = str(e)
+
+        # Pixels still in processing are written before flushing.
+        for scan_job in in_flight:
+            scan_job.wait()
+        job.image.flush()
+        job.end_time = time.time()
+        broker.publish("raster", job.to_dict())
+
+
+def shared_state_publisher(shared_state, broker, plotter_state, interval_s):
+    """Publish the plotter state and the current image to shared memory after each event.
+       Targeting changes come without an event, so the state is also republished every interval.
+    """
+    subscription = broker.subscribe()
+    while threading.main_thread().is_alive():
+        try:
+            subscription.get(timeout=interval_s)
+            # Coalesce bursts of events.
+            while True:
+                subscription.get_nowait()
+        except queue.Empty:
+            pass
 
-        # Query machine state.
-        port.write("?\n".encode())
+        shared_state.publish_state(plotter_state.snapshot())
+        shared_state.publish_image(NirsPlotterConfig.scanned_image)
+        shared_state.beat()
 
-        with lock:
-            # Fast reading.
-            while True:
-                data = port.readline().decode()
-                if len(data) == 0:
-                    break
-                elif data == "\r\n":
-                    pass
-                else:
-                    # Check and interpret machine state info.
-                    # e.g.: <Alarm|WPos:0.000,0.000,0.000|FS:0,0>
-                    if data[0] == "<":
-                        # Split the message.
-                        all_items = data[1:-1].split("|")
-
-                        # Update the state and the position.
-                        plotter_state["state"] = all_items[0]
-                        plotter_state["position"] = list([float(pos) for pos in all_items[1].split(":")[1].split(",")])
-
-                        # Regulate float numbers.
-                        plotter_state["position"] = [0.0 if (-0.01 <= v <= 0.0) else v for v in plotter_state["position"]]
-
-                    else:
-                        # Save the data to buffer, deque the if full.
-                        if buffer.full():
-                            buffer.get()
-                        buffer.put(data)
-    # Clean up.
-    port.close()
-
-
-def construct_plotter_image_response(fig, ax, image, extent, plotter_state):
-    """Draw and generate plotter image response."""
-    while True:
-        # Clear figure.
-        ax.clear()
-        # image = np.random.random(image.shape)
-        # image[0, :] = 0
-        # image[:, 0] = 0
-        # plotter_state["position"] = np.random.randint(0, 50, (3, ))
-
-        # Draw the map.
-        # Copy image to prevent manipulation.
-        img = image.get_image()
-        img_mask = image.scan_flags.transpose()
-        img_painted = np.copy(img)
-
-        if np.any(image.scan_flags):
-            # Scanned image.
-            min_value = np.min(img[img_mask])
-            max_value = np.max(img[img_mask])
-
-            # Normalize array (revert 0 as no ink, 1 as with ink).
-            img_painted = image.normalize_array(img_painted, mask=img_mask)
-
-            # Set unscanned area as white -- max intensity (no ink).
-            img_painted[~img_mask] = 0
 
+class PlotterImageRenderer:
+    """Draw and generate plotter image responses.
+       Axes and ticks are drawn once, the map and the position markers are blitted on top when changed.
+       The PNG is cached and only re-encoded when the map or the position changes.
+    """
+
+    def __init__(self, fig, ax, image, extent):
+        """Init renderer, draw static background."""
+        self.fig = fig
+        self.ax = ax
+        self.image = image
+
+        # Animated artists are excluded from the background.
+        self.map_artist = ax.imshow(np.zeros(image.get_image().shape), cmap="binary", extent=extent,
+                                    origin="upper", zorder=1, vmin=0, vmax=1, animated=True)
+        self.cross_artist, = ax.plot(0, 0, "+r", markersize=15, clip_on=False, zorder=2, animated=True)
+        self.circle_artist, = ax.plot(0, 0, "or", markersize=15, clip_on=False, zorder=2, mfc="none",
+                                      animated=True)
+        fig.canvas.draw()
+        self.background = fig.canvas.copy_from_bbox(fig.bbox)
+        self.map_background = None
+
+        # Cache.
+        self.image_version = None
+        self.position = None
+        self.png = None
+
+    def _render(self, plotter_state):
+        """Update changed artists and encode PNG if needed, return the ETag."""
+        image_version = self.image.version
+        position = tuple(plotter_state["position"][:2])
+
+        if image_version != self.image_version:
+            # Draw the map.
+            self.map_artist.set_data(paint_image(self.image))
+            self.fig.canvas.restore_region(self.background)
+            self.ax.draw_artist(self.map_artist)
+            self.map_background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+        if (image_version != self.image_version) or (position != self.position):
+            # Draw position markers.
+            self.fig.canvas.restore_region(self.map_background)
+            for artist in [self.cross_artist, self.circle_artist]:
+                artist.set_data([position[0]], [position[1]])
+                self.ax.draw_artist(artist)
+
+            # Encode.
+            buf = io.BytesIO()
+            pyplot().imsave(buf, np.asarray(self.fig.canvas.buffer_rgba()), format="png")
+            self.png = buf.getvalue()
+            self.image_version = image_version
+            self.position = position
+
+        return '"{}-{}-{:.3f}-{:.3f}"'.format(image_tag(self.image), self.image_version, *self.position)
+
+    def get_response(self, request, plotter_state):
+        """Plotter image response with the position of a plotter state snapshot, 304 if the client has it."""
+        etag = self._render(plotter_state)
+        if request.META.get("HTTP_IF_NONE_MATCH") == etag:
+            response = HttpResponseNotModified()
         else:
-            # Empty image -- not scanned yet.
-
-            # Set image to plain white.
-            img_painted = np.zeros(img.shape)
-
-        print(img[0][0])
-        ax.imshow(img_painted, cmap="binary", extent=extent, origin="upper", zorder=1,
-                  vmin=0, vmax=1)
-        ax.plot(plotter_state["position"][0], plotter_state["position"][1], "+r",
-                markersize=15, clip_on=False, zorder=2)
-        ax.plot(plotter_state["position"][0], plotter_state["position"][1], "or",
-                markersize=15, clip_on=False, zorder=2, mfc="none")
-
-        # fig.tight_layout()
-        # fig.savefig("output.png", bbox_inches='tight')
-        fig.savefig("output.png", dpi=fig.dpi)
-
-        # Prepare response.
-        buf = io.BytesIO()
-        # canvas.print_png(buf, bbox_inches='tight', pad_inches=0)
-        # fig.savefig(buf, bbox_inches="tight")
-        fig.savefig(buf, dpi=fig.dpi, format="png")
-        response = HttpResponse(buf.getvalue(), content_type="image/png")
-        response["Access-Control-Allow-Origin"] = "*"
-        response["Access-Control-Expose-Headers"] = "*"
-        response["Content-Length"] = str(len(response.content))
-        response["Plotter-State"] = str(plotter_state["state"])
-        response["Plotter-Position"] = json.dumps(dict(zip("xyz", plotter_state["position"])))
-        response["Targeting-Position"] = json.dumps(dict(zip("xyz", plotter_state["targeting"])))
-
-        yield response
+            response = HttpResponse(self.png, content_type="image/png")
+            response["Content-Length"] = str(len(self.png))
+
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"
+
+        return set_plotter_headers(response, plotter_state)
 
 
 class NirsPlotterConfig(AppConfig):
@@ -147,66 +344,150 @@ class NirsPlotterConfig(AppConfig):
         "y": int(np.floor(workspace_size_mm["y"] / pixel_size_mm["y"]))
     }
 
-    # Initialize a NIRS instance.
-    nirs = NIRS()
-    nirs.set_hibernate(False)
-
-    # Connect to XY-plotter.
-    serial_port = None
-    dev_list = comports()
-    for dev in dev_list:
-        serial_port = serial.Serial(port=dev.device, baudrate=115200, bytesize=8, parity='N', stopbits=1, timeout=1)
-
-    if serial_port is None:
-        # Error.
-        print("Failed to connect to plotter.")
-        exit(-1)
-    else:
-        serial_port.write("$X\n".encode())
-
     # Machine state.
-    plotter_state = {
-        "state": "",
-        "position": [0.0, 0.0, 0.0],
-        "targeting": [0.0, 0.0, 0.0],
-    }
-
-    # Start serial port threading.
-    serial_buffer = queue.Queue(maxsize=100)
-    serial_lock = threading.Lock()
-    serial_read_thread = threading.Thread(
-        target=serial_reader, args=(serial_port, serial_lock, serial_buffer, plotter_state))
-    serial_read_thread.start()
+    plotter_state = PlotterState()
+
+    # Shared image and state, attached on demand in web workers.
+    shared_state = None
+
+    # Live events.
+    event_broker = EventBroker()
+    scan_jobs = {}
+    raster_jobs = {}
+    raster_queue = queue.Queue()
+    plotter_streams = {}
+
+    # Hardware, connected on first use by connect_hardware(), only by its owner:
+    # web workers of a hardware daemon forward requests to it. The hardwared command clears hardware_client.
+    hardware_client = NIRS_HARDWARE_SOCKET is not None
+    nirs = None
+    scanner = None
+    plotter = None
+    fake_grbl = None
+    raster_thread = None
+    hardware_lock = threading.Lock()
+    next_connect_time = 0.0
 
     # Prepare plotter figure.
     fig = None
     ax = None
+    image_renderer = None
+    scanned_image = None
+    metadata = None
 
-    # Image generator lock.
+    # Image renderer lock.
     generator_lock = threading.Lock()
 
 
-def set_new_pixel_size_mm(new_pixel_size_mm):
-    """Set new pixel size, adjust work space accordingly."""
+def open_plotter_port():
+    """Open the plotter's serial port, the last one listed if there are several. None if none opens."""
+    import serial
+    from serial.tools.list_ports import comports
 
-    # Compute new output resolution and work space size.
-    new_output_resolution = {
-        "x": int(np.floor(NirsPlotterConfig.max_workspace_size_mm["x"] / new_pixel_size_mm["x"])),
-        "y": int(np.floor(NirsPlotterConfig.max_workspace_size_mm["y"] / new_pixel_size_mm["y"]))
-    }
-    new_workspace_size_mm = {
-        "x": new_pixel_size_mm["x"] * new_output_resolution["x"],
-        "y": new_pixel_size_mm["y"] * new_output_resolution["y"]
-    }
+    if NIRS_PLOTTER_BACKEND == "simulated":
+        if NirsPlotterConfig.fake_grbl is not None:
+            NirsPlotterConfig.fake_grbl.close()
+        NirsPlotterConfig.fake_grbl = FakeGrbl(**NIRS_SIMULATED_PLOTTER)
+        dev_list = [NirsPlotterConfig.fake_grbl.port_name]
+    else:
+        dev_list = [dev.device for dev in comports()]
 
-    # Update parameters.
+    for dev in reversed(dev_list):
+        try:
+            return serial.Serial(port=dev, baudrate=115200, bytesize=8, parity='N', stopbits=1, timeout=1)
+        except serial.SerialException as e:
+            print("[ERROR]: Failed to open {}: {}".format(dev, e))
+    return None
+
+
+def hardware_connected():
+    """Whether the scanner and the plotter are connected, and the plotter connection is alive."""
+    return ((NirsPlotterConfig.scanner is not None) and (NirsPlotterConfig.plotter is not None)
+            and NirsPlotterConfig.plotter.is_alive() and (NirsPlotterConfig.scanned_image is not None))
+
+
+def connect_hardware(retry_interval_s=5.0):
+    """Connect the scanner and the plotter and start the workers, if not done yet.
+       Called on first use rather than at import, so that management commands start without hardware.
+       A missing device or a lost plotter connection is retried on later calls, at most every retry_interval_s.
+       Returns whether the hardware is connected.
+    """
+    if hardware_connected():
+        return True
+
+    with NirsPlotterConfig.hardware_lock:
+        if hardware_connected():
+            return True
+        if time.monotonic() < NirsPlotterConfig.next_connect_time:
+            return False
+
+        try:
+            # Initialize a NIRS instance, all scanner calls go through the worker.
+            if NirsPlotterConfig.scanner is None:
+                if NIRS_SCANNER_BACKEND == "simulated":
+                    nirs = SimulatedNIRS(
+                        position_getter=lambda: NirsPlotterConfig.plotter_state.snapshot()["position"],
+                        **NIRS_SIMULATED_SCANNER)
+                else:
+                    from pynirs.NIRS import NIRS
+                    nirs = NIRS()
+                nirs.set_hibernate(False)
+
+                scanner = ScannerWorker(nirs)
+                scanner.start()
+                NirsPlotterConfig.nirs, NirsPlotterConfig.scanner = nirs, scanner
+
+            # Connect to XY-plotter, again if the connection was lost.
+            if (NirsPlotterConfig.plotter is None) or (not NirsPlotterConfig.plotter.is_alive()):
+                serial_port = open_plotter_port()
+                if serial_port is None:
+                    raise RuntimeError("Failed to connect to plotter.")
+
+                plotter = GrblConnection(serial_port, NirsPlotterConfig.plotter_state, NirsPlotterConfig.event_broker,
+                                         status_interval_s=NIRS_PLOTTER_STATUS_INTERVAL_S)
+                plotter.start()
+                if not plotter.wait_ready(NIRS_PLOTTER_READY_TIMEOUT_S):
+                    serial_port.close()
+                    raise RuntimeError("Plotter did not respond.")
+                plotter.send("$X\n")
+                NirsPlotterConfig.plotter = plotter
+
+            # Start raster job worker.
+            if NirsPlotterConfig.raster_thread is None:
+                NirsPlotterConfig.raster_thread = threading.Thread(
+                    target=raster_worker,
+                    args=(NirsPlotterConfig.raster_queue, NirsPlotterConfig.scanner, lambda: NirsPlotterConfig.plotter,
+                          NirsPlotterConfig.plotter_state, NirsPlotterConfig.event_broker))
+                NirsPlotterConfig.raster_thread.start()
+
+            # Init parameters.
+            if NirsPlotterConfig.scanned_image is None:
+                set_new_pixel_size_mm(NirsPlotterConfig.pixel_size_mm)
+
+            # Web workers read the image and the state from shared memory instead of forwarding.
+            if (NIRS_HARDWARE_SOCKET is not None) and (NirsPlotterConfig.shared_state is None):
+                NirsPlotterConfig.shared_state = SharedState(NIRS_SHARED_MEMORY_NAME, create=True)
+                threading.Thread(
+                    target=shared_state_publisher,
+                    args=(NirsPlotterConfig.shared_state, NirsPlotterConfig.event_broker,
+                          NirsPlotterConfig.plotter_state, NIRS_PLOTTER_STATUS_INTERVAL_S)).start()
+        except Exception as e:
+            print("[ERROR]: Hardware connection failed, retrying in {} s: {}".format(retry_interval_s, e))
+            NirsPlotterConfig.next_connect_time = time.monotonic() + retry_interval_s
+            return False
+
+    return True
+
+
+def create_plotter_figure(workspace_size_mm):
+    """Plotter figure of a work space (in millimeter), returns fig and ax."""
     base_size = 10
-    fig, ax = plt.subplots(figsize=(base_size, new_workspace_size_mm["y"] / new_workspace_size_mm["x"] * base_size),
+    fig, ax = pyplot().subplots(figsize=(base_size, workspace_size_mm["y"] / workspace_size_mm["x"] * base_size),
                            dpi=100)
     fig.subplots_adjust(left=0.04, right=0.93, bottom=0.04, top=0.93, wspace=0.0, hspace=0.0)
     # fig.subplots_adjust(left=0.00, right=1.0, bottom=0.00, top=1.0, wspace=0.0, hspace=0.0)
-    ax.set_xlim(0, new_workspace_size_mm["x"])
-    ax.set_ylim(0, new_workspace_size_mm["y"])
+    ax.set_xlim(0, workspace_size_mm["x"])
+    ax.set_ylim(0, workspace_size_mm["y"])
 
     # Adjust border line size.
     line_width = 1.0
@@ -215,10 +496,10 @@ def set_new_pixel_size_mm(new_pixel_size_mm):
 
     # Ticks and grid.
     grid_flag = False
-    x_ticks_major = np.arange(0, new_workspace_size_mm["x"] + 0.1, new_workspace_size_mm["x"] * 5)
-    x_ticks_minor = np.arange(0, new_workspace_size_mm["x"] + 0.1, new_workspace_size_mm["x"])
-    y_ticks_major = np.flip(np.arange(0, new_workspace_size_mm["y"] + 0.1, new_workspace_size_mm["y"] * 5))
-    y_ticks_minor = np.flip(np.arange(0, new_workspace_size_mm["y"] + 0.1, new_workspace_size_mm["y"]))
+    x_ticks_major = np.arange(0, workspace_size_mm["x"] + 0.1, workspace_size_mm["x"] * 5)
+    x_ticks_minor = np.arange(0, workspace_size_mm["x"] + 0.1, workspace_size_mm["x"])
+    y_ticks_major = np.flip(np.arange(0, workspace_size_mm["y"] + 0.1, workspace_size_mm["y"] * 5))
+    y_ticks_minor = np.flip(np.arange(0, workspace_size_mm["y"] + 0.1, workspace_size_mm["y"]))
     ax.set_xticks(x_ticks_major, minor=False)
     ax.set_xticks(x_ticks_minor, minor=True)
     ax.set_yticks(y_ticks_major, minor=False)
@@ -235,6 +516,27 @@ def set_new_pixel_size_mm(new_pixel_size_mm):
         ax.grid(False, which="major", axis="both")
         ax.grid(False, which="minor", axis="both")
 
+    return fig, ax
+
+
+def set_new_pixel_size_mm(new_pixel_size_mm, session_id=None):
+    """Set new pixel size, adjust work space accordingly.
+       A new scan session is started, or an existing session is resumed if session_id is given.
+    """
+
+    # Compute new output resolution and work space size.
+    new_output_resolution = {
+        "x": int(np.floor(NirsPlotterConfig.max_workspace_size_mm["x"] / new_pixel_size_mm["x"])),
+        "y": int(np.floor(NirsPlotterConfig.max_workspace_size_mm["y"] / new_pixel_size_mm["y"]))
+    }
+    new_workspace_size_mm = {
+        "x": new_pixel_size_mm["x"] * new_output_resolution["x"],
+        "y": new_pixel_size_mm["y"] * new_output_resolution["y"]
+    }
+
+    # Update parameters.
+    fig, ax = create_plotter_figure(new_workspace_size_mm)
+
     # Interpreted image test.
     # scanned_image = NIRSImage(new_output_resolution["x"], new_output_resolution["y"],
     #                           new_pixel_size_mm["x"], new_pixel_size_mm["y"], fig, ax)
@@ -264,11 +566,19 @@ def set_new_pixel_size_mm(new_pixel_size_mm):
         }
     }
 
-    # Image map and generator.
+    # Image map and renderer.
     # image = np.random.random((output_size["y"], output_size["x"]))
     # image = np.ones(shape=(output_resolution["y"], output_resolution["x"]), dtype=float)
     extent = (0, new_workspace_size_mm["x"], new_workspace_size_mm["y"], 0)
 
+    # Scan session storage.
+    storage_dir = None
+    if NIRS_SESSION_DIR is not None:
+        if session_id is None:
+            session_id = time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+        storage_dir = os.path.join(NIRS_SESSION_DIR, session_id)
+    metadata["session_id"] = session_id
+
     # Save parameters.
     NirsPlotterConfig.pixel_size_mm = new_pixel_size_mm
     NirsPlotterConfig.output_resolution = new_output_resolution
@@ -282,16 +592,153 @@ def set_new_pixel_size_mm(new_pixel_size_mm):
             NirsPlotterConfig.pixel_size_mm["x"],
             NirsPlotterConfig.pixel_size_mm["y"],
             NirsPlotterConfig.fig,
-            NirsPlotterConfig.ax)
+            NirsPlotterConfig.ax,
+            storage_dir=storage_dir,
+            processing=NIRS_SIGNAL_PROCESSING,
+            model=NIRS_PIXEL_MODEL)
+    NirsPlotterConfig.scanned_image.parse_all_pixels()
+    NirsPlotterConfig.event_broker.publish("metadata", metadata)
     NirsPlotterConfig.extent = extent
-    NirsPlotterConfig.image_response_generator = construct_plotter_image_response(
+    NirsPlotterConfig.image_renderer = PlotterImageRenderer(
         NirsPlotterConfig.fig,
         NirsPlotterConfig.ax,
         NirsPlotterConfig.scanned_image,
-        NirsPlotterConfig.extent,
-        NirsPlotterConfig.plotter_state)
+        NirsPlotterConfig.extent)
+
+
+def submit_raster_job(x_range_mm, y_range_mm, skip_scanned=False, **kwargs):
+    """Create a raster job over the current image and queue it.
+       Set skip_scanned to resume an interrupted scan.
+    """
+    image = NirsPlotterConfig.scanned_image
+    pixels = build_raster_path(image, x_range_mm, y_range_mm)
+    if skip_scanned:
+        pixels = [(ix, iy) for ix, iy in pixels if not image.scan_flags[ix, iy]]
+    job = RasterJob(image, pixels, **kwargs)
+    NirsPlotterConfig.raster_jobs[job.job_id] = job
+    NirsPlotterConfig.raster_queue.put(job)
+
+    return job
+
+
+def submit_scan_job(num_repeats, pga_gain=None, max_jobs_kept=100, as_arrays=False):
+    """Queue a scan at the current position, the image is updated once done.
+       Raises queue.Full if too many scans are waiting. Only the latest jobs are kept for retrieval.
+       With as_arrays, results are kept as arrays (see ScanJob), for binary responses.
+    """
+
+    # The position of the exposure, the plotter may be moved on before the results are processed.
+    def _record_position(job):
+        job.position = NirsPlotterConfig.plotter_state.snapshot()["position"]
+
+    def _update_image(job):
+        wx, wy, _ = job.position
+        ix, iy = NirsPlotterConfig.scanned_image._workcoord2imagecoord(wx, wy)
+        store_scan_results(NirsPlotterConfig.scanned_image, ix, iy, job.results)
+        update_image(NirsPlotterConfig.scanned_image, NirsPlotterConfig.event_broker)
+        NirsPlotterConfig.event_broker.publish("scan", {"ix": ix, "iy": iy, "job_id": job.job_id})
+
+    job = NirsPlotterConfig.scanner.submit_scan(num_repeats, pga_gain, on_scanned=_record_position,
+                                               on_done=_update_image, as_arrays=as_arrays, block=False)
+    NirsPlotterConfig.scan_jobs[job.job_id] = job
+    while len(NirsPlotterConfig.scan_jobs) > max_jobs_kept:
+        del NirsPlotterConfig.scan_jobs[next(iter(NirsPlotterConfig.scan_jobs))]
+
+    return job
+
+
+def list_sessions():
+    """Stored scan sessions, oldest first."""
+    if (NIRS_SESSION_DIR is None) or (not os.path.isdir(NIRS_SESSION_DIR)):
+        return []
+
+    all_sessions = []
+    for session_id in sorted(os.listdir(NIRS_SESSION_DIR)):
+        session_file = os.path.join(NIRS_SESSION_DIR, session_id, "session.json")
+        if os.path.exists(session_file):
+            with open(session_file) as f:
+                session = json.load(f)
+            session["session_id"] = session_id
+            session["num_scanned"] = int(np.count_nonzero(
+                np.load(os.path.join(NIRS_SESSION_DIR, session_id, "scan_flags.npy"), mmap_mode="r")))
+            all_sessions.append(session)
+
+    return all_sessions
+
+
+def resume_session(session_id):
+    """Reopen a stored scan session as the current image."""
+    session_file = os.path.join(NIRS_SESSION_DIR, session_id, "session.json")
+    with open(session_file) as f:
+        session = json.load(f)
+    set_new_pixel_size_mm(session["pixel_size_mm"], session_id=session_id)
+
+
+def get_shared_state(max_age_s=5.0):
+    """Shared image and state of the hardware daemon in a web worker, None if the daemon is not publishing.
+       Reattaches after a daemon restart.
+    """
+    shared_state = NirsPlotterConfig.shared_state
+    if (shared_state is None) or (not shared_state.is_live(max_age_s)):
+        try:
+            shared_state = SharedState(NIRS_SHARED_MEMORY_NAME)
+        except FileNotFoundError:
+            return None
+        NirsPlotterConfig.shared_state = shared_state
+
+    return shared_state if shared_state.is_live(max_age_s) else None
+
+
+def current_plotter_state():
+    """Plotter state snapshot, a copy from shared memory in web workers."""
+    if NirsPlotterConfig.hardware_client:
+        return NirsPlotterConfig.shared_state.read_state()
+    return NirsPlotterConfig.plotter_state.snapshot()
+
+
+def wait_plotter_state(seq, timeout, poll_interval_s=0.02):
+    """Plotter state snapshot newer than seq, or the current one after timeout.
+       Web workers poll shared memory.
+    """
+    if not NirsPlotterConfig.hardware_client:
+        return NirsPlotterConfig.plotter_state.wait_newer(seq, timeout)
+
+    end_time = time.monotonic() + timeout
+    plotter_state = current_plotter_state()
+    while (plotter_state["seq"] <= seq) and (time.monotonic() < end_time):
+        time.sleep(poll_interval_s)
+        plotter_state = current_plotter_state()
+    return plotter_state
+
+
+def current_image():
+    """Current image, a snapshot from shared memory in web workers."""
+    if NirsPlotterConfig.hardware_client:
+        return NirsPlotterConfig.shared_state.read_image()
+    return NirsPlotterConfig.scanned_image
+
+
+def get_image_renderer(image):
+    """Matplotlib renderer of an image, call under generator_lock.
+       Web workers render snapshots with their own figure, rebuilt when the daemon replaces the image.
+    """
+    renderer = NirsPlotterConfig.image_renderer
+    if not NirsPlotterConfig.hardware_client:
+        return renderer
+
+    if (renderer is None) or (image_tag(renderer.image) != image_tag(image)):
+        if renderer is not None:
+            pyplot().close(renderer.fig)
+        workspace_size_mm = {
+            "x": image.shape[0] * image.pixel_size_mm_x,
+            "y": image.shape[1] * image.pixel_size_mm_y
+        }
+        fig, ax = create_plotter_figure(workspace_size_mm)
+        extent = (0, workspace_size_mm["x"], workspace_size_mm["y"], 0)
+        renderer = PlotterImageRenderer(fig, ax, image, extent)
+        NirsPlotterConfig.image_renderer = renderer
 
+    renderer.image = image
+    return renderer
 
-# Init parameters.
-set_new_pixel_size_mm(NirsPlotterConfig.pixel_size_mm)
 
@@ -0,0 +1,63 @@
+# codec.py
+# Scan results as JSON or as NumPy .npz archives, picked by content negotiation.
+# .npz members are plain little-endian arrays, load them with np.load(io.BytesIO(response.content)).
+
+import io
+import numpy as np
+
+from django.http import HttpResponse, JsonResponse
+
+
+NPZ_CONTENT_TYPE = "application/x-npz"
+FORMATS = ["json", "npz"]
+
+
+def wants_npz(request, requested_format=None):
+    """Whether the client asked for .npz, by format ("json" or "npz") if given, otherwise by the Accept header."""
+    if requested_format is not None:
+        return requested_format == "npz"
+    return NPZ_CONTENT_TYPE in request.META.get("HTTP_ACCEPT", "")
+
+
+def scan_results_to_arrays(results):
+    """Scan results, as a dict or as (wavelength, intensity, reference, metadata), as a dict of arrays and scalars."""
+    if isinstance(results, dict):
+        arrays = dict(results)
+        arrays["wavelength"] = np.asarray(results["wavelength"], dtype=np.float64)
+        arrays["intensity"] = np.asarray(results["intensity"], dtype=np.int32)
+        arrays["reference"] = np.asarray(results["reference"], dtype=np.int32)
+        return arrays
+
+    wavelength, intensity, reference, metadata = results
+    arrays = metadata._asdict()
+    arrays.update(wavelength=wavelength, intensity=intensity, reference=reference)
+    return arrays
+
+
+def arrays_to_json(arrays):
+    """Arrays and NumPy scalars as lists and Python scalars."""
+    return dict((key, value.tolist() if isinstance(value, (np.ndarray, np.generic)) else value)
+                for key, value in arrays.items())
+
+
+def encode_npz(arrays):
+    """Uncompressed .npz archive, cheapest to encode and decode. Members are little-endian on any host."""
+    buf = io.BytesIO()
+    little_endian = {}
+    for name, arr in arrays.items():
+        arr = np.asarray(arr)
+        little_endian[name] = arr.astype(arr.dtype.newbyteorder("<"), copy=False)
+    np.savez(buf, **little_endian)
+    return buf.getvalue()
+
+
+def arrays_response(request, arrays, requested_format=None):
+    """Response of arrays as .npz or as JSON lists."""
+    if wants_npz(request, requested_format):
+        response = HttpResponse(encode_npz(arrays), content_type=NPZ_CONTENT_TYPE)
+        response["Content-Length"] = str(len(response.content))
+    else:
+        response = JsonResponse(arrays_to_json(arrays))
+    response["Vary"] = "Accept"
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
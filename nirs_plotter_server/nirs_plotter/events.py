@@ -0,0 +1,67 @@
+# events.py
+# Publish / subscribe of plotter and scanner events, streamed to clients as Server-Sent Events.
+
+import json
+import time
+import queue
+import threading
+
+
+class EventBroker:
+    """Fan out events to all subscribers, each subscriber has its own bounded queue."""
+
+    def __init__(self, max_queue_size=1000):
+        self.max_queue_size = max_queue_size
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """Create a subscription queue."""
+        subscription = queue.Queue(maxsize=self.max_queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event_type, data):
+        """Send an event to all subscribers, drop the oldest events of slow subscribers."""
+        event = (event_type, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            while True:
+                try:
+                    subscription.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        subscription.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def stream(self, initial_events=(), keepalive_s=15.0):
+        """Generate Server-Sent Events text for a new subscriber until the client disconnects."""
+        subscription = self.subscribe()
+        try:
+            for event_type, data in initial_events:
+                yield format_sse(event_type, data)
+
+            while True:
+                try:
+                    event_type, data = subscription.get(timeout=keepalive_s)
+                except queue.Empty:
+                    # Comment line keeps proxies and the connection alive.
+                    yield ": keep-alive {:.0f}\n\n".format(time.time())
+                    continue
+                yield format_sse(event_type, data)
+        finally:
+            self.unsubscribe(subscription)
+
+
+def format_sse(event_type, data):
+    """Format an event in Server-Sent Events wire format."""
+    return "event: {}\ndata: {}\n\n".format(event_type, json.dumps(data))
@@ -0,0 +1,414 @@
+# grbl.py
+# Serial I/O with a GRBL controller: selector-based reader, writer queue, command completions as futures.
+
+import re
+import time
+import uuid
+import queue
+import selectors
+import threading
+from collections import deque
+import concurrent.futures
+from concurrent.futures import Future
+
+
+class GrblError(Exception):
+    """A command answered with "error:N", or dropped by a soft reset."""
+    pass
+
+
+class GrblStream:
+    """A batch of G-code lines streamed to the controller, with per-line completion."""
+
+    def __init__(self, lines):
+        self.stream_id = uuid.uuid4().hex
+        self.lines = list(lines)
+        self.futures = []
+        self.created_time = time.time()
+
+    def to_dict(self):
+        """Stream progress summary, failed lines are listed with their errors."""
+        num_done = sum(future.done() for future in self.futures)
+        errors = [{"line_number": idx, "line": self.lines[idx], "error": str(future.exception())}
+                  for idx, future in enumerate(self.futures) if future.done() and future.exception()]
+        return {
+            "stream_id": self.stream_id,
+            "state": "done" if num_done == len(self.futures) else "running",
+            "num_lines": len(self.lines),
+            "num_done": num_done,
+            "num_errors": len(errors),
+            "errors": errors,
+            "created_time": self.created_time,
+        }
+
+
+class PlotterState:
+    """Versioned plotter state.
+       Each change swaps in a new snapshot with the next sequence number, snapshots are never mutated,
+       so readers take the current one without locking. wait_newer() blocks until a newer one is swapped in.
+    """
+
+    def __init__(self):
+        self._snapshot = {
+            "seq": 0,
+            "time": time.time(),
+            "state": "",
+            "position": (0.0, 0.0, 0.0),
+            "targeting": (0.0, 0.0, 0.0),
+        }
+        self._condition = threading.Condition()
+
+    def snapshot(self):
+        """Current snapshot, a dict with seq, time, state, position and targeting. Do not modify it."""
+        return self._snapshot
+
+    def update(self, **fields):
+        """Swap in a snapshot with fields replaced, returns whether anything changed."""
+        with self._condition:
+            if all(self._snapshot[key] == value for key, value in fields.items()):
+                return False
+            self._swap(fields)
+        return True
+
+    def set_targeting(self, **axes):
+        """Replace targeting axes given as x, y and z."""
+        with self._condition:
+            targeting = tuple(axes.get(axis, value) for axis, value in zip("xyz", self._snapshot["targeting"]))
+            if targeting != self._snapshot["targeting"]:
+                self._swap({"targeting": targeting})
+
+    def wait_newer(self, seq, timeout):
+        """Wait until the sequence number is above seq, returns the current snapshot either way."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._snapshot["seq"] > seq, timeout)
+            return self._snapshot
+
+    def _swap(self, fields):
+        snapshot = dict(self._snapshot, **fields)
+        snapshot["seq"] = self._snapshot["seq"] + 1
+        snapshot["time"] = time.time()
+        self._snapshot = snapshot
+        self._condition.notify_all()
+
+
+def clean_gcode(program):
+    """Split a program into lines, strip comments and whitespace, drop empty lines."""
+    lines = []
+    for line in program.splitlines():
+        line = re.sub(r"\(.*?\)|;.*", "", line).strip()
+        if len(line) > 0:
+            lines.append(line)
+    return lines
+
+
+class GrblConnection:
+    """Own a GRBL serial port.
+       Lines are written in order by a writer thread, each line is answered by GRBL with one "ok" or "error:N",
+       which completes the future returned by send(). Characters of unanswered lines are counted so that
+       GRBL's receive buffer is kept full but never overflown, the planner then never runs dry between lines.
+       Status reports are requested periodically and update plotter_state (a PlotterState), changes are published
+       as "state" events.
+       Waiters block on a condition notified by status reports, see wait_idle().
+    """
+
+    # Real-time commands are picked out of the stream by GRBL and not answered with "ok".
+    REALTIME_COMMANDS = (b"?", b"!", b"~", b"\x18")
+
+    def __init__(self, port, plotter_state, broker=None, *, status_interval_s=0.1, buffer_size=100,
+                 rx_buffer_size=128):
+        """Init instance, call start() to run I/O threads.
+           Other received lines are kept in a bounded buffer for clients to read.
+        """
+        self.port = port
+        self.plotter_state = plotter_state
+        self.broker = broker
+        self.status_interval_s = status_interval_s
+        self.rx_buffer_size = rx_buffer_size
+        self.buffer = queue.Queue(maxsize=buffer_size)
+
+        self._write_queue = queue.Queue()
+        self._write_lock = threading.Lock()
+
+        # Unanswered lines as (future, length), and their characters in the receive buffer.
+        self._pending = deque()
+        self._rx_used = 0
+        self._rx_condition = threading.Condition()
+        self._threads = []
+        # Set by the reader as it exits, lines queued after that fail right away.
+        self._closed = False
+
+        # Notified on every status report, and on the reset banner.
+        self._state_condition = threading.Condition()
+        self._status_count = 0
+        self._banner_count = 0
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._read_loop, name="grbl-reader"),
+                         threading.Thread(target=self._write_loop, name="grbl-writer")]
+        for thread in self._threads:
+            thread.start()
+
+    def is_alive(self):
+        """Whether the connection is up, it goes down for good if the port fails."""
+        return (len(self._threads) > 0) and all(thread.is_alive() for thread in self._threads)
+
+    def send(self, command):
+        """Queue G-code line(s) without waiting.
+           Returns a future of the last line, resolved to "ok" or failed with GrblError.
+        """
+        if isinstance(command, str):
+            command = command.encode()
+        if not command.endswith(b"\n"):
+            command += b"\n"
+
+        future = None
+        for line in command.splitlines(keepends=True):
+            future = Future()
+            self._write_queue.put((line, future))
+        if self._closed:
+            self._fail_queued(GrblError("Connection closed."))
+        return future
+
+    def stream(self, program):
+        """Queue a G-code program (text or list of lines), returns a GrblStream."""
+        if isinstance(program, str):
+            program = [program]
+        grbl_stream = GrblStream(clean_gcode("\n".join(program)))
+        for line in grbl_stream.lines:
+            future = Future()
+            grbl_stream.futures.append(future)
+            self._write_queue.put(((line + "\n").encode(), future))
+        if self._closed:
+            self._fail_queued(GrblError("Connection closed."))
+        return grbl_stream
+
+    def sync(self):
+        """Future resolved once all motion queued before it has completed (G4 P0 dwell)."""
+        return self.send("G4 P0")
+
+    def wait_ready(self, timeout):
+        """Wait for the reset banner or a status report, returns whether one arrived.
+           Controllers resetting as the port opens drop lines sent while they boot.
+        """
+        with self._state_condition:
+            return self._state_condition.wait_for(lambda: self._status_count + self._banner_count > 0, timeout)
+
+    def wait_state(self, predicate, timeout, *, cancel_event=None, fresh=False):
+        """Wait until predicate(plotter state snapshot) holds, returns whether it did.
+           Set fresh to only accept status reports received after the call.
+        """
+        end_time = time.monotonic() + timeout
+        with self._state_condition:
+            min_count = self._status_count + 1 if fresh else 0
+            while (self._status_count < min_count) or (not predicate(self.plotter_state.snapshot())):
+                remaining = end_time - time.monotonic()
+                if (remaining <= 0) or ((cancel_event is not None) and cancel_event.is_set()):
+                    return False
+                self._state_condition.wait(min(remaining, 0.1))
+        return True
+
+    def wait_idle(self, position=None, *, sync=False, tol=0.05, timeout=60, cancel_event=None):
+        """Wait until the plotter reports idle, at position (x, y) if given.
+           Returns whether it did before timeout or cancellation.
+           Set sync after queueing motion: a dwell (G4 P0) is queued and waited for first, as the plotter may
+           still report idle before the motion starts. Without it no G-code is sent, only status reports are used.
+        """
+        end_time = time.monotonic() + timeout
+        future = self.sync() if sync else None
+        while future is not None:
+            try:
+                future.result(timeout=0.1)
+                break
+            except concurrent.futures.TimeoutError:
+                if (time.monotonic() >= end_time) or ((cancel_event is not None) and cancel_event.is_set()):
+                    return False
+            except GrblError:
+                return False
+
+        def _arrived(plotter_state):
+            if plotter_state["state"].lower() != "idle":
+                return False
+            if position is None:
+                return True
+            return all(abs(v - target) <= tol for v, target in zip(plotter_state["position"], position))
+
+        # Ask for a report now rather than at the next scheduled query.
+        self.send_realtime(b"?")
+        return self.wait_state(_arrived, max(end_time - time.monotonic(), 0), cancel_event=cancel_event, fresh=True)
+
+    def send_realtime(self, command):
+        """Write a real-time command immediately, ahead of queued lines."""
+        if isinstance(command, str):
+            command = command.encode()
+        if command not in self.REALTIME_COMMANDS:
+            raise ValueError("Not a real-time command: {!r}.".format(command))
+
+        with self._write_lock:
+            self.port.write(command)
+
+        if command == b"\x18":
+            # Soft reset discards everything not yet answered.
+            self._fail_pending(GrblError("Soft reset."))
+
+    def drain_buffer(self):
+        """Get and clear received lines."""
+        lines = []
+        while True:
+            try:
+                lines.append(self.buffer.get_nowait())
+            except queue.Empty:
+                return lines
+
+    def _pop_pending(self):
+        """Release the oldest unanswered line, None if there is none."""
+        with self._rx_condition:
+            if len(self._pending) == 0:
+                return None
+            future, length = self._pending.popleft()
+            self._rx_used -= length
+            self._rx_condition.notify()
+        return future
+
+    def _fail_pending(self, error):
+        while True:
+            future = self._pop_pending()
+            if future is None:
+                return
+            future.set_exception(error)
+
+    def _fail_queued(self, error):
+        """Fail lines not yet written."""
+        while True:
+            try:
+                _, future = self._write_queue.get_nowait()
+            except queue.Empty:
+                return
+            future.set_exception(error)
+
+    def _write_loop(self):
+        """Write queued lines in order, register them to be answered."""
+        while threading.main_thread().is_alive():
+            try:
+                line, future = self._write_queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._closed:
+                    return
+                continue
+
+            # Wait for room in the receive buffer, register before writing as the answer may arrive right away.
+            with self._rx_condition:
+                while (not self._closed) and (len(self._pending) > 0) and \
+                        (self._rx_used + len(line) > self.rx_buffer_size):
+                    if not threading.main_thread().is_alive():
+                        return
+                    self._rx_condition.wait(timeout=0.5)
+                if self._closed:
+                    future.set_exception(GrblError("Connection closed."))
+                    continue
+                self._pending.append((future, len(line)))
+                self._rx_used += len(line)
+            try:
+                with self._write_lock:
+                    self.port.write(line)
+            except (OSError, TypeError, ValueError):
+                # Port closed, pyserial raises these too if it is closed during the write.
+                # The reader fails registered lines as the connection closes.
+                pass
+
+    def _wait_readable(self, selector, timeout):
+        """Wait until data arrives or timeout, blocking read on ports without a file descriptor."""
+        if selector is not None:
+            return len(selector.select(timeout)) > 0
+        self.port.timeout = timeout
+        return True
+
+    def _read_loop(self):
+        """Read whatever arrives, request status reports on schedule."""
+        try:
+            selector = selectors.DefaultSelector()
+            selector.register(self.port.fileno(), selectors.EVENT_READ)
+            self.port.timeout = 0
+        except (AttributeError, OSError, ValueError):
+            selector = None
+
+        received = b""
+        next_status_time = time.monotonic()
+        try:
+            while threading.main_thread().is_alive():
+                now = time.monotonic()
+                if now >= next_status_time:
+                    self.send_realtime(b"?")
+                    next_status_time = now + self.status_interval_s
+
+                if not self._wait_readable(selector, max(next_status_time - time.monotonic(), 0)):
+                    continue
+                received += self.port.read(max(self.port.in_waiting, 1))
+
+                # Complete lines.
+                *lines, received = received.split(b"\n")
+                for line in lines:
+                    self._handle_line(line.decode(errors="ignore").strip())
+        except OSError as e:
+            # E.g. unplugged, the owner reconnects with a new connection.
+            print("[ERROR]: Plotter connection lost: {}".format(e))
+
+        # Clean up, nothing is answered any more.
+        with self._rx_condition:
+            self._closed = True
+            self._rx_condition.notify_all()
+        self._fail_pending(GrblError("Connection closed."))
+        self._fail_queued(GrblError("Connection closed."))
+        if selector is not None:
+            selector.close()
+        self.port.close()
+
+    def _handle_line(self, line):
+        """Interpret a received line."""
+        if len(line) == 0:
+            return
+
+        if line[0] == "<":
+            # Machine state info, e.g.: <Alarm|WPos:0.000,0.000,0.000|FS:0,0>
+            try:
+                all_items = line[1:-1].split("|")
+                position = [float(pos) for pos in all_items[1].split(":")[1].split(",")]
+            except (IndexError, ValueError):
+                # Truncated or garbled report, the next one follows shortly.
+                return
+
+            # Regulate float numbers.
+            position = tuple(0.0 if (-0.01 <= v <= 0.0) else v for v in position)
+
+            with self._state_condition:
+                changed = self.plotter_state.update(state=all_items[0], position=position)
+                self._status_count += 1
+                self._state_condition.notify_all()
+
+            if (self.broker is not None) and changed:
+                self.broker.publish("state", self.plotter_state.snapshot())
+            return
+
+        if line.startswith("Grbl "):
+            # Reset banner, e.g. "Grbl 1.1h ['$' for help]", unanswered lines were dropped.
+            self._fail_pending(GrblError("Reset."))
+            with self._state_condition:
+                self._banner_count += 1
+                self._state_condition.notify_all()
+        elif (line == "ok") or line.startswith("error:"):
+            future = self._pop_pending()
+            if future is not None:
+                if line == "ok":
+                    future.set_result(line)
+                else:
+                    future.set_exception(GrblError(line))
+
+        # Save the line to buffer, deque if full.
+        while True:
+            try:
+                self.buffer.put_nowait(line + "\r\n")
+                break
+            except queue.Full:
+                try:
+                    self.buffer.get_nowait()
+                except queue.Empty:
+                    pass
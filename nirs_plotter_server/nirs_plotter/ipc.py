@@ -0,0 +1,194 @@
+# ipc.py
+# Hardware owner daemon and web worker proxy over a Unix socket.
+# The daemon (manage.py hardwared) owns the scanner, the plotter and the image, and runs the views;
+# web workers started with NIRS_HARDWARE_SOCKET forward requests to it, so any number of them can run.
+# Image and state reads are served by the workers themselves from shared memory (see shared.py).
+
+import io
+import os
+import json
+import socket
+import struct
+import socketserver
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.urls import resolve, Resolver404
+from nirs_plotter_server.settings import NIRS_HARDWARE_SOCKET
+from .apps import NirsPlotterConfig, get_shared_state, connect_hardware
+
+
+# Frames are a 4-byte big-endian length and the payload, an empty frame ends a response body.
+FRAME_HEADER = struct.Struct(">I")
+
+# Views served by web workers from shared memory while the daemon is publishing.
+LOCAL_VIEWS = {"state", "image"}
+
+# Views working without the hardware.
+HARDWARE_FREE_VIEWS = {"index", "sessions"}
+
+# Not forwarded, they describe the connection rather than the response.
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "content-length"}
+
+
+def send_frame(sock, payload):
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def recv_exactly(sock, size):
+    """Receive size bytes, raises ConnectionError if the peer closes first."""
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if len(chunk) == 0:
+            raise ConnectionError("Connection closed.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def recv_frame(sock):
+    size, = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    return recv_exactly(sock, size)
+
+
+class HardwareRequestHandler(socketserver.BaseRequestHandler):
+    """Run one forwarded request through Django's WSGI handler, stream the response back."""
+
+    def handle(self):
+        try:
+            request_info = json.loads(recv_frame(self.request))
+            body = recv_frame(self.request)
+        except (ConnectionError, ValueError):
+            return
+
+        environ = {
+            "REQUEST_METHOD": request_info["method"],
+            "PATH_INFO": request_info["path"],
+            "QUERY_STRING": request_info["query_string"],
+            "CONTENT_TYPE": request_info["content_type"],
+            "CONTENT_LENGTH": str(len(body)),
+            "SERVER_NAME": request_info["server_name"],
+            "SERVER_PORT": request_info["server_port"],
+            "REMOTE_ADDR": request_info["remote_addr"],
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": request_info["scheme"],
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": io.StringIO(),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        environ.update(request_info["headers"])
+
+        def _start_response(status, headers, exc_info=None):
+            send_frame(self.request, json.dumps({"status": status, "headers": headers}).encode())
+
+        result = self.server.wsgi_handler(environ, _start_response)
+        try:
+            for chunk in result:
+                if len(chunk) > 0:
+                    send_frame(self.request, chunk)
+            send_frame(self.request, b"")
+        except OSError:
+            # Web worker went away, e.g. an event stream client disconnected.
+            pass
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+
+
+class HardwareServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serve forwarded requests, one thread per connection."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, wsgi_handler):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.wsgi_handler = wsgi_handler
+        super().__init__(socket_path, HardwareRequestHandler)
+
+
+def forward_request(request, socket_path=NIRS_HARDWARE_SOCKET):
+    """Forward a request to the hardware daemon, the response body is streamed as it arrives."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        send_frame(sock, json.dumps({
+            "method": request.method,
+            "path": request.path_info,
+            "query_string": request.META.get("QUERY_STRING", ""),
+            "content_type": request.META.get("CONTENT_TYPE", ""),
+            "server_name": request.META.get("SERVER_NAME", "localhost"),
+            "server_port": str(request.META.get("SERVER_PORT", "80")),
+            "remote_addr": request.META.get("REMOTE_ADDR", ""),
+            "scheme": request.scheme,
+            "headers": dict((key, value) for key, value in request.META.items() if key.startswith("HTTP_")),
+        }).encode())
+        send_frame(sock, request.body)
+        response_info = json.loads(recv_frame(sock))
+    except (OSError, ValueError):
+        sock.close()
+        return HttpResponse("Hardware daemon unavailable.", status=503)
+
+    def _body():
+        try:
+            while True:
+                chunk = recv_frame(sock)
+                if len(chunk) == 0:
+                    return
+                yield chunk
+        except OSError:
+            return
+        finally:
+            sock.close()
+
+    status = int(response_info["status"].split(" ", 1)[0])
+    headers = [(key, value) for key, value in response_info["headers"]
+               if key.lower() not in HOP_BY_HOP_HEADERS]
+    content_type = dict((key.lower(), value) for key, value in headers).get("content-type")
+
+    # Event streams stay open, everything else is read in full.
+    if (content_type is not None) and content_type.startswith("text/event-stream"):
+        response = StreamingHttpResponse(_body(), status=status)
+    else:
+        response = HttpResponse(b"".join(_body()), status=status)
+    for key, value in headers:
+        response[key] = value
+
+    return response
+
+
+def get_url_name(request):
+    """URL name of the view of a request, None if it is not a view of this app."""
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return None
+    return match.url_name if match.func.__module__ == "nirs_plotter.views" else None
+
+
+def is_local_view(request):
+    """Whether a web worker can serve the request from shared memory."""
+    return (get_url_name(request) in LOCAL_VIEWS) and (get_shared_state() is not None)
+
+
+class HardwareProxyMiddleware:
+    """Forward requests to the hardware daemon in web workers, except reads served from shared memory.
+       In the hardware owner, the hardware is connected on the first request needing it.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if NirsPlotterConfig.hardware_client:
+            if is_local_view(request):
+                return self.get_response(request)
+            return forward_request(request)
+
+        url_name = get_url_name(request)
+        if (url_name is not None) and (url_name not in HARDWARE_FREE_VIEWS) and (not connect_hardware()):
+            return HttpResponse("Hardware unavailable.", status=503)
+        return self.get_response(request)
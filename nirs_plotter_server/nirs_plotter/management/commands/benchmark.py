@@ -0,0 +1,227 @@
+# benchmark.py
+# End-to-end performance measurements, results are saved as JSON for comparison between commits.
+# Usage: NIRS_SCANNER_BACKEND=simulated NIRS_PLOTTER_BACKEND=simulated python manage.py benchmark -o bench.json
+
+import sys
+import json
+import time
+import threading
+import subprocess
+import numpy as np
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from nirs_plotter_server.settings import BASE_DIR, NIRS_SCANNER_BACKEND, NIRS_PLOTTER_BACKEND
+from nirs_plotter.apps import NirsPlotterConfig, set_new_pixel_size_mm, submit_raster_job, connect_hardware, \
+    pyplot
+from nirs_plotter.utils import NIRSImage
+
+
+def summarize(samples):
+    """Summary statistics of time samples (in second), reported in millisecond."""
+    samples_ms = np.array(samples) * 1000.0
+    return {
+        "n": len(samples_ms),
+        "mean_ms": float(np.mean(samples_ms)),
+        "median_ms": float(np.median(samples_ms)),
+        "p95_ms": float(np.percentile(samples_ms, 95)),
+        "min_ms": float(np.min(samples_ms)),
+        "max_ms": float(np.max(samples_ms)),
+    }
+
+
+def timeit(func, repeats):
+    """Time repeated calls of a function."""
+    samples = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start_time)
+    return samples
+
+
+def git_commit():
+    """Current commit hash, empty if unavailable."""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BASE_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+class Command(BaseCommand):
+    help = "Benchmark scan, render and state-polling endpoints."
+
+    def add_arguments(self, parser):
+        parser.add_argument("-o", "--output", default="benchmark.json", help="Output JSON file.")
+        parser.add_argument("--repeats", type=int, default=20, help="Repeats per measurement.")
+        parser.add_argument("--num-repeats", type=int, default=1, help="Scan repeats for nirs/scan.")
+        parser.add_argument("--pixel-sizes", type=float, nargs="+", default=[4.0, 2.0, 1.0, 0.5],
+                            help="Pixel sizes in millimeter for grid size dependent measurements.")
+        parser.add_argument("--pollers", type=int, nargs="+", default=[1, 4, 16],
+                            help="Numbers of concurrent plotter/state pollers.")
+        parser.add_argument("--poll-duration", type=float, default=2.0, help="Polling duration in second.")
+        parser.add_argument("--raster-pixels", type=int, default=10, help="Pixels of the raster scan, 0 to skip.")
+        parser.add_argument("--startup-repeats", type=int, default=3,
+                            help="Cold starts of manage.py check, 0 to skip.")
+
+    def handle(self, *args, **options):
+        repeats = options["repeats"]
+        results = {
+            "commit": git_commit(),
+            "time": time.time(),
+            "backends": {"scanner": NIRS_SCANNER_BACKEND, "plotter": NIRS_PLOTTER_BACKEND},
+            "options": {key: options[key] for key in ["repeats", "num_repeats", "pixel_sizes",
+                                                      "pollers", "poll_duration", "raster_pixels",
+                                                      "startup_repeats"]},
+        }
+        if options["startup_repeats"] > 0:
+            results["startup"] = self.bench_startup(options["startup_repeats"])
+
+        # Hardware is connected on first use, time it separately.
+        start_time = time.perf_counter()
+        if not connect_hardware():
+            raise CommandError("Hardware unavailable.")
+        results["connect_hardware"] = summarize([time.perf_counter() - start_time])
+        original_pixel_size_mm = dict(NirsPlotterConfig.pixel_size_mm)
+
+        results["nirs_scan"] = self.bench_nirs_scan(repeats, options["num_repeats"])
+        results["get_scan_results"] = self.bench_get_scan_results(repeats)
+        results["parse_all_pixels"] = self.bench_parse_all_pixels(repeats, options["pixel_sizes"])
+        results["plotter_image"] = self.bench_plotter_image(repeats, options["pixel_sizes"])
+        results["plotter_state"] = self.bench_plotter_state(options["pollers"], options["poll_duration"])
+        results["plotter_command"] = self.bench_plotter_command(repeats)
+        if options["raster_pixels"] > 0:
+            results["raster"] = self.bench_raster(options["raster_pixels"])
+
+        # Restore.
+        set_new_pixel_size_mm(original_pixel_size_mm)
+
+        with open(options["output"], "w") as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write("Benchmark results saved to {}.".format(options["output"]))
+
+    @staticmethod
+    def bench_startup(repeats):
+        """Cold start time of a management command, from process start to exit."""
+        return summarize(timeit(lambda: subprocess.run([sys.executable, "manage.py", "check"], cwd=BASE_DIR,
+                                                       stdout=subprocess.DEVNULL, check=True), repeats))
+
+    @staticmethod
+    def bench_nirs_scan(repeats, num_repeats):
+        """Latency of nirs/scan requests."""
+        client = Client()
+        body = json.dumps({"num_repeats": num_repeats, "wait": True})
+        samples = timeit(lambda: client.post("/nirs/scan", body, content_type="application/json"), repeats)
+        return summarize(samples)
+
+    @staticmethod
+    def bench_get_scan_results(repeats):
+        """Cost of fetching and converting the last scan results."""
+        nirs = NirsPlotterConfig.nirs
+        nirs.scan(1)
+        results = {"get_scan_results": summarize(timeit(nirs.get_scan_results, repeats))}
+        if hasattr(nirs, "get_scan_arrays"):
+            results["get_scan_arrays"] = summarize(timeit(nirs.get_scan_arrays, repeats))
+        return results
+
+    @staticmethod
+    def bench_parse_all_pixels(repeats, pixel_sizes):
+        """Cost of handling one new spectrum against grid size."""
+        scan_data = NirsPlotterConfig.nirs.get_scan_results()
+        max_size = NirsPlotterConfig.max_workspace_size_mm
+
+        results = []
+        for pixel_size in pixel_sizes:
+            width, height = int(max_size["x"] / pixel_size), int(max_size["y"] / pixel_size)
+            fig, ax = pyplot().subplots()
+            ax.set_xlim(0, width * pixel_size)
+            ax.set_ylim(0, height * pixel_size)
+            image = NIRSImage(width, height, pixel_size, pixel_size, fig, ax)
+            pyplot().close(fig)
+
+            def _update():
+                image.set_pixel_data(np.random.randint(width), np.random.randint(height), scan_data)
+                image.parse_all_pixels()
+
+            results.append({
+                "pixel_size_mm": pixel_size,
+                "grid": [width, height],
+                "num_cells": width * height,
+                **summarize(timeit(_update, repeats)),
+            })
+        return results
+
+    @staticmethod
+    def bench_plotter_image(repeats, pixel_sizes):
+        """Render time of plotter/image against resolution and renderer, half of the pixels scanned.
+           The image version is bumped before each request to bypass the render cache.
+        """
+        client = Client()
+        scan_data = NirsPlotterConfig.nirs.get_scan_results()
+
+        results = []
+        for pixel_size in pixel_sizes:
+            set_new_pixel_size_mm({"x": pixel_size, "y": pixel_size})
+            image = NirsPlotterConfig.scanned_image
+            for ix in range(image.shape[0] // 2):
+                for iy in range(image.shape[1]):
+                    image.set_pixel_data(ix, iy, scan_data)
+            image.parse_all_pixels()
+
+            for renderer in ["matplotlib", "fast"]:
+                def _render():
+                    image.version += 1
+                    client.get("/plotter/image", {"renderer": renderer})
+
+                results.append({
+                    "pixel_size_mm": pixel_size,
+                    "resolution": list(image.shape),
+                    "renderer": renderer,
+                    **summarize(timeit(_render, repeats)),
+                })
+        return results
+
+    @staticmethod
+    def bench_plotter_state(pollers, duration):
+        """Throughput and latency of plotter/state under concurrent pollers."""
+        results = []
+        for num_pollers in pollers:
+            all_samples = [[] for _ in range(num_pollers)]
+            end_time = time.perf_counter() + duration
+
+            def _poll(samples):
+                client = Client()
+                while time.perf_counter() < end_time:
+                    start_time = time.perf_counter()
+                    client.get("/plotter/state")
+                    samples.append(time.perf_counter() - start_time)
+
+            threads = [threading.Thread(target=_poll, args=(samples,)) for samples in all_samples]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            samples = [sample for poller_samples in all_samples for sample in poller_samples]
+            results.append({
+                "pollers": num_pollers,
+                "requests_per_s": len(samples) / duration,
+                **summarize(samples),
+            })
+        return results
+
+    @staticmethod
+    def bench_plotter_command(repeats):
+        """Round trip of a G-code line, from queueing to its "ok"."""
+        plotter = NirsPlotterConfig.plotter
+        return summarize(timeit(lambda: plotter.send("G90").result(timeout=5), repeats))
+
+    @staticmethod
+    def bench_raster(num_pixels):
+        """Throughput of a one-row raster scan, with mean time per pipeline stage."""
+        set_new_pixel_size_mm({"x": 2, "y": 2})
+        job = submit_raster_job([0, 2 * (num_pixels - 1)], [0, 0])
+        while job.state in ["pending", "running"]:
+            time.sleep(0.05)
+        return job.to_dict()
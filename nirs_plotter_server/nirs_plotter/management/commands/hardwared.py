@@ -0,0 +1,36 @@
+# hardwared.py
+# Hardware owner daemon, serves requests forwarded by web workers over NIRS_HARDWARE_SOCKET.
+# Usage: NIRS_HARDWARE_SOCKET=/tmp/nirs_plotter.sock python manage.py hardwared
+#        then run any number of web workers with the same NIRS_HARDWARE_SOCKET.
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.handlers.wsgi import WSGIHandler
+from nirs_plotter_server.settings import NIRS_HARDWARE_SOCKET
+from nirs_plotter.ipc import HardwareServer
+from nirs_plotter.apps import NirsPlotterConfig, connect_hardware
+
+
+class Command(BaseCommand):
+    help = "Own the scanner and the plotter, serve requests forwarded by web workers."
+
+    def handle(self, *args, **options):
+        if NIRS_HARDWARE_SOCKET is None:
+            raise CommandError("NIRS_HARDWARE_SOCKET is not set.")
+
+        # This process owns the hardware, the socket setting makes others web workers.
+        NirsPlotterConfig.hardware_client = False
+
+        # Connect now so that web workers find the shared state, retried on requests if it fails.
+        if not connect_hardware():
+            self.stderr.write("Hardware unavailable, retrying on requests.")
+
+        server = HardwareServer(NIRS_HARDWARE_SOCKET, WSGIHandler())
+        self.stdout.write("Hardware daemon listening on {}.".format(NIRS_HARDWARE_SOCKET))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if NirsPlotterConfig.shared_state is not None:
+                NirsPlotterConfig.shared_state.unlink()
@@ -0,0 +1,155 @@
+# pixel_models.py
+# Pixel models reducing spectra to pixel values, batched over (n_pixels, n_wavelengths) arrays.
+
+import os
+import pickle
+import numpy as np
+
+from nirs_plotter_server.settings import NIRS_MODEL_DIR
+
+
+# Registered model classes by name.
+MODELS = {}
+
+
+def register_model(name):
+    """Class decorator registering a pixel model under a name."""
+    def _register(cls):
+        cls.name = name
+        MODELS[name] = cls
+        return cls
+    return _register
+
+
+def create_model(name, **params):
+    """Create a registered pixel model, raises ValueError for unknown names."""
+    if name not in MODELS:
+        raise ValueError("Unknown model: {}.".format(name))
+    return MODELS[name](**params)
+
+
+class PixelModel:
+    """Base pixel model. predict() maps spectra (n_pixels, n_wavelengths) to values (n_pixels,)."""
+
+    name = None
+    # Whether the model is still unfitted, it is then fitted once min_samples spectra are scanned.
+    needs_fit = False
+    min_samples = 0
+
+    def __init__(self, **params):
+        self.params = params
+
+    def fit(self, spectra, wavelength):
+        """Fit to all scanned spectra, nothing to fit by default."""
+        pass
+
+    def predict(self, spectra, wavelength):
+        raise NotImplementedError
+
+    def to_dict(self):
+        return {"name": self.name, "params": self.params}
+
+
+@register_model("mean")
+class MeanModel(PixelModel):
+    """Mean over all wavelengths."""
+
+    def predict(self, spectra, wavelength):
+        return np.mean(spectra, axis=1)
+
+
+@register_model("wavelength")
+class WavelengthModel(PixelModel):
+    """Value at the wavelength closest to target_wavelength (nm), e.g. absorbance of an ink band."""
+
+    def __init__(self, target_wavelength=1302.71):
+        super().__init__(target_wavelength=target_wavelength)
+        self.target_wavelength = float(target_wavelength)
+
+    def predict(self, spectra, wavelength):
+        return spectra[:, int(np.nanargmin(np.abs(np.asarray(wavelength) - self.target_wavelength)))]
+
+
+@register_model("band_ratio")
+class BandRatioModel(PixelModel):
+    """Ratio of the means over two wavelength bands, [start, end] in nm each."""
+
+    def __init__(self, band=(1280, 1320), reference_band=(1050, 1100)):
+        super().__init__(band=list(band), reference_band=list(reference_band))
+        self.band = band
+        self.reference_band = reference_band
+
+    @staticmethod
+    def _band_mask(wavelength, band):
+        wavelength = np.asarray(wavelength)
+        mask = (wavelength >= min(band)) & (wavelength <= max(band))
+        if not np.any(mask):
+            raise ValueError("No wavelength in band {}.".format(list(band)))
+        return mask
+
+    def predict(self, spectra, wavelength):
+        numerator = np.mean(spectra[:, self._band_mask(wavelength, self.band)], axis=1)
+        denominator = np.mean(spectra[:, self._band_mask(wavelength, self.reference_band)], axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return numerator / denominator
+
+
+@register_model("pca")
+class PCAModel(PixelModel):
+    """Projection on a principal component of the scanned spectra.
+       Components are fitted to all scanned spectra once there are min_samples of them, pixels are NaN until then.
+       They are fitted again only on train_model or set_model.
+    """
+
+    def __init__(self, component=0, min_samples=10):
+        super().__init__(component=component, min_samples=min_samples)
+        self.component = int(component)
+        self.min_samples = max(int(min_samples), self.component + 1)
+        self.mean = None
+        self.components = None
+
+    @property
+    def needs_fit(self):
+        return self.components is None
+
+    def fit(self, spectra, wavelength):
+        if len(spectra) < self.min_samples:
+            self.mean, self.components = None, None
+            return
+
+        self.mean = np.mean(spectra, axis=0)
+        _, _, vt = np.linalg.svd(spectra - self.mean, full_matrices=False)
+        self.components = vt
+
+    def predict(self, spectra, wavelength):
+        if (self.components is None) or (self.components.shape[1] != spectra.shape[1]):
+            return np.full(len(spectra), np.nan)
+        return (spectra - self.mean) @ self.components[self.component]
+
+
+@register_model("regression")
+class RegressionModel(PixelModel):
+    """Linear or PLS regression loaded from a pickle file in NIRS_MODEL_DIR.
+       The file holds an object with predict() (e.g. a scikit-learn estimator),
+       or a dict of "coef" (n_wavelengths,) and "intercept".
+    """
+
+    def __init__(self, file_name):
+        super().__init__(file_name=file_name)
+
+        # Only files in the model directory.
+        path = os.path.join(NIRS_MODEL_DIR, os.path.basename(file_name))
+        if not os.path.isfile(path):
+            raise ValueError("Model file not found: {}.".format(file_name))
+        with open(path, "rb") as f:
+            self.model = pickle.load(f)
+
+    def predict(self, spectra, wavelength):
+        if hasattr(self.model, "predict"):
+            return np.ravel(self.model.predict(spectra))
+
+        coef = np.asarray(self.model["coef"], dtype=float)
+        if len(coef) != spectra.shape[1]:
+            raise ValueError("Model has {} coefficients, spectra have {} wavelengths.".format(
+                len(coef), spectra.shape[1]))
+        return spectra @ coef + self.model.get("intercept", 0.0)
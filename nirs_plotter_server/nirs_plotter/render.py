@@ -0,0 +1,158 @@
+# render.py
+# Matplotlib-free plotter map rendering with NumPy.
+
+import io
+import json
+import zlib
+import struct
+import numpy as np
+
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseBadRequest
+
+
+# Palettes: rows 0..254 map values 0..1, row 255 is the marker color.
+MARKER_INDEX = 255
+
+
+def _palette(start, end):
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    palette[:MARKER_INDEX] = np.linspace(start, end, MARKER_INDEX).round().astype(np.uint8)[:, None]
+    palette[MARKER_INDEX] = [255, 0, 0]
+    return palette
+
+
+COLORMAPS = {
+    # White (no ink) to black (ink), same as matplotlib "binary".
+    "binary": _palette(255, 0),
+    "gray": _palette(0, 255),
+}
+
+
+def image_tag(image):
+    """Identity of an image in ETags, snapshots of an image in shared memory carry the tag of the original."""
+    return getattr(image, "image_tag", None) or "{:x}".format(id(image))
+
+
+def set_plotter_headers(response, plotter_state):
+    """Attach plotter state headers to an image response."""
+    response["Access-Control-Allow-Origin"] = "*"
+    response["Access-Control-Expose-Headers"] = "*"
+    response["Plotter-State"] = str(plotter_state["state"])
+    response["Plotter-Seq"] = str(plotter_state["seq"])
+    response["Plotter-Position"] = json.dumps(dict(zip("xyz", plotter_state["position"])))
+    response["Targeting-Position"] = json.dumps(dict(zip("xyz", plotter_state["targeting"])))
+
+    return response
+
+
+def paint_image(image):
+    """Normalized map (0 as no ink, 1 as with ink), unscanned area as 0."""
+    img = image.get_image()
+    img_mask = image.scan_flags.transpose()
+
+    if not np.any(img_mask):
+        # Empty image -- not scanned yet.
+        return np.zeros(img.shape)
+
+    img_painted = image.normalize_array(img, mask=img_mask)
+    img_painted[~img_mask] = 0
+
+    return img_painted
+
+
+def draw_marker(indices, row, col, radius):
+    """Draw a crosshair and a circle in place."""
+    height, width = indices.shape
+    row, col = int(round(row)), int(round(col))
+
+    # Bounding window.
+    r_min, r_max = max(row - radius - 1, 0), min(row + radius + 2, height)
+    c_min, c_max = max(col - radius - 1, 0), min(col + radius + 2, width)
+    if (r_min >= r_max) or (c_min >= c_max):
+        return indices
+
+    rows, cols = np.ogrid[r_min:r_max, c_min:c_max]
+    distance = np.sqrt((rows - row) ** 2 + (cols - col) ** 2)
+    mask = (np.abs(distance - radius) < 0.8)
+    mask |= (rows == row) & (np.abs(cols - col) <= radius)
+    mask |= (cols == col) & (np.abs(rows - row) <= radius)
+    indices[r_min:r_max, c_min:c_max][mask] = MARKER_INDEX
+
+    return indices
+
+
+def render_map(image, position, *, scale=1, marker_radius=8):
+    """Render the map as palette indices, upscaled by an integer factor, with the position marker."""
+    img_painted = paint_image(image)
+    height, width = img_painted.shape
+
+    # Quantize, then nearest-neighbor upscaling in one broadcast copy.
+    levels = np.round(np.clip(img_painted, 0, 1) * (MARKER_INDEX - 1)).astype(np.uint8)
+    indices = np.empty((height * scale, width * scale), dtype=np.uint8)
+    indices.reshape(height, scale, width, scale)[...] = levels[:, None, :, None]
+
+    # Work coordinates to output pixels, y axis points down.
+    row = position[1] / image.pixel_size_mm_y * scale
+    col = position[0] / image.pixel_size_mm_x * scale
+
+    return draw_marker(indices, row, col, marker_radius)
+
+
+def encode_png(indices, palette, compress_level=1):
+    """Encode palette indices as an 8-bit palette PNG."""
+    height, width = indices.shape
+
+    # Filter type 0 (none) for each scanline.
+    raw = np.zeros((height, width + 1), dtype=np.uint8)
+    raw[:, 1:] = indices
+
+    def _chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0))
+            + _chunk(b"PLTE", palette.tobytes())
+            + _chunk(b"IDAT", zlib.compress(raw.tobytes(), compress_level))
+            + _chunk(b"IEND", b""))
+
+
+def encode_webp(indices, palette):
+    """Encode palette indices as lossless WebP, requires Pillow."""
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.fromarray(palette[indices]).save(buf, format="WEBP", lossless=True, method=0)
+    return buf.getvalue()
+
+
+def construct_fast_image_response(request, image, plotter_state):
+    """Plotter image response rendered without Matplotlib, safe to run concurrently.
+       Query parameters: format (png, webp), scale (integer upscaling), cmap (binary, gray).
+    """
+    image_format = request.GET.get("format", "png")
+    cmap = request.GET.get("cmap", "binary")
+    try:
+        scale = int(request.GET.get("scale", max(1, 1000 // image.shape[0])))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid scale.")
+    if (image_format not in ["png", "webp"]) or (cmap not in COLORMAPS) or not (1 <= scale <= 64):
+        return HttpResponseBadRequest("Unsupported format, colormap or scale.")
+
+    position = tuple(plotter_state["position"][:2])
+    etag = '"fast-{}-{}-{:.3f}-{:.3f}-{}-{}-{}"'.format(image_tag(image), image.version, *position,
+                                                           image_format, cmap, scale)
+    if request.META.get("HTTP_IF_NONE_MATCH") == etag:
+        response = HttpResponseNotModified()
+    else:
+        indices = render_map(image, position, scale=scale)
+        if image_format == "webp":
+            response = HttpResponse(encode_webp(indices, COLORMAPS[cmap]), content_type="image/webp")
+        else:
+            response = HttpResponse(encode_png(indices, COLORMAPS[cmap]), content_type="image/png")
+        response["Content-Length"] = str(len(response.content))
+
+    response["ETag"] = etag
+    response["Cache-Control"] = "no-cache"
+    response["Pixel-Scale"] = str(scale)
+
+    return set_plotter_headers(response, plotter_state)
@@ -0,0 +1,218 @@
+# scanner.py
+# All scanner calls run in order on one worker thread, scans are queued as jobs.
+# Scans are pipelined: exposure -> readout -> transfer on the scanner thread, processing on its own thread,
+# so the next exposure can start while the last spectrum is being processed.
+
+import time
+import uuid
+import queue
+import threading
+import numpy as np
+from collections import deque
+from concurrent.futures import Future
+
+
+# Pipeline stages in order, "queued" is the time waiting for the scanner.
+SCAN_STAGES = ["queued", "exposure", "readout", "transfer", "processing"]
+
+
+class ScanJob:
+    """A queued scan, results are kept once done."""
+
+    def __init__(self, num_repeats, pga_gain=None, *, on_scanned=None, on_done=None, as_arrays=False):
+        """Init job. Hooks are called with the job:
+           on_scanned on the scanner thread once the exposure is done (before data is read out),
+           on_done on the processing thread with the results.
+           Results are scan results as a dict, or (wavelength, intensity, reference, metadata) with as_arrays
+           if the scanner supports it.
+        """
+        self.job_id = uuid.uuid4().hex
+        self.num_repeats = num_repeats
+        self.pga_gain = pga_gain
+        self.on_scanned = on_scanned
+        self.on_done = on_done
+        self.as_arrays = as_arrays
+
+        # Job state: pending -> running -> done / error.
+        self.state = "pending"
+        self.message = ""
+        self.results = None
+        # Work position (x, y, z) of the exposure, if recorded by the on_scanned hook.
+        self.position = None
+        self.created_time = time.time()
+        self.start_time = None
+        self.end_time = None
+        self.timings = {}
+        self.scanned_event = threading.Event()
+        self.done_event = threading.Event()
+
+    def wait(self, timeout=None):
+        """Wait until done, returns whether it is."""
+        return self.done_event.wait(timeout)
+
+    def wait_scanned(self, timeout=None):
+        """Wait until the exposure is done (or failed), returns whether it is."""
+        return self.scanned_event.wait(timeout)
+
+    def to_dict(self, include_data=True):
+        """Job summary, with scan results once done."""
+        job_dict = {
+            "job_id": self.job_id,
+            "state": self.state,
+            "message": self.message,
+            "num_repeats": self.num_repeats,
+            "created_time": self.created_time,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "timings_ms": dict((stage, seconds * 1000.0) for stage, seconds in self.timings.items()),
+        }
+        if include_data and isinstance(self.results, dict):
+            job_dict["data"] = self.results
+        return job_dict
+
+
+class ScannerWorker:
+    """Own the scanner, serialize calls on a worker thread with a bounded queue."""
+
+    def __init__(self, nirs, *, max_queue_size=16, timing_window=100):
+        self.nirs = nirs
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._process_queue = queue.Queue()
+        self._timings = deque(maxlen=timing_window)
+        self._threads = []
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._run, name="scanner-worker"),
+                         threading.Thread(target=self._process, name="scanner-processing")]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, method_name, *args, block=True, **kwargs):
+        """Queue a call of a scanner method, returns a future of its return value.
+           Raises queue.Full if the queue is full and block is False.
+        """
+        future = Future()
+        self._queue.put((future, method_name, args, kwargs), block=block)
+        return future
+
+    def call(self, method_name, *args, **kwargs):
+        """Call a scanner method on the worker and wait for the result."""
+        return self.submit(method_name, *args, **kwargs).result()
+
+    def submit_scan(self, num_repeats, pga_gain=None, *, on_scanned=None, on_done=None, as_arrays=False,
+                    block=True):
+        """Queue a scan job, raises queue.Full if the queue is full and block is False."""
+        job = ScanJob(num_repeats, pga_gain, on_scanned=on_scanned, on_done=on_done, as_arrays=as_arrays)
+        self._queue.put((job, None, (), {}), block=block)
+        return job
+
+    def queue_size(self):
+        return self._queue.qsize()
+
+    def stage_timings(self):
+        """Per-stage time of recent scans in millisecond.
+           Exposure, readout and transfer share the scanner, processing overlaps with the next scan,
+           so throughput is bound by the larger of the two.
+        """
+        summary = {"n": len(self._timings)}
+        for stage in SCAN_STAGES:
+            samples = [timings[stage] * 1000.0 for timings in list(self._timings) if stage in timings]
+            if len(samples) > 0:
+                summary[stage] = {"mean_ms": float(np.mean(samples)), "max_ms": float(np.max(samples))}
+
+        if all(stage in summary for stage in ["exposure", "readout", "transfer", "processing"]):
+            scanner_ms = sum(summary[stage]["mean_ms"] for stage in ["exposure", "readout", "transfer"])
+            summary["bound_by"] = "scanner" if scanner_ms >= summary["processing"]["mean_ms"] else "processing"
+        return summary
+
+    def _check(self, return_code, stage):
+        # Split scan calls return 0 on success.
+        if (return_code is not None) and (return_code != 0):
+            raise RuntimeError("Scan {} failed with {}.".format(stage, return_code))
+
+    def _run_scan(self, job):
+        """Gain, exposure, readout and transfer as one uninterrupted sequence, then hand over to processing."""
+        job.state = "running"
+        job.start_time = time.time()
+        stage_time = time.perf_counter()
+        job.timings["queued"] = job.start_time - job.created_time
+
+        def _lap(stage):
+            nonlocal stage_time
+            now = time.perf_counter()
+            job.timings[stage] = now - stage_time
+            stage_time = now
+
+        try:
+            if job.pga_gain is not None:
+                self.nirs.set_pga_gain(job.pga_gain)
+
+            # Libraries built without scan_exposure / scan_readout scan in one call, the sample waits for the readout.
+            split = getattr(self.nirs, "has_split_scan", False)
+            if split:
+                self._check(self.nirs.scan_exposure(job.num_repeats), "exposure")
+            else:
+                self.nirs.scan(job.num_repeats)
+            _lap("exposure")
+
+            job.scanned_event.set()
+            if job.on_scanned is not None:
+                job.on_scanned(job)
+
+            if split:
+                self._check(self.nirs.scan_readout(), "readout")
+                _lap("readout")
+
+            if job.as_arrays and hasattr(self.nirs, "get_scan_arrays"):
+                job.results = self.nirs.get_scan_arrays()
+            else:
+                job.results = self.nirs.get_scan_results()
+            _lap("transfer")
+        except Exception as e:
+            job.state = "error"
+            job.message = str(e)
+
+        job.scanned_event.set()
+        self._process_queue.put(job)
+
+    def _run(self):
+        """Run queued calls one by one."""
+        while threading.main_thread().is_alive():
+            try:
+                item, method_name, args, kwargs = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            if isinstance(item, ScanJob):
+                self._run_scan(item)
+                continue
+
+            if not item.set_running_or_notify_cancel():
+                continue
+            try:
+                item.set_result(getattr(self.nirs, method_name)(*args, **kwargs))
+            except Exception as e:
+                item.set_exception(e)
+
+    def _process(self):
+        """Run on_done hooks of scanned jobs in order."""
+        while threading.main_thread().is_alive():
+            try:
+                job = self._process_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            if job.state != "error":
+                start_time = time.perf_counter()
+                try:
+                    if job.on_done is not None:
+                        job.on_done(job)
+                    job.state = "done"
+                except Exception as e:
+                    job.state = "error"
+                    job.message = str(e)
+                job.timings["processing"] = time.perf_counter() - start_time
+                self._timings.append(dict(job.timings))
+
+            job.end_time = time.time()
+            job.done_event.set()
@@ -0,0 +1,200 @@
+# shared.py
+# Plotter state and image of the hardware daemon, published in shared memory for its web workers.
+# Each part is guarded by a sequence counter (seqlock): odd while the daemon writes it,
+# readers copy without locking and retry if the counter moved during the copy.
+
+import time
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+from .utils import NIRSImage
+from .render import image_tag
+
+
+HEADER_DTYPE = np.dtype([
+    ("closed", np.uint8),
+    ("heartbeat", np.float64),
+    # Plotter state, "seq" is the sequence number of the snapshot and not part of the seqlock.
+    ("state_seq", np.uint64),
+    ("seq", np.int64),
+    ("time", np.float64),
+    ("state", "S32"),
+    ("position", np.float64, 3),
+    ("targeting", np.float64, 3),
+    # Image, the data is in segment "<name>_<generation>", a new image gets a new segment.
+    ("image_seq", np.uint64),
+    ("generation", np.uint64),
+    ("image_tag", "S32"),
+    ("version", np.int64),
+    ("shape", np.int64, 2),
+    ("pixel_size_mm", np.float64, 2),
+    ("percentiles", np.float64, 2),
+], align=True)
+
+
+def create_segment(name, size):
+    """Create a shared memory segment, replacing a leftover of a crashed daemon."""
+    try:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        shared_memory.SharedMemory(name=name).unlink()
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+
+def attach_segment(name):
+    """Attach to a segment of the daemon, raises FileNotFoundError if there is none."""
+    segment = shared_memory.SharedMemory(name=name)
+    # Only the daemon removes its segments, not the resource tracker of a worker at exit.
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+def image_arrays(segment, shape):
+    """Image and scan flags in an image segment."""
+    img = np.ndarray(shape, dtype=np.float64, buffer=segment.buf)
+    scan_flags = np.ndarray(shape, dtype=bool, buffer=segment.buf, offset=img.nbytes)
+    return img, scan_flags
+
+
+class ImageSnapshot:
+    """Consistent copy of the published image, renders like the NIRSImage it was copied from."""
+
+    normalize_array = NIRSImage.normalize_array
+
+    def __init__(self, image_tag, version, img, scan_flags, pixel_size_mm, percentiles):
+        self.image_tag = image_tag
+        self.version = version
+        self.img = img
+        self.scan_flags = scan_flags
+        self.shape = img.shape
+        self.pixel_size_mm_x, self.pixel_size_mm_y = pixel_size_mm
+        self._low_percentile, self._high_percentile = percentiles
+
+    def get_image(self):
+        """Return image array, transposed as NIRSImage.get_image."""
+        return self.img.transpose()
+
+
+class SharedState:
+    """Shared plotter state and image, written by the daemon only (create=True), read by web workers."""
+
+    def __init__(self, name, *, create=False):
+        """Create or attach, attaching raises FileNotFoundError if the daemon has not created it."""
+        self.name = name
+        self.create = create
+        if create:
+            self._segment = create_segment(name, HEADER_DTYPE.itemsize)
+        else:
+            self._segment = attach_segment(name)
+        self._header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self._segment.buf)
+
+        # Writer: last published state and image. Reader: (segment, img, scan_flags) of the attached generation,
+        # the segment goes first so that it is released after the arrays viewing it.
+        self._published_state = None
+        self._published_image = None
+        self._image = None
+        self._generation = 0
+
+    def is_live(self, max_age_s):
+        """Whether the daemon has published recently."""
+        return (self._header["closed"] == 0) and (time.time() - float(self._header["heartbeat"]) < max_age_s)
+
+    def beat(self):
+        self._header["heartbeat"] = time.time()
+
+    def publish_state(self, plotter_state):
+        """Write a plotter state snapshot if newer than the last one."""
+        if plotter_state["seq"] == self._published_state:
+            return
+
+        self._header["state_seq"] += 1
+        self._header["seq"] = plotter_state["seq"]
+        self._header["time"] = plotter_state["time"]
+        self._header["state"] = str(plotter_state["state"]).encode()[:HEADER_DTYPE["state"].itemsize]
+        self._header["position"] = plotter_state["position"]
+        self._header["targeting"] = plotter_state["targeting"]
+        self._header["state_seq"] += 1
+        self._published_state = plotter_state["seq"]
+
+    def publish_image(self, image):
+        """Write the image if changed, the version is read first so that a racing update is written next time."""
+        version = image.version
+        if (image_tag(image), version) == self._published_image:
+            return
+
+        old_image = None
+        if (self._image is None) or (self._published_image[0] != image_tag(image)):
+            old_image = self._image
+            self._generation += 1
+            num_pixels = int(np.prod(image.shape))
+            segment = create_segment("{}_{}".format(self.name, self._generation),
+                                     num_pixels * (np.dtype(np.float64).itemsize + np.dtype(bool).itemsize))
+            self._image = (segment,) + image_arrays(segment, image.shape)
+
+        self._header["image_seq"] += 1
+        np.copyto(self._image[1], image.img)
+        np.copyto(self._image[2], image.scan_flags)
+        self._header["generation"] = self._generation
+        self._header["image_tag"] = image_tag(image).encode()
+        self._header["version"] = version
+        self._header["shape"] = image.shape
+        self._header["pixel_size_mm"] = (image.pixel_size_mm_x, image.pixel_size_mm_y)
+        self._header["percentiles"] = (image._low_percentile, image._high_percentile)
+        self._header["image_seq"] += 1
+        self._published_image = (image_tag(image), version)
+
+        # Workers still attached to the old segment keep their mapping until they move on.
+        if old_image is not None:
+            old_image[0].unlink()
+
+    def read_state(self):
+        """Copy of the plotter state snapshot."""
+        while True:
+            seq = int(self._header["state_seq"])
+            if seq % 2 == 0:
+                plotter_state = {
+                    "seq": int(self._header["seq"]),
+                    "time": float(self._header["time"]),
+                    "state": self._header["state"].item().decode(),
+                    "position": tuple(self._header["position"].tolist()),
+                    "targeting": tuple(self._header["targeting"].tolist()),
+                }
+                if int(self._header["state_seq"]) == seq:
+                    return plotter_state
+            time.sleep(0)
+
+    def read_image(self):
+        """Copy of the image as an ImageSnapshot, None if none is published yet."""
+        while True:
+            seq = int(self._header["image_seq"])
+            if seq % 2 == 1:
+                time.sleep(0)
+                continue
+            generation = int(self._header["generation"])
+            if generation == 0:
+                return None
+
+            attached = self._image
+            if generation != self._generation:
+                try:
+                    segment = attach_segment("{}_{}".format(self.name, generation))
+                    attached = (segment,) + image_arrays(segment, tuple(self._header["shape"]))
+                except (FileNotFoundError, TypeError, ValueError):
+                    # Replaced again meanwhile, or a torn shape.
+                    time.sleep(0)
+                    continue
+
+            snapshot = ImageSnapshot(self._header["image_tag"].item().decode(), int(self._header["version"]),
+                                     attached[1].copy(), attached[2].copy(),
+                                     tuple(self._header["pixel_size_mm"].tolist()),
+                                     tuple(self._header["percentiles"].tolist()))
+            if int(self._header["image_seq"]) == seq:
+                self._image, self._generation = attached, generation
+                return snapshot
+
+    def unlink(self):
+        """Remove the segments, workers see the daemon closed. Mappings stay valid until the process exits."""
+        self._header["closed"] = 1
+        self._segment.unlink()
+        if self._image is not None:
+            self._image[0].unlink()
@@ -0,0 +1,370 @@
+# simulation.py
+# Simulated NIRScan Nano and GRBL plotter for running without hardware.
+
+import os
+import re
+import time
+import tty
+import queue
+import select
+import threading
+import numpy as np
+from collections import namedtuple
+
+
+# Same fields as pynirs.NIRS.ScanMetadata, which needs the compiled library to import.
+ScanMetadata = namedtuple("ScanMetadata", ["header_version", "scan_name", "scan_time", "temperature_system",
+                                           "temperature_detector", "humidity", "pga", "valid_length"])
+
+
+class SimulatedNIRS:
+    """Simulated NIRScan Nano, same interface as pynirs.NIRS."""
+
+    class TYPES:
+        COLUMN_TYPE = 0
+        HADAMARD_TYPE = 1
+        SLEW_TYPE = 2
+
+    has_split_scan = True
+
+    def __init__(self, *, scan_latency_s=0.5, repeat_latency_s=0.05, readout_latency_s=0.0, noise_level=0.01,
+                 temperature_drift_per_min=0.05, position_getter=None, seed=None):
+        """Init instance.
+           Exposure takes scan_latency_s + repeat_latency_s * num_repeats, data transfer readout_latency_s.
+           position_getter returns the current (x, y, z) in millimeter, used to draw a synthetic sample.
+        """
+        self.scan_latency_s = scan_latency_s
+        self.repeat_latency_s = repeat_latency_s
+        self.readout_latency_s = readout_latency_s
+        self.noise_level = noise_level
+        self.temperature_drift_per_min = temperature_drift_per_min
+        self.position_getter = position_getter
+        self._rng = np.random.default_rng(seed)
+        self._start_time = time.time()
+
+        # Device settings.
+        self.num_patterns = 228
+        self.wavelength_start_nm = 900
+        self.wavelength_end_nm = 1700
+        self.pga = 64
+        self.lamp_on = False
+        self.hibernate = True
+
+        # Last scan.
+        self._wavelength = np.zeros(0, dtype=np.float64)
+        self._intensity = np.zeros(0, dtype=np.intc)
+        self._reference = np.zeros(0, dtype=np.intc)
+        self._metadata = None
+        self._exposure = None
+
+    def _cleanup(self):
+        pass
+
+    def _lamp_profile(self, wavelength):
+        """Halogen lamp through the optics, peaks around 1300 nm."""
+        return 20000 * np.exp(-((wavelength - 1300) / 350) ** 2) + 2000
+
+    def _sample_absorbance(self, wavelength, position=None):
+        """Synthetic sample: ink spots on paper, absorbing around 1450 nm."""
+        ink = 0.0
+        if position is not None:
+            x, y = position[:2]
+            ink = 0.5 + 0.5 * np.sin(x / 8.0) * np.cos(y / 8.0)
+        return 0.05 + 0.4 * ink * np.exp(-((wavelength - 1450) / 60) ** 2)
+
+    def scan_snr(self, scan_type="hadamard"):
+        return {"snr_100ms": 5000.0, "snr_500ms": 10000.0, "snr_1s": 15000.0}
+
+    def scan(self, num_repeats=1):
+        self.scan_exposure(num_repeats)
+        self.scan_readout()
+
+    def scan_exposure(self, num_repeats=1):
+        # The sample is seen during the exposure.
+        position = None if self.position_getter is None else list(self.position_getter())
+        time.sleep(self.scan_latency_s + self.repeat_latency_s * num_repeats)
+        self._exposure = (num_repeats, position)
+        return 0
+
+    def scan_readout(self):
+        time.sleep(self.readout_latency_s)
+        if self._exposure is None:
+            return -1
+        num_repeats, position = self._exposure
+
+        # Temperature drift.
+        elapsed_min = (time.time() - self._start_time) / 60.0
+        temperature_detector = 30.0 + self.temperature_drift_per_min * elapsed_min
+        temperature_system = temperature_detector - 2.0
+
+        # Synthetic spectra, noise averages down with repeats.
+        wavelength = np.linspace(self.wavelength_start_nm, self.wavelength_end_nm, self.num_patterns)
+        gain = self.pga / 64.0 * (1.0 - 0.002 * (temperature_detector - 30.0))
+        reference = self._lamp_profile(wavelength) * gain
+        intensity = reference * 10 ** (-self._sample_absorbance(wavelength, position))
+        noise = self._rng.normal(0, self.noise_level / np.sqrt(num_repeats), wavelength.shape)
+        intensity = intensity * (1.0 + noise)
+
+        now = time.gmtime()
+        self._wavelength = wavelength
+        self._intensity = np.round(intensity).astype(np.intc)
+        self._reference = np.round(reference).astype(np.intc)
+        self._metadata = ScanMetadata(
+            header_version=1,
+            scan_name="simulated",
+            scan_time=time.strftime("%Y%m%d%H%M%S", now),
+            temperature_system=round(temperature_system, 2),
+            temperature_detector=round(temperature_detector, 2),
+            humidity=40.0,
+            pga=self.pga,
+            valid_length=self.num_patterns)
+        return 0
+
+    def get_scan_results(self):
+        if self._metadata is None:
+            return {}
+
+        return {
+            "header_version": str(self._metadata.header_version),
+            "scan_name": self._metadata.scan_name,
+            "scan_time": self._metadata.scan_time,
+            "temperature_system": self._metadata.temperature_system,
+            "temperature_detector": self._metadata.temperature_detector,
+            "humidity": self._metadata.humidity,
+            "pga": self._metadata.pga,
+            "wavelength": [float("{:f}".format(v)) for v in self._wavelength],
+            "intensity": self._intensity.tolist(),
+            "reference": self._reference.tolist(),
+            "valid_length": self._metadata.valid_length,
+        }
+
+    def get_scan_metadata(self):
+        return self._metadata
+
+    def get_scan_arrays(self, copy=True):
+        wavelength, intensity, reference = self._wavelength, self._intensity, self._reference
+        if copy:
+            wavelength, intensity, reference = np.copy(wavelength), np.copy(intensity), np.copy(reference)
+
+        return wavelength, intensity, reference, self._metadata
+
+    def display_version(self):
+        return 0
+
+    def set_hibernate(self, new_value: bool):
+        self.hibernate = bool(new_value)
+        return 0
+
+    def set_config(self, scanConfigIndex=8, scan_type=1, num_patterns=228, num_repeats=6,
+                   wavelength_start_nm=900, wavelength_end_nm=1700, width_px=7):
+        self.num_patterns = num_patterns
+        self.wavelength_start_nm = wavelength_start_nm
+        self.wavelength_end_nm = wavelength_end_nm
+
+    def set_pga_gain(self, new_value):
+        self.pga = int(new_value)
+
+    def set_lamp_on_off(self, new_value):
+        self.lamp_on = bool(new_value)
+
+    def clear_error_status(self):
+        pass
+
+
+class FakeGrbl:
+    """GRBL controller simulated behind a pseudo terminal.
+       Open port_name with pyserial as if it was the plotter.
+    """
+
+    # G-codes understood, others are answered with "error:20" (unsupported command) as GRBL does.
+    SUPPORTED_G_CODES = (0, 1, 4, 10, 20, 21, 90, 91)
+
+    def __init__(self, *, max_feed_mm_min=3000, speed_factor=1.0, rx_buffer_size=128, planner_size=15):
+        """Init instance and start serving.
+           speed_factor > 1 runs motion faster than real time.
+           Lines are answered once their moves fit in the planner, received bytes beyond rx_buffer_size
+           are counted in rx_overflows like lost characters on a real controller.
+        """
+        self.max_feed_mm_min = max_feed_mm_min
+        self.speed_factor = speed_factor
+        self.rx_buffer_size = rx_buffer_size
+        self.rx_overflows = 0
+
+        # Pseudo terminal.
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._slave_fd)
+        self.port_name = os.ttyname(self._slave_fd)
+
+        # Machine state.
+        self.state = "Alarm"
+        self.position = np.zeros(3)
+        self.work_offset = np.zeros(3)
+        self.absolute_mode = True
+        self.feed = 1000.0
+        self._lock = threading.Lock()
+
+        # Lines are parsed from the receive buffer, motion is executed in order by a planner thread.
+        self._rx = queue.Queue()
+        self._rx_used = 0
+        self._planner = queue.Queue(maxsize=planner_size)
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+        threading.Thread(target=self._serve, daemon=True).start()
+        threading.Thread(target=self._parse, daemon=True).start()
+        threading.Thread(target=self._execute, daemon=True).start()
+
+        # As a board resetting when the port opens.
+        self._write("Grbl 1.1h ['$' for help]")
+
+    def close(self):
+        """Close the pseudo terminal and stop the threads."""
+        with self._write_lock:
+            self._closed.set()
+            os.close(self._master_fd)
+            os.close(self._slave_fd)
+        self._rx.put(None)
+
+    def _plan(self, move):
+        """Queue a move (None for a dwell), blocks while the planner is full."""
+        while not self._closed.is_set():
+            try:
+                self._planner.put(move, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _write(self, message):
+        with self._write_lock:
+            if not self._closed.is_set():
+                os.write(self._master_fd, (message + "\r\n").encode())
+
+    def _status_report(self):
+        with self._lock:
+            wpos = self.position - self.work_offset
+            return "<{}|WPos:{:.3f},{:.3f},{:.3f}|FS:{:d},0>".format(
+                self.state, wpos[0], wpos[1], wpos[2], int(self.feed))
+
+    def _serve(self):
+        """Read incoming bytes, answer real-time commands at once and buffer lines."""
+        line = b""
+        while not self._closed.is_set():
+            try:
+                if len(select.select([self._master_fd], [], [], 0.1)[0]) == 0:
+                    continue
+                data = os.read(self._master_fd, 1024)
+            except (OSError, ValueError):
+                return
+
+            for byte in data:
+                char = bytes([byte])
+                if char == b"?":
+                    # Real-time status query.
+                    self._write(self._status_report())
+                    continue
+
+                with self._lock:
+                    if self._rx_used >= self.rx_buffer_size:
+                        self.rx_overflows += 1
+                        continue
+                    self._rx_used += 1
+                line += char
+                if char == b"\n":
+                    self._rx.put(line)
+                    line = b""
+
+    def _parse(self):
+        """Handle buffered lines, blocks while the planner is full."""
+        while True:
+            # A line leaves the receive buffer as it is parsed, before it is answered.
+            line = self._rx.get()
+            if line is None:
+                return
+            with self._lock:
+                self._rx_used -= len(line)
+            self._handle_line(line.decode(errors="ignore").strip().upper())
+
+    def _handle_line(self, line):
+        """Interpret a G-code line."""
+        if line == "$X":
+            with self._lock:
+                if self.state == "Alarm":
+                    self.state = "Idle"
+            self._write("[MSG:Caution: Unlocked]")
+            self._write("ok")
+            return
+        if line.startswith("$"):
+            self._write("ok")
+            return
+
+        words = dict((letter, float(value)) for letter, value in re.findall(r"([A-Z])\s*(-?[0-9.]+)", line))
+        codes = [int(float(value)) for value in re.findall(r"G\s*([0-9.]+)", line)]
+        if any(code not in self.SUPPORTED_G_CODES for code in codes):
+            self._write("error:20")
+            return
+
+        if 10 in codes:
+            # G10 P1 L20: set work coordinates.
+            with self._lock:
+                for idx, axis in enumerate("XYZ"):
+                    if axis in words:
+                        self.work_offset[idx] = self.position[idx] - words[axis]
+        elif any(axis in words for axis in "XYZ"):
+            if 91 in codes:
+                self.absolute_mode = False
+            if 90 in codes:
+                self.absolute_mode = True
+            if "F" in words:
+                self.feed = min(words["F"], self.max_feed_mm_min)
+            self._plan((dict((axis, words[axis]) for axis in "XYZ" if axis in words), self.absolute_mode, self.feed))
+        else:
+            if 91 in codes:
+                self.absolute_mode = False
+            if 90 in codes:
+                self.absolute_mode = True
+            if 4 in codes:
+                # Dwell, acknowledged once motion before it is done.
+                self._plan(None)
+                return
+
+        self._write("ok")
+
+    def _execute(self):
+        """Run planned moves with linear motion at the feed rate."""
+        while not self._closed.is_set():
+            try:
+                move = self._planner.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if move is None:
+                with self._lock:
+                    if self._planner.empty():
+                        self.state = "Idle"
+                self._write("ok")
+                continue
+
+            target_words, absolute_mode, feed = move
+            with self._lock:
+                start = np.copy(self.position)
+                target = np.copy(start)
+                for idx, axis in enumerate("XYZ"):
+                    if axis in target_words:
+                        if absolute_mode:
+                            target[idx] = target_words[axis] + self.work_offset[idx]
+                        else:
+                            target[idx] = start[idx] + target_words[axis]
+                self.state = "Run"
+
+            distance = np.linalg.norm(target - start)
+            duration = distance / max(feed, 1.0) * 60.0 / self.speed_factor
+            start_time = time.time()
+            while True:
+                progress = 1.0 if duration <= 0 else min((time.time() - start_time) / duration, 1.0)
+                with self._lock:
+                    self.position = start + (target - start) * progress
+                if (progress >= 1.0) or self._closed.is_set():
+                    break
+                time.sleep(0.005)
+
+            with self._lock:
+                if self._planner.empty():
+                    self.state = "Idle"
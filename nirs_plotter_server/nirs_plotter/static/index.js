@@ -25,7 +25,11 @@ var app = new Vue({
             "move": "move",
             "unlock": "unlock",
             "setzero": "zero",
-        }
+            "events": "events",
+        },
+        eventSource: null,
+        imageFetching: false,
+        imageOutdated: false,
     },
     methods: {
         drawTargetPoint: function (ctx) {
@@ -39,16 +43,19 @@ var app = new Vue({
         unlockPlotter: function () {
             fetch(this.api + this.endpoints.unlock);
         },
+        setMetadata: function (data) {
+            this.workspaceSizeMm = data["workspace_size_mm"];
+            this.pixelSizeMm = data["pixel_size_mm"];
+            this.outputResolution = data["output_resolution"];
+            this.originalPointCoordinates = data["original_point_coordinates"];
+            this.xyFactors = data["xy_factors"];
+        },
         getMetadata: function () {
             fetch(this.api + this.endpoints.metadata)
                 .then(response => {
                     response.json().then(data => {
                         // Set metadata.
-                        this.workspaceSizeMm = data["workspace_size_mm"];
-                        this.pixelSizeMm = data["pixel_size_mm"];
-                        this.outputResolution = data["output_resolution"];
-                        this.originalPointCoordinates = data["original_point_coordinates"];
-                        this.xyFactors = data["xy_factors"];
+                        this.setMetadata(data);
                     });
                 });
         },
@@ -58,6 +65,7 @@ var app = new Vue({
             if (validURL(newApi)) {
                 this.api = newApi;
                 this.getMetadata();
+                this.startEvents();
                 this.message = "API updated.";
             } else {
                 // DEBUG.
@@ -141,15 +149,7 @@ var app = new Vue({
         imageFetch: function () {
             return fetch(this.api + this.endpoints.image);
         },
-        loopFetch: function () {
-            this.imageFetch()
-                .then(function (response) {
-                    let headers = response.headers;
-                    thisApp.plotterState = headers.get("Plotter-State");
-                    thisApp.plotterPosition = JSON.parse(headers.get("Plotter-Position"));
-                    return response.blob();
-                })
-                .then(function (imageBlob) {
+        drawImageBlob: function (imageBlob) {
                     // console.log("Updating image.");
 
                     // Draw on canvas with buffering.
@@ -184,7 +184,18 @@ var app = new Vue({
                     };
 
                     image.src = imageUrl;
-
+        },
+        loopFetch: function () {
+            // Polling fallback without Server-Sent Events.
+            this.imageFetch()
+                .then(function (response) {
+                    let headers = response.headers;
+                    thisApp.plotterState = headers.get("Plotter-State");
+                    thisApp.plotterPosition = JSON.parse(headers.get("Plotter-Position"));
+                    return response.blob();
+                })
+                .then(function (imageBlob) {
+                    thisApp.drawImageBlob(imageBlob);
                     setTimeout(thisApp.loopFetch, 500);
                 })
                 .catch(function (error) {
@@ -192,6 +203,43 @@ var app = new Vue({
                     setTimeout(thisApp.loopFetch, 1000);
                 });
         },
+        requestImage: function () {
+            // Fetch image on change, at most one request in flight.
+            if (this.imageFetching) {
+                this.imageOutdated = true;
+                return;
+            }
+            this.imageFetching = true;
+            this.imageOutdated = false;
+            this.imageFetch()
+                .then(response => response.blob())
+                .then(imageBlob => thisApp.drawImageBlob(imageBlob))
+                .catch(error => console.log(error))
+                .finally(() => {
+                    thisApp.imageFetching = false;
+                    if (thisApp.imageOutdated) {
+                        thisApp.requestImage();
+                    }
+                });
+        },
+        startEvents: function () {
+            // Subscribe to pushed state and image updates.
+            if (this.eventSource !== null) {
+                this.eventSource.close();
+            }
+            this.eventSource = new EventSource(this.api + this.endpoints.events);
+            this.eventSource.addEventListener("state", event => {
+                let data = JSON.parse(event.data);
+                thisApp.plotterState = data["state"];
+                thisApp.plotterPosition = {"x": data["position"][0], "y": data["position"][1], "z": data["position"][2]};
+                thisApp.requestImage();
+            });
+            this.eventSource.addEventListener("pixels", () => thisApp.requestImage());
+            this.eventSource.addEventListener("metadata", event => {
+                thisApp.setMetadata(JSON.parse(event.data));
+                thisApp.requestImage();
+            });
+        },
     },
     mounted() {
 
@@ -233,7 +281,11 @@ var app = new Vue({
         // Get metadata.
         this.getMetadata();
 
-        // Start fetch plotter status.
-        this.loopFetch();
+        // Start fetch plotter status, pushed if supported.
+        if (window.EventSource) {
+            this.startEvents();
+        } else {
+            this.loopFetch();
+        }
     }
 });
@@ -1,3 +1,357 @@
-from django.test import TestCase
+import io
+import json
+import time
+from unittest import mock
+from collections import namedtuple
 
-# Create your tests here.
+import numpy as np
+
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory
+
+from .apps import NirsPlotterConfig, build_raster_path, create_plotter_figure, store_scan_results
+from .codec import NPZ_CONTENT_TYPE, scan_results_to_arrays, encode_npz, arrays_response
+from .grbl import GrblConnection, GrblError, PlotterState
+from .simulation import FakeGrbl
+from .utils import NIRSImage
+from .views import get_plotter_map, parse_index, pixel_model
+
+from NIRSignal.NIRSignal import invalid_to_nearest, moving_average, get_processing_plan, process_signals
+
+
+def new_image(width=8, height=4, pixel_size_mm=1.0, **kwargs):
+    """In-memory image with a figure of matching size."""
+    fig, ax = create_plotter_figure({"x": width * pixel_size_mm, "y": height * pixel_size_mm})
+    return NIRSImage(width, height, pixel_size_mm, pixel_size_mm, fig, ax, **kwargs)
+
+
+def synthetic_spectra(n_spectra, n_wavelengths=228, seed=0):
+    """Wavelength axis, intensity and reference spectra like the simulated scanner's."""
+    rng = np.random.default_rng(seed)
+    wavelength = np.linspace(900, 1700, n_wavelengths)
+    reference = np.round(20000 * np.exp(-((wavelength - 1300) / 350) ** 2) + 2000)
+    intensity = np.round(reference * rng.uniform(0.3, 0.9, (n_spectra, 1))
+                         * (1 + rng.normal(0, 0.01, (n_spectra, n_wavelengths))))
+    return wavelength, intensity.astype(np.int32), np.tile(reference, (n_spectra, 1)).astype(np.int32)
+
+
+def invalid_to_nearest_loop(signal):
+    """Per-sample reference of invalid_to_nearest on a 1-D signal."""
+    signal = np.asarray(signal, dtype=float)
+    valid = np.flatnonzero(np.isfinite(signal))
+    new_signal = np.copy(signal)
+    if len(valid) == 0:
+        return new_signal
+    for idx in np.flatnonzero(~np.isfinite(signal)):
+        left, right = valid[valid < idx], valid[valid > idx]
+        if len(left) == 0:
+            new_signal[idx] = signal[right[0]]
+        elif len(right) == 0:
+            new_signal[idx] = signal[left[-1]]
+        else:
+            # Ties go to the right.
+            mid = int(np.ceil((left[-1] + right[0]) / 2))
+            new_signal[idx] = signal[left[-1]] if idx < mid else signal[right[0]]
+    return new_signal
+
+
+def process_signal_loop(wavelength_list, raw_intensity, raw_reference, reference_spectrum, *,
+                        selected_indexes=None, absorbance_mode=True):
+    """Reference processing of one spectrum, step by step with the default parameters."""
+    from scipy.signal import savgol_filter
+    if selected_indexes is not None:
+        wavelength_list = wavelength_list[selected_indexes]
+        raw_intensity = raw_intensity[selected_indexes]
+        raw_reference = raw_reference[selected_indexes]
+        reference_spectrum = reference_spectrum[selected_indexes]
+
+    processed = savgol_filter(raw_intensity.astype(float), window_length=11, polyorder=3)
+    if absorbance_mode:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            processed = -np.log10(processed / raw_reference) - reference_spectrum
+        processed = invalid_to_nearest_loop(processed)
+    processed = moving_average(processed, N=11)
+    return wavelength_list[::8], processed[::8]
+
+
+class SignalProcessingTests(SimpleTestCase):
+
+    def test_invalid_to_nearest_matches_loop(self):
+        rng = np.random.default_rng(1)
+        signals = rng.normal(size=(50, 40))
+        signals[rng.random(signals.shape) < 0.3] = np.nan
+        signals[0, :5] = np.inf
+        signals[1, -5:] = np.nan
+        signals[2, :] = np.nan
+
+        filled = invalid_to_nearest(signals)
+        for signal, expected in zip(signals, filled):
+            np.testing.assert_array_equal(invalid_to_nearest_loop(signal), expected)
+        self.assertTrue(np.isnan(signals[3:]).any(), "Input is not modified by default.")
+
+    def test_plan_matches_reference(self):
+        wavelength, intensity, reference = synthetic_spectra(6)
+        intensity[0, 100:130] = -100  # Invalid absorbance, filled with the nearest values.
+        reference_spectrum = np.linspace(0.0, 0.1, len(wavelength))
+        for selected_indexes in [None, np.arange(10, 220)]:
+            for absorbance_mode in [True, False]:
+                plan = get_processing_plan(wavelength, reference_spectrum, selected_indexes=selected_indexes,
+                                           absorbance_mode=absorbance_mode)
+                batch = plan.apply(intensity, reference)
+                wavelength_processed, _ = process_signals(wavelength, intensity, reference, reference_spectrum,
+                                                          selected_indexes=selected_indexes,
+                                                          absorbance_mode=absorbance_mode)
+                for idx in range(len(intensity)):
+                    expected_wavelength, expected = process_signal_loop(
+                        wavelength, intensity[idx], reference[idx], reference_spectrum,
+                        selected_indexes=selected_indexes, absorbance_mode=absorbance_mode)
+                    np.testing.assert_allclose(batch[idx], expected, rtol=1e-9, atol=1e-9)
+                np.testing.assert_array_equal(wavelength_processed, expected_wavelength)
+
+    def test_moving_average_along_axis(self):
+        from scipy.ndimage import uniform_filter1d
+        signals = np.random.default_rng(2).normal(size=(5, 40))
+        np.testing.assert_allclose(NIRSImage._moving_average(signals, 11),
+                                   [uniform_filter1d(signal, size=11, mode="reflect") for signal in signals])
+
+
+class NIRSImageTests(SimpleTestCase):
+
+    def test_parses_only_dirty_pixels(self):
+        image = new_image()
+        wavelength, intensity, reference = synthetic_spectra(3)
+        for idx, (ix, iy) in enumerate([(0, 0), (1, 2), (1, 2)]):
+            image.set_pixel_arrays(ix, iy, wavelength, intensity[idx], reference[idx])
+
+        idx_x, idx_y = image.parse_all_pixels()
+        self.assertEqual(sorted(zip(idx_x.tolist(), idx_y.tolist())), [(0, 0), (1, 2)])
+        self.assertAlmostEqual(image.img[1, 2], np.mean(intensity[2]), places=3)
+        self.assertTrue(np.all(image.img[~image.scan_flags] < 0), "Unscanned pixels keep their value.")
+        self.assertEqual(len(image.parse_all_pixels()[0]), 0)
+
+    def test_failed_parsing_keeps_dirty_pixels(self):
+        image = new_image()
+        wavelength, intensity, reference = synthetic_spectra(1)
+        image.set_pixel_arrays(3, 1, wavelength, intensity[0], reference[0])
+
+        predict = image.model.predict
+        image.model.predict = lambda spectra, wavelength: 1 / 0
+        with self.assertRaises(ZeroDivisionError):
+            image.parse_all_pixels()
+        image.model.predict = predict
+        idx_x, idx_y = image.parse_all_pixels()
+        self.assertEqual((idx_x.tolist(), idx_y.tolist()), ([3], [1]))
+
+    def test_model_is_fitted_once(self):
+        image = new_image()
+        image.set_model("pca", min_samples=3)
+        wavelength, intensity, reference = synthetic_spectra(5)
+        for idx in range(2):
+            image.set_pixel_arrays(idx, 0, wavelength, intensity[idx], reference[idx])
+        self.assertEqual(len(image.parse_all_pixels()[0]), 2)
+        self.assertTrue(np.all(np.isnan(image.img[:2, 0])))
+        self.assertEqual(len(image.parse_all_pixels()[0]), 0, "Not fitted again below min_samples.")
+
+        # The whole image is parsed again once when the model is fitted, later only new pixels.
+        image.set_pixel_arrays(0, 1, wavelength, intensity[2], reference[2])
+        image.set_pixel_arrays(0, 1, wavelength, intensity[2], reference[2])
+        self.assertEqual(len(image.parse_all_pixels()[0]), 3)
+        self.assertTrue(np.all(np.isfinite(image.img[image.scan_flags])))
+        components = image.model.components
+        image.set_pixel_arrays(1, 1, wavelength, intensity[3], reference[3])
+        self.assertEqual(len(image.parse_all_pixels()[0]), 1)
+        self.assertIs(image.model.components, components)
+
+    def test_pixel_data_round_trip(self):
+        image = new_image()
+        self.assertIsNone(image.get_pixel_data(2, 3))
+
+        wavelength, intensity, reference = synthetic_spectra(1)
+        image.set_pixel_data(2, 3, {"wavelength": wavelength.tolist(), "intensity": intensity[0].tolist(),
+                                    "reference": reference[0].tolist(), "temperature_system": 28.5,
+                                    "humidity": 40.0, "pga": 64})
+        data = image.get_pixel_data(2, 3)
+        self.assertEqual(data["intensity"], intensity[0].tolist())
+        self.assertEqual(data["reference"], reference[0].tolist())
+        self.assertEqual((data["temperature_system"], data["humidity"], data["pga"]), (28.5, 40.0, 64))
+        self.assertTrue(np.isnan(data["temperature_detector"]))
+        self.assertEqual(image.intensity.shape, image.shape + (len(wavelength),))
+        self.assertEqual(image.intensity.dtype, np.int32)
+
+    def test_pixel_arrays_of_region(self):
+        image = new_image()
+        self.assertEqual(image.get_pixel_arrays()["intensity"].shape, (0, 0))
+
+        wavelength, intensity, reference = synthetic_spectra(2)
+        image.set_pixel_arrays(2, 1, wavelength, intensity[0], reference[0], pga=32)
+        image.set_pixel_arrays(5, 3, wavelength, intensity[1], reference[1])
+        arrays = image.get_pixel_arrays(slice(0, 4), slice(None))
+        self.assertEqual((arrays["ix"].tolist(), arrays["iy"].tolist(), arrays["pga"].tolist()), ([2], [1], [32]))
+        np.testing.assert_array_equal(arrays["intensity"][0], intensity[0])
+
+    def test_spectrum_length_must_match(self):
+        image = new_image()
+        wavelength, intensity, reference = synthetic_spectra(1)
+        image.set_pixel_arrays(0, 0, wavelength, intensity[0], reference[0])
+        with self.assertRaises(ValueError):
+            image.set_pixel_arrays(1, 0, wavelength[:-1], intensity[0, :-1], reference[0, :-1])
+        self.assertFalse(image.scan_flags[1, 0])
+
+
+
+class RasterPathTests(SimpleTestCase):
+
+    def test_region_is_half_open(self):
+        image = new_image(width=10, height=5, pixel_size_mm=2.0)
+        pixels = build_raster_path(image, [0, 10], [0, 4])
+        self.assertEqual(pixels[:5], [(ix, 0) for ix in range(5)])
+        self.assertEqual(pixels[5:], [(ix, 1) for ix in reversed(range(5))])
+
+        self.assertEqual(build_raster_path(image, [3, 5.5], [1, 1]), [(1, 0), (2, 0)])
+        self.assertEqual(build_raster_path(image, [4, 4], [0, 0]), [(2, 0)])
+        self.assertEqual(build_raster_path(image, [0, 10], [-10, 0]), [])
+        self.assertEqual(len(build_raster_path(image, [0, 100], [0, 100])), 50)
+
+class GrblConnectionTests(SimpleTestCase):
+
+    def setUp(self):
+        import serial
+        self.fake = FakeGrbl(speed_factor=100, rx_buffer_size=64)
+        self.addCleanup(self.fake.close)
+        self.connection = GrblConnection(serial.Serial(self.fake.port_name, 115200), PlotterState(),
+                                         status_interval_s=0.05, rx_buffer_size=64)
+        self.connection.start()
+        self.addCleanup(self.connection.port.close)
+        self.assertTrue(self.connection.wait_ready(5))
+
+    def test_streaming_never_overflows(self):
+        self.connection.send("$X").result(5)
+        program = ["G91 G1 G21 X{:.3f} Y0.500 F3000".format(0.1 * (idx % 7)) for idx in range(100)]
+        grbl_stream = self.connection.stream(program)
+        for future in grbl_stream.futures:
+            self.assertEqual(future.result(10), "ok")
+        self.assertEqual(self.fake.rx_overflows, 0)
+
+    def test_wait_idle_sends_no_gcode_without_sync(self):
+        self.connection.send("$X").result(5)
+        self.connection.send("G90 G1 X5 Y0 F3000")
+        with mock.patch.object(self.connection, "send", side_effect=AssertionError("G-code sent.")):
+            self.assertTrue(self.connection.wait_idle((5, 0), timeout=10))
+        self.connection.send("G91 G1 X1 F3000")
+        self.assertTrue(self.connection.wait_idle(sync=True, timeout=10))
+        self.assertAlmostEqual(self.connection.plotter_state.snapshot()["position"][0], 6.0, places=2)
+
+    def test_answers_match_lines(self):
+        futures = [self.connection.send(line) for line in ["$X", "G90", "G38.2 X1", "G91", "G17", "G4 P0"]]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result(5))
+            except GrblError as e:
+                results.append(str(e))
+        self.assertEqual(results, ["ok", "ok", "error:20", "ok", "error:20", "ok"])
+
+    def test_reset_fails_unanswered_lines(self):
+        self.connection.send("$X").result(5)
+        self.connection.send("G90 G1 X50 F60")
+        future = self.connection.send("G4 P0")
+        time.sleep(0.1)
+        self.fake._write("Grbl 1.1h ['$' for help]")
+        with self.assertRaises(GrblError):
+            future.result(5)
+
+        # Garbled status reports are skipped, later lines are matched again.
+        self.fake._write("<Idle|WPos:1.0,")
+        self.fake._write("<Idle")
+        self.assertEqual(self.connection.send("G91").result(5), "ok")
+        self.assertTrue(self.connection.is_alive())
+
+    def test_closed_connection_fails_lines(self):
+        self.connection.port.close()
+        with self.assertRaises(GrblError):
+            self.connection.send("G4 P0").result(5)
+        for thread in self.connection._threads:
+            thread.join(5)
+        self.assertFalse(self.connection.is_alive())
+
+
+
+class CodecTests(SimpleTestCase):
+
+    def test_npz_round_trip(self):
+        wavelength, intensity, reference = synthetic_spectra(1)
+        Metadata = namedtuple("Metadata", ["scan_name", "pga"])
+        for results in [(wavelength, intensity[0], reference[0], Metadata("scan", 64)),
+                        {"wavelength": wavelength.tolist(), "intensity": intensity[0].tolist(),
+                         "reference": reference[0].tolist(), "scan_name": "scan", "pga": 64}]:
+            arrays = np.load(io.BytesIO(encode_npz(scan_results_to_arrays(results))))
+            np.testing.assert_array_equal(arrays["wavelength"], wavelength)
+            np.testing.assert_array_equal(arrays["intensity"], intensity[0])
+            self.assertEqual(arrays["intensity"].dtype, np.int32)
+            self.assertEqual((str(arrays["scan_name"]), int(arrays["pga"])), ("scan", 64))
+
+    def test_npz_is_little_endian(self):
+        arrays = np.load(io.BytesIO(encode_npz({"intensity": np.arange(4, dtype=">i4")})))
+        self.assertEqual(arrays["intensity"].dtype.str, "<i4")
+        np.testing.assert_array_equal(arrays["intensity"], np.arange(4))
+
+    def test_negotiation(self):
+        factory = RequestFactory()
+        arrays = {"ix": np.arange(3)}
+        response = arrays_response(factory.get("/", HTTP_ACCEPT=NPZ_CONTENT_TYPE), arrays)
+        self.assertEqual(response["Content-Type"], NPZ_CONTENT_TYPE)
+        np.testing.assert_array_equal(np.load(io.BytesIO(response.content))["ix"], arrays["ix"])
+
+        response = arrays_response(factory.get("/", HTTP_ACCEPT=NPZ_CONTENT_TYPE), arrays, "json")
+        self.assertEqual(json.loads(response.content), {"ix": [0, 1, 2]})
+
+class ViewTests(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.saved_image = NirsPlotterConfig.scanned_image
+        NirsPlotterConfig.scanned_image = new_image()
+
+    def tearDown(self):
+        NirsPlotterConfig.scanned_image = self.saved_image
+
+    def test_parse_index(self):
+        self.assertEqual(parse_index(None, 10), slice(None))
+        self.assertEqual(parse_index("3", 10), 3)
+        self.assertEqual(parse_index("2:5", 10), slice(2, 5))
+        self.assertEqual(parse_index(":5", 10), slice(None, 5))
+        for value in ["10", "-1", "a", "1:b", ""]:
+            with self.assertRaises(ValueError):
+                parse_index(value, 10)
+
+    def post_model(self, data):
+        request = self.factory.post("/plotter/model", json.dumps(data), content_type="application/json")
+        return pixel_model(request)
+
+    def test_failing_model_is_rejected(self):
+        image = NirsPlotterConfig.scanned_image
+        wavelength, intensity, reference = synthetic_spectra(1)
+        store_scan_results(image, 0, 0, {"wavelength": wavelength, "intensity": intensity[0],
+                                         "reference": reference[0]})
+
+        response = self.post_model({"name": "band_ratio", "params": {"band": [2000, 2100]}})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(image.model.name, "mean")
+        self.assertEqual(self.post_model({"name": "unknown"}).status_code, 400)
+
+        response = self.post_model({"name": "band_ratio", "params": {"band": [1280, 1320]}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["model"]["name"], "band_ratio")
+        self.assertTrue(np.isfinite(image.img[0, 0]))
+
+    def test_map_without_image(self):
+        request = self.factory.get("/plotter/map", {"renderer": "fast"})
+        NirsPlotterConfig.scanned_image = None
+        self.assertEqual(get_plotter_map(request).status_code, 503)
+
+        with mock.patch.object(NirsPlotterConfig, "hardware_client", True), \
+                mock.patch.object(NirsPlotterConfig, "shared_state") as shared_state, \
+                mock.patch("nirs_plotter.views.forward_request", return_value=HttpResponse("map")) as forward:
+            shared_state.read_image.return_value = None
+            self.assertEqual(get_plotter_map(request).content, b"map")
+        forward.assert_called_once_with(request)
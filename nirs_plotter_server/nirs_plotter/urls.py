@@ -6,15 +6,29 @@ urlpatterns = [
     path('plotter/', views.plotter_index, name="index"),
     path('plotter/buffer', views.get_serial_buffer, name='buffer'),
     path('plotter/state', views.get_plotter_state, name='state'),
+    path('plotter/wait', views.wait_plotter, name='wait'),
+    path('plotter/events', views.get_events, name='events'),
     path('plotter/write', views.write_plotter, name="write"),
+    path('plotter/stream', views.plotter_stream, name="stream"),
+    path('plotter/stream/<str:stream_id>', views.plotter_stream_progress, name="stream_progress"),
     path('plotter/image', views.get_plotter_map, name="image"),
     path('plotter/move', views.plotter_movement, name="move"),
     path('plotter/pixelsize', views.set_pixel_size, name="pixelsize"),
+    path('plotter/processing', views.set_processing, name="processing"),
+    path('plotter/model', views.pixel_model, name="model"),
+    path('plotter/pixels', views.get_pixels, name="pixels"),
     path('plotter/metadata', views.get_plotter_metadata, name="metadata"),
     path('plotter/unlock', views.unlock_plotter, name="unlock"),
     path('plotter/zero', views.set_zero_point, name="zero"),
     path('nirs/clearerror', views.clear_nirs_error_status, name="clearerror"),
     path('nirs/scan', views.nirs_scan, name="scan"),
+    path('nirs/scan/<str:job_id>', views.nirs_scan_result, name="scan_result"),
+    path('nirs/timing', views.nirs_timing, name="timing"),
     path('nirs/lamp', views.nirs_set_lamp_on_off, name="lamp"),
-    path('nirs/setdata', views.nirs_set_data, name="setdata")
+    path('nirs/setdata', views.nirs_set_data, name="setdata"),
+    path('raster/submit', views.raster_submit, name="raster_submit"),
+    path('raster/<str:job_id>', views.raster_progress, name="raster_progress"),
+    path('raster/<str:job_id>/cancel', views.raster_cancel, name="raster_cancel"),
+    path('sessions/', views.get_sessions, name="sessions"),
+    path('sessions/<str:session_id>/resume', views.session_resume, name="session_resume"),
 ]
@@ -2,24 +2,38 @@
 # Signal processing, machine learning, etc.
 
 import os
+import sys
+import json
+import time
 import pickle
-from nirs_plotter_server.settings import BASE_DIR
+import inspect
+import functools
+import threading
+from nirs_plotter_server.settings import BASE_DIR, NIRS_REFERENCE_DIR
+from .pixel_models import create_model
 import numpy as np
-from scipy.signal import savgol_filter, detrend, decimate
-import matplotlib as mlp
-import matplotlib.pyplot as plt
 
-mlp.use("Agg")
+sys.path.append(os.path.join(BASE_DIR, "../lib"))
+from NIRSignal.NIRSignal import invalid_to_nearest, moving_average, get_processing_plan, ProcessingPlan
+
+# Default of processing arguments, None means no processing.
+_DEFAULT = object()
 
 
 class NIRSImage:
     """Class for process and store recovered image."""
 
     def __init__(self, width, height, pixel_size_mm_x, pixel_size_mm_y, fig, ax, *,
-                 low_percentile=2, high_percentile=98):
-        """Init instance."""
+                 low_percentile=2, high_percentile=98, storage_dir=None, processing=None, model=None):
+        """Init instance.
+           If storage_dir is given, spectra and metadata are kept in memory-mapped .npy files there,
+           an existing session in storage_dir is resumed.
+           processing holds keyword arguments of NIRSignal.process_signals, None keeps raw intensity.
+           model is {"name": ..., "params": {...}} of a registered pixel model, mean over wavelengths by default.
+        """
 
         self.shape = (width, height)
+        self.storage_dir = storage_dir
         self.fig = fig
         self.ax = ax
 
@@ -38,31 +52,61 @@ class NIRSImage:
         self.set_figure(pixel_size_mm_x, pixel_size_mm_y, fig, ax)
 
         # Allocate memory.
+        resume = (storage_dir is not None) and os.path.exists(os.path.join(storage_dir, "session.json"))
+        self.processing = processing
+        self._plan = None
+        if model is None:
+            model = {"name": "mean"}
+        if resume:
+            with open(os.path.join(storage_dir, "session.json")) as f:
+                session = json.load(f)
+            self.processing = session.get("processing")
+            model = session.get("model", model)
+        elif storage_dir is not None:
+            os.makedirs(storage_dir, exist_ok=True)
+            with open(os.path.join(storage_dir, "session.json"), "w") as f:
+                json.dump({
+                    "shape": self.shape,
+                    "pixel_size_mm": {"x": pixel_size_mm_x, "y": pixel_size_mm_y},
+                    "created_time": time.time(),
+                    "processing": processing,
+                    "model": model,
+                }, f)
+        try:
+            self.model = create_model(model["name"], **model.get("params", {}))
+        except (TypeError, ValueError) as e:
+            print("[ERROR]: Pixel model unavailable ({}), using mean.".format(e))
+            self.model = create_model("mean")
+
         self.img = np.ones(self.shape) * -0xFFFFFFFF
-        self.scan_flags = np.zeros(self.shape, dtype=bool)
+        self.version = 0
+        self.scan_flags = self._new_array("scan_flags", self.shape, bool, False)
         self.change_flags = np.zeros(self.shape, dtype=bool)
-        self.all_data_raw = np.empty(self.shape, dtype=object)
-        self.all_data_processed = np.empty(self.shape, dtype=object)
-
-        # # Load reference spectrum.
-        # with open(os.path.join(BASE_DIR, "../data/reference/reference_spectrum"), "rb") as f:
-        #     reference_data = pickle.load(f)
-        #     self.wavelength_list = reference_data["wavelength_list"]
-        #     self.selected_indexes = reference_data["selected_indexes"]
-        #     self.reference_spectrum = reference_data["reference_spectrum"]
-
-        # # Signal parameters.
-        # # self._target_wavelength = 1142.79
-        # self._target_wavelength = 1302.71
-        # self._moving_average_window_size = 11
-        # self._decimal_factor = 1
 
-        # # Pre-calculate wavelength list after processing.
-        # self.wavelength_list_processed = self.wavelength_list[self.selected_indexes]
-        # self.wavelength_list_processed = self.wavelength_list_processed[::self._decimal_factor]
-
-        # # Pre-calculate index of target wavelength.
-        # self._idx_target_wavelength = np.nanargmin(np.abs(self.wavelength_list_processed - self._target_wavelength))
+        # Spectral cubes (width, height, n_wavelengths), allocated with the first spectrum.
+        self.wavelength = None
+        self.wavelength_processed = None
+        self.intensity = None
+        self.reference = None
+        self.processed = None
+
+        # Per-pixel metadata.
+        self.temperature_system = self._new_array("temperature_system", self.shape, np.float32, np.nan)
+        self.temperature_detector = self._new_array("temperature_detector", self.shape, np.float32, np.nan)
+        self.humidity = self._new_array("humidity", self.shape, np.float32, np.nan)
+        self.pga = self._new_array("pga", self.shape, np.int16, 0)
+        self.timestamp = self._new_array("timestamp", self.shape, np.float64, np.nan)
+
+        # Pixels changed since last parsing, the lock also guards cube allocation.
+        self._dirty_pixels = []
+        self._lock = threading.Lock()
+        self.num_scanned = int(np.count_nonzero(self.scan_flags))
+
+        # Reload stored spectra.
+        if resume and os.path.exists(os.path.join(storage_dir, "wavelength.npy")):
+            self._allocate_cube(np.load(os.path.join(storage_dir, "wavelength.npy")))
+            self._dirty_pixels = list(zip(*np.nonzero(self.scan_flags)))
+            self.train_model()
 
         # Image parameters.
         # Normalization percentile range.
@@ -131,9 +175,6 @@ class NIRSImage:
         ix, iy = (np.floor((wx - self.wx_min + 0.1) / self.pixel_size_mm_x),
                   np.floor((wy - self.wy_min + 0.1) / self.pixel_size_mm_y))
 
-        print(ix)
-        print(iy)
-
         return int(ix), int(iy)
 
     def _imagecoord2workcoord(self, ix, iy):
@@ -153,44 +194,7 @@ class NIRSImage:
     @staticmethod
     def _invalid_to_nearest(signal, copy=True):
         """ Repleace invalid values (nan/inf) to nearest valid values. """
-        # Init.
-        idx_left_valid = None
-        idx_right_valid = None
-        normal_state = np.isfinite(signal[0])
-
-        if copy:
-            new_signal = np.copy(signal)
-        else:
-            new_signal = signal
-
-        for idx, s in enumerate(signal):
-            # Looking for nan/inf.
-            if normal_state & (~np.isfinite(s)):
-                # Nan segment starts.
-                normal_state = False
-                idx_left_valid = idx - 1
-            elif (~normal_state) & np.isfinite(s):
-                # Nan segment ends.
-                normal_state = True
-                idx_right_valid = idx
-
-                # Fill-in non-valid segment.
-                if idx_left_valid is None:
-                    # Head-nan process.
-                    new_signal[:idx_right_valid] = signal[idx_right_valid]
-                else:
-                    # Find mid-point.
-                    idx_mid = int(np.ceil((idx_right_valid + idx_left_valid) / 2))
-
-                    # Fill-in, mid-point = right_valid
-                    new_signal[idx_left_valid + 1:idx_mid] = signal[idx_left_valid]
-                    new_signal[idx_mid:idx_right_valid] = signal[idx_right_valid]
-
-        # Tail process.
-        if not normal_state:
-            new_signal[idx_left_valid + 1:] = signal[idx_left_valid]
-
-        return new_signal
+        return invalid_to_nearest(signal, copy=copy)
 
     def normalize_array(self, input_arr, revert=True, mask=None):
         """ Robust normalization of an array. """
@@ -222,45 +226,257 @@ class NIRSImage:
 
     @staticmethod
     def _moving_average(signal, N):
-        from scipy.ndimage.filters import uniform_filter1d
         """ Moving average, nearest-padding, left-and-right. """
-        return uniform_filter1d(signal, size=N, mode="reflect")
+        return moving_average(signal, N)
 
-    def _preprocess(self, data_raw):
-        """Pre-process raw signals."""
+    def _plan_params(self, processing):
+        """Processing plan parameters, a "reference" file name is replaced by its reference spectrum
+           (interpolated to the wavelength axis if needed) and selected wavelengths.
+        """
+        params = dict(processing)
+        if "reference" in params:
+            # Loaded even before the first spectrum, to check that it exists.
+            reference = load_reference(params.pop("reference"))
+            if self.wavelength is not None:
+                if (len(reference["wavelength_list"]) == len(self.wavelength)) and \
+                        np.allclose(reference["wavelength_list"], self.wavelength):
+                    params.setdefault("reference_spectrum", reference["reference_spectrum"])
+                    params.setdefault("selected_indexes", reference["selected_indexes"])
+                else:
+                    params.setdefault("reference_spectrum", np.interp(
+                        self.wavelength, reference["wavelength_list"], reference["reference_spectrum"]))
+        return params
+
+    def get_plan(self, processing=_DEFAULT):
+        """Processing plan of the wavelength axis, current processing is used unless given.
+           None before the first spectrum or without processing. The current plan is kept until processing changes.
+        """
+        if processing is _DEFAULT:
+            if self._plan is None:
+                self._plan = self.get_plan(self.processing)
+            return self._plan
+        if (processing is None) or (self.wavelength is None):
+            return None
+
+        return get_processing_plan(self.wavelength, **self._plan_params(processing))
+
+    def _preprocess(self, raw_intensity, raw_reference, processing=_DEFAULT):
+        """Pre-process raw signals, one spectrum or a batch of (..., n_wavelengths).
+           Current processing is used unless given.
+        """
+        plan = self.get_plan(processing)
 
         # Get raw spectrum.
-        raw_intensity = np.array(data_raw["intensity"])
-        raw_reference = np.array(data_raw["reference"])
         processed = raw_intensity
 
-        # Add extra pre-processing steps here.
-
-        return np.array(processed)
+        if plan is not None:
+            processed = plan.apply(raw_intensity, raw_reference)
+
+        return np.array(processed, dtype=np.float32)
+
+    def _processed_wavelength(self, wavelength, processing):
+        """Wavelength axis of pre-processed spectra."""
+        if processing is None:
+            return np.array(wavelength)
+
+        return np.array(get_processing_plan(wavelength, **self._plan_params(processing)).wavelength)
+
+    def _new_array(self, name, shape, dtype, fill_value):
+        """Allocate an array, memory-mapped to storage if set. Existing stored arrays are reopened."""
+        if self.storage_dir is None:
+            return np.full(shape, fill_value, dtype=dtype)
+
+        path = os.path.join(self.storage_dir, name + ".npy")
+        if os.path.exists(path):
+            arr = np.load(path, mmap_mode="r+")
+            if arr.shape != tuple(shape):
+                raise ValueError("Stored {} has shape {}, expected {}.".format(name, arr.shape, tuple(shape)))
+            return arr
+
+        # A new file is zero already, writing zeros would touch every page.
+        arr = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=tuple(shape))
+        if fill_value != 0:
+            arr[...] = fill_value
+        return arr
+
+    def _replace_array(self, name, arr):
+        """Replace a stored array by writing a new file, mappings of the old one stay valid."""
+        if self.storage_dir is None:
+            return arr
+
+        path = os.path.join(self.storage_dir, name + ".npy")
+        stored = np.lib.format.open_memmap(path + ".tmp", mode="w+", dtype=arr.dtype, shape=arr.shape)
+        stored[...] = arr
+        stored.flush()
+        os.replace(path + ".tmp", path)
+        return stored
+
+    def _allocate_cube(self, wavelength):
+        """Allocate spectral cubes for the wavelength axis."""
+        n_wavelengths = len(wavelength)
+        self.wavelength = self._new_array("wavelength", (n_wavelengths,), np.float64, 0)
+        self.wavelength[:] = wavelength
+        self.intensity = self._new_array("intensity", self.shape + (n_wavelengths,), np.int32, 0)
+        self.reference = self._new_array("reference", self.shape + (n_wavelengths,), np.int32, 0)
+        self.wavelength_processed = self._processed_wavelength(wavelength, self.processing)
+        self.processed = self._new_array("processed", self.shape + (len(self.wavelength_processed),),
+                                         np.float32, np.nan)
+
+    def flush(self):
+        """Write memory-mapped arrays to storage."""
+        for arr in [self.scan_flags, self.wavelength, self.intensity, self.reference, self.processed,
+                    self.temperature_system, self.temperature_detector, self.humidity, self.pga, self.timestamp]:
+            if isinstance(arr, np.memmap):
+                arr.flush()
+
+    def set_pixel_arrays(self, idx_x, idx_y, wavelength, intensity, reference, *,
+                         temperature_system=np.nan, temperature_detector=np.nan, humidity=np.nan, pga=0,
+                         timestamp=None):
+        """Save and pre-process a spectrum for a pixel from arrays."""
+        with self._lock:
+            if self.wavelength is None:
+                self._allocate_cube(wavelength)
+        if len(wavelength) != len(self.wavelength):
+            raise ValueError("Spectrum length {} does not match image wavelength axis length {}.".format(
+                len(wavelength), len(self.wavelength)))
+
+        self.intensity[idx_x, idx_y] = intensity
+        self.reference[idx_x, idx_y] = reference
+        with self._lock:
+            self.processed[idx_x, idx_y] = self._preprocess(intensity, reference)
+        self.temperature_system[idx_x, idx_y] = temperature_system
+        self.temperature_detector[idx_x, idx_y] = temperature_detector
+        self.humidity[idx_x, idx_y] = humidity
+        self.pga[idx_x, idx_y] = pga
+        self.timestamp[idx_x, idx_y] = time.time() if timestamp is None else timestamp
 
-    def set_pixel_data(self, idx_x, idx_y, data_raw):
-        """Save and pre-process a spectrum for a pixel."""
-        self.all_data_raw[idx_x, idx_y] = data_raw
-        self.all_data_processed[idx_x, idx_y] = self._preprocess(data_raw)
         self.change_flags[idx_x, idx_y] = True
-        self.scan_flags[idx_x, idx_y] = True
-
-    def parse_all_pixels(self):
-        """Parse all stored spectra into pixels."""
-        # TODO: Replace model.
+        with self._lock:
+            if not self.scan_flags[idx_x, idx_y]:
+                self.num_scanned += 1
+            self.scan_flags[idx_x, idx_y] = True
+            self._dirty_pixels.append((idx_x, idx_y))
+
+    def set_processing(self, processing, chunk_size=10000):
+        """Change pre-processing and re-process all scanned spectra, in vectorized batches of chunk_size.
+           The model is fitted again, all scanned pixels are parsed again with the next parse_all_pixels call.
+           Invalid parameters raise TypeError / ValueError / IndexError and leave the image unchanged.
+        """
+        with self._lock:
+            if processing is not None:
+                inspect.signature(ProcessingPlan).bind(None, **self._plan_params(processing))
+
+            if self.wavelength is not None:
+                wavelength_processed = self._processed_wavelength(self.wavelength, processing)
+                processed = np.full(self.shape + (len(wavelength_processed),), np.nan, dtype=np.float32)
+                idx_x, idx_y = np.nonzero(self.scan_flags)
+                for start in range(0, len(idx_x), chunk_size):
+                    chunk = (idx_x[start:start + chunk_size], idx_y[start:start + chunk_size])
+                    processed[chunk] = self._preprocess(self.intensity[chunk], self.reference[chunk], processing)
+
+                self.wavelength_processed = wavelength_processed
+                self.processed = self._replace_array("processed", processed)
+                self._plan = None
+
+            self.processing = processing
+            self._update_session(processing=processing)
+            self._fit_model()
+
+    def _update_session(self, **fields):
+        """Update fields of the stored session information."""
+        if self.storage_dir is None:
+            return
 
-        for idx_y in range(self.all_data_processed.shape[1]):
-            for idx_x in range(self.all_data_processed.shape[0]):
+        session_file = os.path.join(self.storage_dir, "session.json")
+        with open(session_file) as f:
+            session = json.load(f)
+        session.update(fields)
+        with open(session_file, "w") as f:
+            json.dump(session, f)
 
-                if self.change_flags[idx_x, idx_y]:
-                    data_processed = self.all_data_processed[idx_x, idx_y]
+    def set_pixel_data(self, idx_x, idx_y, data_raw):
+        """Save and pre-process a spectrum for a pixel from scan results."""
+        self.set_pixel_arrays(idx_x, idx_y, data_raw["wavelength"], data_raw["intensity"], data_raw["reference"],
+                              temperature_system=data_raw.get("temperature_system", np.nan),
+                              temperature_detector=data_raw.get("temperature_detector", np.nan),
+                              humidity=data_raw.get("humidity", np.nan),
+                              pga=data_raw.get("pga", 0))
+
+    def get_pixel_data(self, idx_x, idx_y):
+        """Get stored spectrum of a pixel as scan results, None if not scanned."""
+        if not self.scan_flags[idx_x, idx_y]:
+            return None
+
+        return {
+            "temperature_system": float(self.temperature_system[idx_x, idx_y]),
+            "temperature_detector": float(self.temperature_detector[idx_x, idx_y]),
+            "humidity": float(self.humidity[idx_x, idx_y]),
+            "pga": int(self.pga[idx_x, idx_y]),
+            "timestamp": float(self.timestamp[idx_x, idx_y]),
+            "wavelength": self.wavelength.tolist(),
+            "intensity": self.intensity[idx_x, idx_y].tolist(),
+            "reference": self.reference[idx_x, idx_y].tolist(),
+            "valid_length": len(self.wavelength),
+        }
+
+    def get_pixel_arrays(self, idx_x=slice(None), idx_y=slice(None)):
+        """Get stored spectra and metadata of the scanned pixels in a region, as arrays over pixels.
+           idx_x and idx_y are image coordinates, integers or slices. Spectra are empty if nothing is scanned.
+        """
+        region = np.zeros(self.shape, dtype=bool)
+        region[idx_x, idx_y] = True
+        ix, iy = np.nonzero(self.scan_flags & region)
 
-                    # Get pixel data.
-                    pixel_data = np.mean(data_processed)
-                    print("{}, {}: {}".format(idx_x, idx_y, pixel_data))
+        if self.wavelength is None:
+            wavelength = np.zeros(0)
+            intensity = reference = np.zeros((len(ix), 0), dtype=np.int32)
+        else:
+            wavelength, intensity, reference = self.wavelength, self.intensity[ix, iy], self.reference[ix, iy]
+
+        return {
+            "ix": ix,
+            "iy": iy,
+            "temperature_system": self.temperature_system[ix, iy],
+            "temperature_detector": self.temperature_detector[ix, iy],
+            "humidity": self.humidity[ix, iy],
+            "pga": self.pga[ix, iy],
+            "timestamp": self.timestamp[ix, iy],
+            "wavelength": np.asarray(wavelength),
+            "intensity": intensity,
+            "reference": reference,
+        }
 
-                    self.img[idx_x, idx_y] = pixel_data
-                    self.change_flags[idx_x, idx_y] = False
+    def parse_all_pixels(self):
+        """Parse changed spectra into pixels, cost is proportional to the number of changed pixels.
+           Returns image coordinates (idx_x, idx_y) of the updated pixels.
+        """
+        # Take over the dirty pixels.
+        with self._lock:
+            # Unfitted models are fitted once, when enough spectra are scanned.
+            if self.model.needs_fit and (self.num_scanned >= self.model.min_samples):
+                self._fit_model()
+            dirty_pixels, self._dirty_pixels = self._dirty_pixels, []
+        if len(dirty_pixels) == 0:
+            return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+
+        # Remove duplicates.
+        idx_x, idx_y = np.unravel_index(
+            np.unique(np.ravel_multi_index(tuple(np.array(dirty_pixels).T), self.shape)), self.shape)
+
+        # Reduce all changed spectra in one batch, on failure they are parsed again next time.
+        try:
+            pixel_data = self.model.predict(np.asarray(self.processed[idx_x, idx_y], dtype=float),
+                                            self.wavelength_processed)
+        except Exception:
+            with self._lock:
+                self._dirty_pixels.extend(dirty_pixels)
+            raise
+
+        self.img[idx_x, idx_y] = pixel_data
+        self.change_flags[idx_x, idx_y] = False
+        self.version += 1
+
+        return idx_x, idx_y
 
     def get_image(self):
         """Return image array.
@@ -285,5 +501,78 @@ class NIRSImage:
         """
         return self.img.transpose()
 
+    def _fit_model(self):
+        """Fit the model to all scanned spectra and parse all of them again, call with the lock held."""
+        if self.processed is None:
+            return
+
+        idx_x, idx_y = np.nonzero(self.scan_flags)
+        self.model.fit(np.asarray(self.processed[idx_x, idx_y], dtype=float), self.wavelength_processed)
+        self._dirty_pixels.extend(zip(idx_x, idx_y))
+
     def train_model(self):
-        pass
+        """Fit the model to all scanned spectra, the image is updated with the next parse_all_pixels call."""
+        with self._lock:
+            self._fit_model()
+
+    def _check_model(self, model):
+        """Fit a new model to all scanned spectra and try it on one, call with the lock held.
+           Raises ValueError if it fails on the current wavelength axis.
+        """
+        if self.processed is None:
+            return
+
+        idx_x, idx_y = np.nonzero(self.scan_flags)
+        spectra = np.asarray(self.processed[idx_x, idx_y], dtype=float)
+        probe = spectra[:1] if len(spectra) > 0 else np.zeros((1, len(self.wavelength_processed)))
+        try:
+            model.fit(spectra, self.wavelength_processed)
+            model.predict(probe, self.wavelength_processed)
+        except Exception as e:
+            raise ValueError("Model fails on the current spectra: {}".format(e))
+
+    def set_model(self, name, **params):
+        """Replace the pixel model, the whole image is updated with the next parse_all_pixels call.
+           Raises ValueError for unknown models or models failing on the current spectra,
+           TypeError for invalid parameters. The current model is kept on errors.
+        """
+        model = create_model(name, **params)
+        with self._lock:
+            self._check_model(model)
+            self.model = model
+            self._update_session(model=model.to_dict())
+            self._dirty_pixels.extend(zip(*np.nonzero(self.scan_flags)))
+
+
+@functools.lru_cache(maxsize=8)
+def load_reference(file_name):
+    """Load reference data from NIRS_REFERENCE_DIR once, shared by all images.
+       Returns a dict of read-only wavelength_list, selected_indexes and reference_spectrum arrays.
+    """
+    path = os.path.join(NIRS_REFERENCE_DIR, os.path.basename(file_name))
+    if not os.path.isfile(path):
+        raise ValueError("Reference not found: {}.".format(file_name))
+
+    with open(path, "rb") as f:
+        reference_data = pickle.load(f)
+
+    reference = {}
+    for key in ["wavelength_list", "selected_indexes", "reference_spectrum"]:
+        reference[key] = np.array(reference_data[key])
+        reference[key].setflags(write=False)
+    return reference
+
+
+def open_session(storage_dir, mode="r"):
+    """Open a stored scan session without loading it into memory.
+       Returns session information and a dict of memory-mapped arrays.
+    """
+    with open(os.path.join(storage_dir, "session.json")) as f:
+        session = json.load(f)
+
+    arrays = {}
+    for file_name in os.listdir(storage_dir):
+        if file_name.endswith(".npy"):
+            arrays[file_name[:-len(".npy")]] = np.load(os.path.join(storage_dir, file_name), mmap_mode=mode)
+
+    return session, arrays
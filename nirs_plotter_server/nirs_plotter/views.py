@@ -1,14 +1,22 @@
 import os
 import json
 import time
+import queue
 import numpy as np
 
 from nirs_plotter_server.settings import BASE_DIR
 from django.shortcuts import render_to_response
-from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, HttpResponseNotFound, \
+    HttpResponseServerError, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from .apps import NirsPlotterConfig, set_new_pixel_size_mm
+from .apps import NirsPlotterConfig, set_new_pixel_size_mm, submit_raster_job, list_sessions, resume_session, \
+    update_image, submit_scan_job, current_plotter_state, current_image, get_image_renderer, \
+    wait_plotter_state
 from .utils import NIRSImage
+from .pixel_models import MODELS
+from .render import construct_fast_image_response
+from .codec import FORMATS, wants_npz, scan_results_to_arrays, arrays_to_json, arrays_response
+from .ipc import forward_request
 
 
 def plotter_index(request):
@@ -18,25 +26,77 @@ def plotter_index(request):
 
 def get_serial_buffer(request):
     """Get all current serial buffer data and clear the buffer."""
-    with NirsPlotterConfig.serial_lock:
-        buffer = list(NirsPlotterConfig.serial_buffer.queue)
-        NirsPlotterConfig.serial_buffer.queue.clear()
     return JsonResponse({
-        "data": buffer
+        "data": NirsPlotterConfig.plotter.drain_buffer()
     })
 
 
 def get_plotter_map(request):
-    """Draw plotter figure and return the image."""
+    """Draw plotter figure and return the image.
+       Use renderer=fast for the Matplotlib-free renderer (map only, without axes).
+       Web workers render from shared memory without asking the hardware daemon, until it publishes an image.
+    """
+    image, plotter_state = current_image(), current_plotter_state()
+    if image is None:
+        # No image published yet, the hardware daemon may have just started.
+        if NirsPlotterConfig.hardware_client:
+            return forward_request(request)
+        return HttpResponse("No image yet.", status=503)
+
+    if request.GET.get("renderer", "matplotlib") == "fast":
+        return construct_fast_image_response(request, image, plotter_state)
+
     with NirsPlotterConfig.generator_lock:
-        response = next(NirsPlotterConfig.image_response_generator)
+        response = get_image_renderer(image).get_response(request, plotter_state)
+    return response
+
+
+def get_events(request):
+    """Stream plotter state, scan completion and pixel updates as Server-Sent Events."""
+    initial_events = [("metadata", NirsPlotterConfig.metadata),
+                      ("state", NirsPlotterConfig.plotter_state.snapshot())]
+    response = StreamingHttpResponse(NirsPlotterConfig.event_broker.stream(initial_events),
+                                     content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    response["Access-Control-Allow-Origin"] = "*"
     return response
 
 
 def get_plotter_state(request):
-    """Get the plotter state and position."""
-    with NirsPlotterConfig.serial_lock:
-        return JsonResponse(NirsPlotterConfig.plotter_state)
+    """Get the plotter state and position, with its sequence number (seq) and time.
+       Query parameters: after (seq, optional) long-polls until a newer state, timeout (second, at most 60).
+       The current state is returned on timeout.
+    """
+    if "after" not in request.GET:
+        return JsonResponse(current_plotter_state())
+
+    try:
+        seq = int(request.GET["after"])
+        timeout = min(float(request.GET.get("timeout", 30)), 60)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid after or timeout.")
+
+    return JsonResponse(wait_plotter_state(seq, timeout))
+
+
+def wait_plotter(request):
+    """Long-poll until the plotter reports idle, read-only: nothing is queued to the plotter.
+       Query parameters: x, y (target position, optional), tol (millimeter), timeout (second, at most 60).
+    """
+    try:
+        position = None
+        if ("x" in request.GET) and ("y" in request.GET):
+            position = (float(request.GET["x"]), float(request.GET["y"]))
+        tol = float(request.GET.get("tol", 0.05))
+        timeout = min(float(request.GET.get("timeout", 30)), 60)
+    except ValueError:
+        return HttpResponseBadRequest("Invalid position, tol or timeout.")
+
+    reached = NirsPlotterConfig.plotter.wait_idle(position, tol=tol, timeout=timeout)
+    response = JsonResponse({"reached": reached, **NirsPlotterConfig.plotter_state.snapshot()})
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
 
 
 def get_plotter_metadata(request):
@@ -61,17 +121,54 @@ def write_plotter(request):
         command = data["command"].encode()
 
         # Execute.
-        with NirsPlotterConfig.serial_lock:
-            NirsPlotterConfig.serial_port.write(command)
+        NirsPlotterConfig.plotter.send(command)
         return HttpResponse("")
     else:
         return HttpResponseBadRequest("Only POST method is accepted.")
 
 
+@csrf_exempt
+def plotter_stream(request):
+    """Stream a G-code program, keeping the controller's planner full.
+       Accepts {"program": "..."} or {"commands": ["...", ...]}, progress at plotter/stream/<stream_id>.
+    """
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+        except json.decoder.JSONDecodeError as e:
+            return HttpResponseBadRequest("JSON format error.")
+
+        if "program" in data:
+            program = data["program"]
+        elif "commands" in data:
+            program = data["commands"]
+        else:
+            return HttpResponseBadRequest("Missing program or commands.")
+
+        # Execute.
+        grbl_stream = NirsPlotterConfig.plotter.stream(program)
+        NirsPlotterConfig.plotter_streams[grbl_stream.stream_id] = grbl_stream
+
+        response = JsonResponse(grbl_stream.to_dict())
+        response["Access-Control-Allow-Origin"] = "*"
+        return response
+    else:
+        return HttpResponseBadRequest("Only POST method is accepted.")
+
+
+def plotter_stream_progress(request, stream_id):
+    """Get per-line completion of a streamed program."""
+    if stream_id not in NirsPlotterConfig.plotter_streams:
+        return HttpResponseNotFound("Unknown stream: {}.".format(stream_id))
+
+    response = JsonResponse(NirsPlotterConfig.plotter_streams[stream_id].to_dict())
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
 def unlock_plotter(request):
     """Unlock the plotter."""
-    with NirsPlotterConfig.serial_lock:
-        NirsPlotterConfig.serial_port.write("$X\n".encode())
+    NirsPlotterConfig.plotter.send("$X\n")
 
     response = HttpResponse("")
     response["Access-Control-Allow-Origin"] = "*"
@@ -103,6 +200,71 @@ def set_pixel_size(request):
     else:
         return HttpResponseBadRequest("Only POST method is accepted.")
 
+@csrf_exempt
+def set_processing(request):
+    """Set spectrum pre-processing of the current image and re-process all scanned pixels.
+       "processing" holds keyword arguments of NIRSignal.process_signals, null for raw intensity.
+    """
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+        except json.decoder.JSONDecodeError as e:
+            return HttpResponseBadRequest("JSON format error.")
+
+        if ("processing" not in data) or not isinstance(data["processing"], (dict, type(None))):
+            return HttpResponseBadRequest("JSON format error.")
+
+        image = NirsPlotterConfig.scanned_image
+        start_time = time.perf_counter()
+        try:
+            image.set_processing(data["processing"])
+        except (TypeError, ValueError, IndexError) as e:
+            return HttpResponseBadRequest("Invalid processing: {}".format(e))
+        update_image(image, NirsPlotterConfig.event_broker)
+
+        response = JsonResponse({
+            "processing": image.processing,
+            "num_pixels": int(np.count_nonzero(image.scan_flags)),
+            "elapsed_s": time.perf_counter() - start_time,
+        })
+        response["Access-Control-Allow-Origin"] = "*"
+        return response
+    else:
+        return HttpResponseBadRequest("Only POST method is accepted.")
+
+@csrf_exempt
+def pixel_model(request):
+    """Get the pixel model of the current image and available models (GET),
+       or replace it and re-render the whole image (POST {"name": ..., "params": {...}}).
+    """
+    image = NirsPlotterConfig.scanned_image
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+        except json.decoder.JSONDecodeError as e:
+            return HttpResponseBadRequest("JSON format error.")
+
+        if ("name" not in data) or not isinstance(data.get("params", {}), dict):
+            return HttpResponseBadRequest("JSON format error.")
+
+        start_time = time.perf_counter()
+        try:
+            image.set_model(data["name"], **data.get("params", {}))
+        except (TypeError, ValueError) as e:
+            return HttpResponseBadRequest("Invalid model: {}".format(e))
+        update_image(image, NirsPlotterConfig.event_broker)
+        elapsed_s = time.perf_counter() - start_time
+    else:
+        elapsed_s = None
+
+    response = JsonResponse({
+        "model": image.model.to_dict(),
+        "available": sorted(MODELS),
+        "elapsed_s": elapsed_s,
+    })
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
+
 @csrf_exempt
 def set_zero_point(request):
     """Set current position as zero position."""
@@ -127,8 +289,7 @@ def set_zero_point(request):
             command += " Z0"
         command += "\n"
 
-        with NirsPlotterConfig.serial_lock:
-            NirsPlotterConfig.serial_port.write(command.encode())
+        NirsPlotterConfig.plotter.send(command)
         response = HttpResponse("")
         response["Access-Control-Allow-Origin"] = "*"
         return response
@@ -156,13 +317,9 @@ def plotter_movement(request):
         if move_type == "incremental":
             command = "G91 G1 G21 "
             # Wait until idle if incremental movement.
-            while True:
-                with NirsPlotterConfig.serial_lock:
-                    if NirsPlotterConfig.plotter_state["state"].lower() == "idle":
-                        relative_point = NirsPlotterConfig.plotter_state["position"]
-                        break
-                    else:
-                        time.sleep(0.2)
+            if not NirsPlotterConfig.plotter.wait_idle(sync=True, timeout=60):
+                return HttpResponseBadRequest("Plotter did not become idle.")
+            relative_point = NirsPlotterConfig.plotter_state.snapshot()["position"]
 
         elif move_type == "absolute":
             command = "G90 G1 G21 "
@@ -170,20 +327,21 @@ def plotter_movement(request):
             return HttpResponseBadRequest(
                 "Unknown movement type: {}. Acceptable types: incremental, absolute.".format(move_type))
 
+        targeting = {}
         if "x" in position:
             command += "X{:.1f} ".format(position["x"])
-            NirsPlotterConfig.plotter_state["targeting"][0] = position["x"] + relative_point[0]
+            targeting["x"] = position["x"] + relative_point[0]
         if "y" in position:
             command += "Y{:.1f} ".format(position["y"])
-            NirsPlotterConfig.plotter_state["targeting"][1] = position["y"] + relative_point[1]
+            targeting["y"] = position["y"] + relative_point[1]
         if "z" in position:
             command += "Z{:.1f} ".format(position["z"])
-            NirsPlotterConfig.plotter_state["targeting"][2] = position["z"] + relative_point[2]
+            targeting["z"] = position["z"] + relative_point[2]
         command += "F{:d}\n".format(feed)
+        NirsPlotterConfig.plotter_state.set_targeting(**targeting)
 
         # Execute.
-        with NirsPlotterConfig.serial_lock:
-            NirsPlotterConfig.serial_port.write(command.encode())
+        NirsPlotterConfig.plotter.send(command)
 
         response = HttpResponse("")
         response["Access-Control-Allow-Origin"] = "*"
@@ -195,13 +353,16 @@ def plotter_movement(request):
 @csrf_exempt
 def clear_nirs_error_status(request):
     """Reset NIRS error status."""
-    NirsPlotterConfig.nirs.clear_error_status()
+    NirsPlotterConfig.scanner.call("clear_error_status")
     return HttpResponse("")
 
 
 @csrf_exempt
 def nirs_scan(request):
-    """Take a NIRS scan and return the spectrum."""
+    """Queue a NIRS scan at the current position and return a job ticket.
+       With "wait": true, block until done and return the spectrum,
+       as .npz with "format": "npz" or an Accept: application/x-npz header.
+    """
     if request.method == "POST":
         try:
             data = json.loads(request.body)
@@ -213,30 +374,104 @@ def nirs_scan(request):
 
         num_repeats = data["num_repeats"]
         # Set PGA gain if required.
-        if "pga_gain" in data:
-            pga_gain = int(data["pga_gain"])
-            NirsPlotterConfig.nirs.set_pga_gain(pga_gain)
+        pga_gain = int(data["pga_gain"]) if "pga_gain" in data else None
+        if data.get("format") not in FORMATS + [None]:
+            return HttpResponseBadRequest("Unsupported format.")
+        binary = wants_npz(request, data.get("format"))
 
         # Scan.
-        NirsPlotterConfig.nirs.scan(num_repeats)
-
-        # Get data.
-        results = NirsPlotterConfig.nirs.get_scan_results()
-
-        # Update image.
-        wx, wy, _ = NirsPlotterConfig.plotter_state["position"]
-        ix, iy = NirsPlotterConfig.scanned_image._workcoord2imagecoord(wx, wy)
-        NirsPlotterConfig.scanned_image.set_pixel_data(ix, iy, results)
-        NirsPlotterConfig.scanned_image.parse_all_pixels()
+        try:
+            job = submit_scan_job(num_repeats, pga_gain, as_arrays=binary)
+        except queue.Full:
+            response = HttpResponse("Scanner queue is full.", status=503)
+            response["Retry-After"] = "1"
+            return response
 
-        return JsonResponse({
-            "data": results,
-        })
+        if data.get("wait", False):
+            job.wait()
+            if job.state == "error":
+                return HttpResponseServerError(job.message)
+            if binary:
+                return arrays_response(request, scan_results_to_arrays(job.results), "npz")
+            return JsonResponse({
+                "data": job.results,
+            })
+
+        response = JsonResponse(job.to_dict(), status=202)
+        response["Access-Control-Allow-Origin"] = "*"
+        return response
 
     else:
         return HttpResponseBadRequest("Only POST method is accepted.")
 
 
+def nirs_scan_result(request, job_id):
+    """Get a scan job, with the spectrum once done.
+       Query parameter wait (second, at most 60) long-polls until done.
+       Once done, the spectrum alone is returned as .npz with format=npz or an Accept: application/x-npz header.
+    """
+    if job_id not in NirsPlotterConfig.scan_jobs:
+        return HttpResponseNotFound("Unknown job: {}.".format(job_id))
+    if request.GET.get("format") not in FORMATS + [None]:
+        return HttpResponseBadRequest("Unsupported format.")
+
+    job = NirsPlotterConfig.scan_jobs[job_id]
+    try:
+        job.wait(min(float(request.GET.get("wait", 0)), 60))
+    except ValueError:
+        return HttpResponseBadRequest("Invalid wait.")
+
+    if (job.state == "done") and wants_npz(request, request.GET.get("format")):
+        return arrays_response(request, scan_results_to_arrays(job.results), "npz")
+
+    job_dict = job.to_dict()
+    if (job.state == "done") and ("data" not in job_dict):
+        job_dict["data"] = arrays_to_json(scan_results_to_arrays(job.results))
+    response = JsonResponse(job_dict)
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+def parse_index(value, size):
+    """Image index from a query parameter, an integer or "start:stop" (either may be empty), all if None.
+       Raises ValueError if invalid or out of range.
+    """
+    if value is None:
+        return slice(None)
+    if ":" in value:
+        start, stop = value.split(":", 1)
+        return slice(int(start) if start else None, int(stop) if stop else None)
+
+    index = int(value)
+    if not 0 <= index < size:
+        raise ValueError("Index out of range: {}.".format(index))
+    return index
+
+
+def get_pixels(request):
+    """Get stored spectra and metadata of scanned pixels, as .npz or JSON lists.
+       Query parameters ix and iy select a region (integer or "start:stop"), format is json or npz
+       (default by the Accept header).
+    """
+    image = NirsPlotterConfig.scanned_image
+    try:
+        idx_x = parse_index(request.GET.get("ix"), image.shape[0])
+        idx_y = parse_index(request.GET.get("iy"), image.shape[1])
+    except ValueError:
+        return HttpResponseBadRequest("Invalid pixel index.")
+    if request.GET.get("format") not in FORMATS + [None]:
+        return HttpResponseBadRequest("Unsupported format.")
+
+    return arrays_response(request, image.get_pixel_arrays(idx_x, idx_y), request.GET.get("format"))
+
+
+def nirs_timing(request):
+    """Mean and max time per scan stage of recent scans, and the stage group bounding throughput."""
+    response = JsonResponse(NirsPlotterConfig.scanner.stage_timings())
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
 @csrf_exempt
 def nirs_set_lamp_on_off(request):
     """Keep the lamp on / off."""
@@ -249,7 +484,7 @@ def nirs_set_lamp_on_off(request):
         new_value = int(data["keep_lamp_on_off"])
 
         # Set lamp on / off.
-        NirsPlotterConfig.nirs.set_lamp_on_off(new_value)
+        NirsPlotterConfig.scanner.call("set_lamp_on_off", new_value)
 
         return HttpResponse("")
 
@@ -259,20 +494,23 @@ def nirs_set_lamp_on_off(request):
 
 @csrf_exempt
 def nirs_set_data(request):
-    """Set data for current pixel for drawing."""
+    """Set data for a pixel (ix, iy, data) or a batch of pixels (pixels: [{ix, iy, data}, ...]) for drawing."""
     if request.method == "POST":
         try:
             data = json.loads(request.body)
         except json.decoder.JSONDecodeError as e:
             return HttpResponseBadRequest("JSON format error.")
 
-        # Get spectrum.
-        scan_data = data["data"]
-        ix, iy = data["ix"], data["iy"]
+        # Get spectra, either a single pixel or a batch of pixels.
+        if "pixels" in data:
+            all_pixels = data["pixels"]
+        else:
+            all_pixels = [data]
 
-        # Update image.
-        NirsPlotterConfig.scanned_image.set_pixel_data(ix, iy, scan_data)
-        NirsPlotterConfig.scanned_image.parse_all_pixels()
+        # Update image, parse once for the whole batch.
+        for pixel in all_pixels:
+            NirsPlotterConfig.scanned_image.set_pixel_data(pixel["ix"], pixel["iy"], pixel["data"])
+        update_image(NirsPlotterConfig.scanned_image, NirsPlotterConfig.event_broker)
 
         return HttpResponse("")
 
@@ -280,4 +518,80 @@ def nirs_set_data(request):
         return HttpResponseBadRequest("Only POST method is accepted.")
 
 
+@csrf_exempt
+def raster_submit(request):
+    """Submit a server-side raster scan job over a workspace region."""
+    if request.method == "POST":
+        try:
+            data = json.loads(request.body)
+        except json.decoder.JSONDecodeError as e:
+            return HttpResponseBadRequest("JSON format error.")
+
+        # Get data fields.
+        region = data["region"]
+        if not (("x" in region) and ("y" in region)):
+            return HttpResponseBadRequest("JSON format error.")
+
+        # Change pixel size if required.
+        if "pixel_size" in data:
+            set_new_pixel_size_mm(data["pixel_size"])
+
+        job = submit_raster_job(region["x"], region["y"],
+                                num_repeats=int(data.get("num_repeats", 1)),
+                                pga_gain=int(data["pga_gain"]) if "pga_gain" in data else None,
+                                feed=int(data.get("feed", 1000)),
+                                skip_scanned=bool(data.get("skip_scanned", False)))
+
+        response = JsonResponse(job.to_dict())
+        response["Access-Control-Allow-Origin"] = "*"
+        return response
+    else:
+        return HttpResponseBadRequest("Only POST method is accepted.")
+
+
+def raster_progress(request, job_id):
+    """Get progress of a raster job."""
+    if job_id not in NirsPlotterConfig.raster_jobs:
+        return HttpResponseNotFound("Unknown job: {}.".format(job_id))
+
+    response = JsonResponse(NirsPlotterConfig.raster_jobs[job_id].to_dict())
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
+
+
+@csrf_exempt
+def raster_cancel(request, job_id):
+    """Cancel a pending or running raster job."""
+    if request.method == "POST":
+        if job_id not in NirsPlotterConfig.raster_jobs:
+            return HttpResponseNotFound("Unknown job: {}.".format(job_id))
+
+        job = NirsPlotterConfig.raster_jobs[job_id]
+        job.cancel()
+
+        return JsonResponse(job.to_dict())
+    else:
+        return HttpResponseBadRequest("Only POST method is accepted.")
+
+
+def get_sessions(request):
+    """List stored scan sessions."""
+    response = JsonResponse({"sessions": list_sessions()})
+    response["Access-Control-Allow-Origin"] = "*"
+    return response
 
+
+@csrf_exempt
+def session_resume(request, session_id):
+    """Reopen a stored scan session, raster jobs with skip_scanned then continue it."""
+    if request.method == "POST":
+        if session_id not in [session["session_id"] for session in list_sessions()]:
+            return HttpResponseNotFound("Unknown session: {}.".format(session_id))
+
+        resume_session(session_id)
+
+        response = JsonResponse(NirsPlotterConfig.metadata)
+        response["Access-Control-Allow-Origin"] = "*"
+        return response
+    else:
+        return HttpResponseBadRequest("Only POST method is accepted.")
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'nirs_plotter.ipc.HardwareProxyMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -119,3 +120,51 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/2.2/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Hardware backends: "hardware" or "simulated".
+# Simulated backends run without the NIRScan Nano and the plotter, e.g. for load testing.
+NIRS_SCANNER_BACKEND = os.environ.get("NIRS_SCANNER_BACKEND", "hardware")
+NIRS_PLOTTER_BACKEND = os.environ.get("NIRS_PLOTTER_BACKEND", "hardware")
+
+# Unix socket of the hardware owner daemon (manage.py hardwared), None to own the hardware in this process.
+# Processes with the socket set are web workers forwarding requests to the daemon and open no hardware,
+# except the daemon itself (see NirsPlotterConfig.hardware_client).
+NIRS_HARDWARE_SOCKET = os.environ.get("NIRS_HARDWARE_SOCKET")
+
+# Shared memory of the hardware daemon, where web workers read the image and the plotter state.
+NIRS_SHARED_MEMORY_NAME = os.environ.get("NIRS_SHARED_MEMORY_NAME", "nirs_plotter")
+
+# Interval of plotter status reports, in second.
+NIRS_PLOTTER_STATUS_INTERVAL_S = 0.1
+# Time for the plotter controller to boot after the port opens (Arduino boards reset on open).
+NIRS_PLOTTER_READY_TIMEOUT_S = 5.0
+
+# Scanned images are stored here as memory-mapped sessions if set, e.g. os.path.join(BASE_DIR, "sessions").
+# Off by default, every start and pixel size change creates a new session which is never removed.
+NIRS_SESSION_DIR = os.environ.get("NIRS_SESSION_DIR")
+
+# Spectrum pre-processing of new sessions, keyword arguments of NIRSignal.process_signals, None for raw intensity.
+NIRS_SIGNAL_PROCESSING = None
+
+# Pixel model of new sessions, a model registered in nirs_plotter.pixel_models with its parameters.
+NIRS_PIXEL_MODEL = {"name": "mean", "params": {}}
+
+# Pickled regression models are loaded from here.
+NIRS_MODEL_DIR = os.path.join(BASE_DIR, "../data/models")
+
+# Reference spectra for absorbance processing ({"reference": file name}) are loaded from here.
+NIRS_REFERENCE_DIR = os.path.join(BASE_DIR, "../data/reference")
+
+# Simulated scanner and plotter parameters.
+NIRS_SIMULATED_SCANNER = {
+    "scan_latency_s": 0.35,
+    "repeat_latency_s": 0.05,
+    "readout_latency_s": 0.15,
+    "noise_level": 0.01,
+    "temperature_drift_per_min": 0.05,
+}
+NIRS_SIMULATED_PLOTTER = {
+    "max_feed_mm_min": 3000,
+    "speed_factor": 1.0,
+}